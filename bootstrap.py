@@ -0,0 +1,138 @@
+"""
+Bootstrap standard errors for the state polling averages.
+
+Two levels are resampled: the polls within each (state, pollster) and the
+pollsters within each state. Rather than rerunning the groupby once per
+replicate, every replicate is a row of multinomial counts, and the
+weighted sums of all replicates come out of two matrix products with a
+sparse poll -> group indicator. The MESS and time weights of each poll are
+kept as computed on the full data; the bootstrap reweights polls, it
+doesn't recompute the cumulative sample sizes.
+
+Usage:
+
+    out = pipeline.run()
+    boot = bootstrap(out["polls"], adjusted=out["adjusted"], nboot=5000)
+    boot["se"], boot[0.05], boot[0.95]
+"""
+import numpy as np
+import pandas
+from scipy import sparse
+
+import pipeline
+from poll_schema import states_abbrev_dict
+
+QUANTILES = [.05, .5, .95]
+
+
+def _resample_counts(group, nboot, rng):
+    """
+    Multinomial counts for resampling members within their groups.
+
+    `group` gives the group code of each member; members of a group are
+    drawn with replacement as many times as the group has members.
+    Returns nboot x members counts.
+    """
+    group = np.asarray(group)
+    n = len(group)
+    order = np.argsort(group, kind="mergesort")
+    sizes = np.bincount(group)
+    starts = np.r_[0, np.cumsum(sizes)[:-1]]
+    # draw a member of the same group for every slot
+    slot_group = group[order]
+    u = rng.random((nboot, n))
+    picks = order[starts[slot_group] +
+                  (u * sizes[slot_group]).astype(int)]
+    flat = (picks + n * np.arange(nboot)[:, None]).ravel()
+    return np.bincount(flat, minlength=n * nboot).reshape(nboot, n)
+
+
+def bootstrap(polls, adjusted=None, natl_weight=None, nboot=2000,
+              chunk=500, quantiles=QUANTILES, seed=None, replicates=False):
+    """
+    Bootstrap the state averages.
+
+    Parameters
+    ----------
+    polls : DataFrame
+        Polls with state, pollster, spread, time_weight, MESS and Weight, as
+        pipeline.state_averages returns them.
+    adjusted : Series, optional
+        trend * m_correction by state. If given, it enters every state's
+        average as the "National" pollster, held fixed, as in the
+        snapshot.
+    natl_weight : float, optional
+        Weight of the national trend. Defaults to the mean weight in
+        pollster_weights.csv, as in the snapshot.
+    nboot : int
+        Number of replicates.
+    chunk : int
+        Replicates computed at once.
+
+    Returns
+    -------
+    DataFrame indexed by State with the full-data estimate, the bootstrap
+    standard error and the requested quantiles. With replicates=True,
+    also the nboot x states replicate matrix.
+    """
+    rng = np.random.default_rng(seed)
+    state = polls["state"].astype(str).map(
+                lambda s : states_abbrev_dict.get(s, s)).values
+    pollster = polls["pollster"].astype(str).values
+    group_codes, groups = pandas.factorize(
+                pandas.MultiIndex.from_arrays([state, pollster]))
+    state_codes, states = pandas.factorize(groups.get_level_values(0))
+    ngroups, nstates = len(groups), len(states)
+    npolls = len(polls)
+
+    w = (polls["time_weight"] * polls["MESS"]).values
+    wy = w * polls["spread"].values
+    poll_to_group = sparse.csr_matrix((np.ones(npolls),
+                                       (np.arange(npolls), group_codes)),
+                                      shape=(npolls, ngroups))
+    group_to_state = sparse.csr_matrix((np.ones(ngroups),
+                                        (np.arange(ngroups), state_codes)),
+                                       shape=(ngroups, nstates))
+    weight = pandas.Series(polls["Weight"].values, index=group_codes)
+    weight = weight.groupby(level=0).first().sort_index().values
+
+    trend_num = np.zeros(nstates)
+    trend_den = np.zeros(nstates)
+    if adjusted is not None:
+        if natl_weight is None:
+            natl_weight = pipeline.load_weights().Weight.mean()
+        trend = adjusted.reindex(states).values
+        has = np.isfinite(trend)
+        trend_num[has] = natl_weight * trend[has]
+        trend_den[has] = natl_weight
+
+    def state_average(poll_counts, pollster_counts):
+        num = poll_to_group.T.dot((poll_counts * wy).T).T
+        den = poll_to_group.T.dot((poll_counts * w).T).T
+        with np.errstate(invalid="ignore", divide="ignore"):
+            average = num / den
+        # a pollster can only lose all its polls if it has none
+        pw = pollster_counts * weight
+        snum = group_to_state.T.dot((pw * np.nan_to_num(average)).T).T
+        sden = group_to_state.T.dot(pw.T).T
+        return (snum + trend_num) / (sden + trend_den)
+
+    estimate = state_average(np.ones((1, npolls)), np.ones((1, ngroups)))[0]
+    reps = []
+    done = 0
+    while done < nboot:
+        n = min(chunk, nboot - done)
+        poll_counts = _resample_counts(group_codes, n, rng)
+        pollster_counts = _resample_counts(state_codes, n, rng)
+        reps.append(state_average(poll_counts, pollster_counts))
+        done += n
+    reps = np.vstack(reps)
+
+    out = pandas.DataFrame(dict(estimate=estimate, se=reps.std(0, ddof=1)),
+                           index=pandas.Index(states, name="State"))
+    for q in quantiles:
+        out[q] = np.quantile(reps, q, axis=0)
+    out = out.sort_index()
+    if replicates:
+        return out, pandas.DataFrame(reps, columns=states)
+    return out
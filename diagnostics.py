@@ -0,0 +1,189 @@
+"""
+Regression diagnostics from a thin QR factorization.
+
+statsmodels' get_influence() and outlier_test() are what
+historical_adjustment.py uses on the poll-change regression, but some of
+their paths build n x n objects. Everything here comes from X = QR with Q
+n x p, so the cost is O(n p**2) and nothing larger than n x p is kept:
+
+    hat_diag        row sums of Q**2
+    student_resid   residuals over the leave-one-out sigma, which has a
+                    closed form in the residual and the leverage
+    cooks_d, dffits, dfb_*
+    press_resid     the leave-one-out prediction errors e / (1 - h)
+
+The table layout is that of statsmodels' summary_frame, with press_resid
+added.
+
+Usage:
+
+    mod = ols(formula, data=changes).fit()
+    infl = Influence.from_results(mod)
+    table = infl.summary_frame()
+    infl.outlier_test("fdr_bh")
+    infl.press
+"""
+import numpy as np
+import pandas
+from scipy import linalg, stats
+from statsmodels.stats.multitest import multipletests
+
+
+class Influence(object):
+    """
+    Influence and outlier measures of a least squares fit.
+
+    Parameters
+    ----------
+    exog : array-like
+        n x p design matrix.
+    endog : array-like
+        n responses.
+    weights : array-like, optional
+        WLS weights. The diagnostics are those of the whitened problem, as
+        in statsmodels.
+    exog_names : list, optional
+        Column names, taken from exog if it's a DataFrame.
+    index : Index, optional
+        Row labels, taken from exog if it's a DataFrame.
+    """
+    def __init__(self, exog, endog, weights=None, exog_names=None,
+                 index=None):
+        if isinstance(exog, pandas.DataFrame):
+            exog_names = exog_names or list(exog.columns)
+            index = exog.index if index is None else index
+        X = np.asarray(exog, dtype=float)
+        y = np.asarray(endog, dtype=float)
+        if weights is not None:
+            root = np.sqrt(np.asarray(weights, dtype=float))
+            X = X * root[:, None]
+            y = y * root
+        self.nobs, self.k_vars = X.shape
+        self.exog_names = exog_names or ["x%d" % i
+                                         for i in range(self.k_vars)]
+        self.index = (pandas.RangeIndex(self.nobs) if index is None
+                      else pandas.Index(index))
+
+        Q, R = linalg.qr(X, mode="economic")
+        self._Q, self._R = Q, R
+        self.params = linalg.solve_triangular(R, np.dot(Q.T, y))
+        self.resid = y - np.dot(X, self.params)
+        self.df_resid = self.nobs - self.k_vars
+        self.ssr = np.dot(self.resid, self.resid)
+        self.scale = self.ssr / self.df_resid
+        self.hat_diag = np.einsum("ij,ij->i", Q, Q)
+
+    @classmethod
+    def from_results(cls, results):
+        """
+        Diagnostics for a fitted statsmodels OLS or WLS.
+        """
+        model = results.model
+        weights = getattr(model, "weights", None)
+        if np.isscalar(weights):
+            weights = None
+        index = getattr(model.data, "row_labels", None)
+        return cls(model.exog, model.endog, weights, model.exog_names, index)
+
+    @property
+    def sigma2_not_obsi(self):
+        """
+        Error variance with each observation left out.
+        """
+        h = self.hat_diag
+        return ((self.ssr - self.resid**2 / (1 - h)) /
+                (self.df_resid - 1))
+
+    @property
+    def resid_studentized_internal(self):
+        return self.resid / np.sqrt(self.scale * (1 - self.hat_diag))
+
+    @property
+    def resid_studentized_external(self):
+        return self.resid / np.sqrt(self.sigma2_not_obsi *
+                                    (1 - self.hat_diag))
+
+    @property
+    def resid_press(self):
+        """
+        Leave-one-out prediction errors.
+        """
+        return self.resid / (1 - self.hat_diag)
+
+    @property
+    def press(self):
+        """
+        Sum of squared leave-one-out prediction errors.
+        """
+        return np.dot(self.resid_press, self.resid_press)
+
+    @property
+    def loo_mse(self):
+        return self.press / self.nobs
+
+    @property
+    def cooks_distance(self):
+        h = self.hat_diag
+        return self.resid_studentized_internal**2 * h / (self.k_vars *
+                                                         (1 - h))
+
+    @property
+    def dffits_internal(self):
+        h = self.hat_diag
+        return self.resid_studentized_internal * np.sqrt(h / (1 - h))
+
+    @property
+    def dffits(self):
+        h = self.hat_diag
+        return self.resid_studentized_external * np.sqrt(h / (1 - h))
+
+    @property
+    def dfbetas(self):
+        """
+        n x p scaled change in the parameters from leaving out each
+        observation.
+        """
+        # (X'X)^-1 x_i for every i is R^-1 Q_i'
+        Rinv_Qt = linalg.solve_triangular(self._R, self._Q.T)
+        Rinv = linalg.solve_triangular(self._R, np.eye(self.k_vars))
+        cov_diag = (Rinv**2).sum(1)
+        dfbeta = (Rinv_Qt * (self.resid / (1 - self.hat_diag))).T
+        return dfbeta / np.sqrt(self.sigma2_not_obsi[:, None] *
+                                cov_diag[None, :])
+
+    def summary_frame(self):
+        """
+        The statsmodels summary_frame table, plus press_resid.
+        """
+        frame = pandas.DataFrame(self.dfbetas, index=self.index,
+                                 columns=["dfb_" + name
+                                          for name in self.exog_names])
+        frame["cooks_d"] = self.cooks_distance
+        frame["standard_resid"] = self.resid_studentized_internal
+        frame["hat_diag"] = self.hat_diag
+        frame["dffits_internal"] = self.dffits_internal
+        frame["student_resid"] = self.resid_studentized_external
+        frame["dffits"] = self.dffits
+        frame["press_resid"] = self.resid_press
+        return frame
+
+    def outlier_test(self, method="bonf", alpha=.05):
+        """
+        Test the externally studentized residuals against a t with
+        df_resid - 1 degrees of freedom, corrected for multiple testing as
+        statsmodels' outlier_test does.
+        """
+        resid = self.resid_studentized_external
+        unadj_p = 2 * stats.t.sf(np.abs(resid), self.df_resid - 1)
+        adj_p = multipletests(unadj_p, alpha=alpha, method=method)[1]
+        return pandas.DataFrame({"student_resid" : resid,
+                                 "unadj_p" : unadj_p,
+                                 method + "(p)" : adj_p}, index=self.index)
+
+
+def influence(results):
+    """
+    Influence of a fitted statsmodels OLS or WLS, like
+    results.get_influence().
+    """
+    return Influence.from_results(results)
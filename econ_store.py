@@ -0,0 +1,208 @@
+"""
+A local store of the FRED economic series used by historical_adjustment.py
+and silver_model.py.
+
+Each series lives in its own CSV under the store directory and is only
+ever appended to: an update asks the source for observations after the
+last stored date and writes just those. Updates of different series run
+concurrently. The source is pluggable, anything with a
+fetch(series_id, start) method returning a Series indexed by date:
+
+    FredSource()        FRED through pandas_datareader, when online
+    FileSource(path)    a CSV with a DATE column and one column per
+                        series, e.g. the old tmp_indicators_full.csv
+
+The transforms, quarterly_growth (annualized quarterly log growth) and
+the econ2004 / econ2008 / econ2012 averages, are cached next to the
+series and only recomputed when a series has changed, so a run reads
+them from disk without touching the network.
+
+Usage:
+
+    store = SeriesStore("data/econ")
+    store.update(FileSource("tmp_indicators_full.csv"))
+    store.quarterly_growth()
+    store.econ(2008)
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas
+
+series = dict(jobs="PAYEMS",
+              income="PI",
+              prod="INDPRO",
+              cons="PCEC96",
+              prices="CPIAUCSL")
+
+start = "2000-10-1"
+
+# the quarters voters know about at each election. 2008Q4 is left out of
+# 2012, as in historical_adjustment.py
+windows = {2004 : ("2001-01-01", "2004-09-30"),
+           2008 : ("2004-10-01", "2008-09-30"),
+           2012 : ("2009-01-01", None)}
+
+
+class FredSource(object):
+    """
+    FRED, through pandas_datareader.
+    """
+    def fetch(self, series_id, start):
+        from pandas_datareader.data import DataReader
+        return DataReader(series_id, "fred", start=start)[series_id]
+
+
+class FileSource(object):
+    """
+    Series from a CSV with a DATE column and one column per series id (or
+    per variable name in `series`).
+    """
+    def __init__(self, path, date_column="DATE"):
+        self.path = path
+        self.date_column = date_column
+        self._data = None
+
+    def fetch(self, series_id, start):
+        if self._data is None:
+            data = pandas.read_csv(self.path, parse_dates=[self.date_column])
+            data.set_index(self.date_column, inplace=True)
+            names = dict((name, series_id)
+                         for name, series_id in series.items())
+            self._data = data.rename(columns=names)
+        data = self._data[series_id].dropna()
+        return data[data.index >= pandas.Timestamp(start)]
+
+
+class SeriesStore(object):
+    def __init__(self, path="data/econ", series=series):
+        self.path = path
+        self.series = dict(series)
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def _file(self, series_id):
+        return os.path.join(self.path, series_id + ".csv")
+
+    def read(self, series_id):
+        """
+        The stored observations of one series.
+        """
+        path = self._file(series_id)
+        if not os.path.exists(path):
+            return pandas.Series(dtype=float, name=series_id,
+                                 index=pandas.DatetimeIndex([], name="DATE"))
+        data = pandas.read_csv(path, parse_dates=["DATE"], index_col="DATE")
+        return data[series_id]
+
+    def last_date(self, series_id):
+        path = self._file(series_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as fin:
+            # read the last line only
+            fin.seek(0, os.SEEK_END)
+            end = fin.tell()
+            fin.seek(max(end - 256, 0))
+            last = fin.read().decode().strip().splitlines()[-1]
+        date = last.split(",")[0]
+        return None if date == "DATE" else pandas.Timestamp(date)
+
+    def _update_one(self, source, series_id):
+        last = self.last_date(series_id)
+        since = start if last is None else last + pandas.Timedelta(days=1)
+        data = source.fetch(series_id, since).dropna()
+        if last is not None:
+            data = data[data.index > last]
+        if not len(data):
+            return 0
+        data = data.sort_index()
+        path = self._file(series_id)
+        new = not os.path.exists(path)
+        with open(path, "a") as fout:
+            if new:
+                fout.write("DATE,%s\n" % series_id)
+            for date, value in zip(data.index, data.values):
+                fout.write("%s,%r\n" % (date.strftime("%Y-%m-%d"),
+                                        float(value)))
+        return len(data)
+
+    def update(self, source=None, jobs=None):
+        """
+        Append whatever the source has past each series' last date.
+        Returns the number of new observations by series id.
+        """
+        source = source or FredSource()
+        ids = list(self.series.values())
+        with ThreadPoolExecutor(jobs or len(ids)) as pool:
+            added = list(pool.map(lambda series_id :
+                                  self._update_one(source, series_id), ids))
+        return dict(zip(ids, added))
+
+    def load(self):
+        """
+        Every series, with the variable names as columns.
+        """
+        data = pandas.concat([self.read(series_id).rename(name)
+                              for name, series_id in self.series.items()],
+                             axis=1)
+        return data.sort_index()
+
+    def _version(self):
+        # the stored files only grow, so sizes identify their contents
+        state = sorted((series_id, os.path.getsize(self._file(series_id))
+                        if os.path.exists(self._file(series_id)) else 0)
+                       for series_id in self.series.values())
+        return hashlib.sha1(json.dumps(state).encode()).hexdigest()
+
+    def _cached(self, name, compute, dates=True):
+        path = os.path.join(self.path, "_%s.csv" % name)
+        meta = os.path.join(self.path, "_%s.version" % name)
+        version = self._version()
+        if os.path.exists(path) and os.path.exists(meta):
+            with open(meta) as fin:
+                if fin.read() == version:
+                    return pandas.read_csv(path, index_col=0,
+                                           parse_dates=dates)
+        result = compute()
+        result.to_csv(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        with open(meta, "w") as fout:
+            fout.write(version)
+        return result
+
+    def quarterly_growth(self):
+        """
+        Annualized quarterly log growth, 400 * diff(log(quarterly mean)).
+        """
+        def compute():
+            quarterly = self.load().resample("QE").mean()
+            growth = np.log(quarterly).diff() * 400
+            return growth.dropna()
+        return self._cached("quarterly_growth", compute)
+
+    def econ_by_cycle(self):
+        """
+        econ2004, econ2008 and econ2012 as rows: the mean over years of
+        the annual mean growth in each cycle's window.
+        """
+        def compute():
+            growth = self.quarterly_growth()
+            rows = {}
+            for cycle, (first, last) in windows.items():
+                part = growth.loc[first:last]
+                rows[cycle] = part.resample("YE").mean().mean()
+            econ = pandas.DataFrame(rows).T
+            econ.index.name = "cycle"
+            return econ
+        return self._cached("econ", compute, dates=False)
+
+    def econ(self, cycle):
+        """
+        The econ Series of one cycle, like econ2008 in
+        historical_adjustment.py.
+        """
+        return self.econ_by_cycle().loc[cycle].rename("econ%d" % cycle)
@@ -0,0 +1,189 @@
+"""
+State (or county) features as aligned arrays, by unit and vintage.
+
+Census features change between vintages; historical_adjustment.py makes
+the 2008 census by averaging 2000 and 2012, which is interpolation at the
+midpoint. Here every vintage is a slice of one vintages x units x
+features array and the features at any date are interpolated between the
+two vintages around it, for all units and features at once (and held
+flat outside the first and last). Features without vintages (PVI, party
+affiliation, FEC giving) are stored once and broadcast.
+
+The matrices the stages consume, raw, whitened as in
+scipy.cluster.vq.whiten (for KMeans and KNN) or standardized (for the
+regressions), are cached per date, feature list and units, so after the
+first request they're a dictionary lookup. They're returned read-only.
+The cache keeps the `cache_size` most recently used matrices. Columns
+without any variation are left unscaled, with a warning, as vq.whiten
+does.
+
+Usage:
+
+    store = load_store()
+    demo_data = store.frame("2012-10-02")
+    X = store.matrix("2012-10-02", kind="whiten")
+    labels = pipeline.cluster_states(demo_data, clean_data=X)
+    X = store.matrix("2008-11-04", ["per_black", "PVI"], kind="standardize")
+"""
+import collections
+import warnings
+
+import numpy as np
+import pandas
+
+import pipeline
+
+KINDS = ["raw", "whiten", "standardize"]
+
+
+def _scale(X):
+    """
+    The column standard deviations, one where a column is constant.
+    """
+    std = X.std(0)
+    constant = std == 0
+    if constant.any():
+        warnings.warn("Some columns have standard deviation zero. "
+                      "The values of these columns will not change.",
+                      RuntimeWarning)
+        std[constant] = 1.
+    return std
+
+
+class FeatureStore(object):
+    """
+    Parameters
+    ----------
+    units : Index
+        States, counties, anything the features are indexed by.
+    cache_size : int
+        How many matrices to keep, least recently used dropped first.
+    """
+    def __init__(self, units, cache_size=64):
+        self.units = pandas.Index(units)
+        self.dates = np.array([], dtype="datetime64[ns]")
+        self.features = []
+        self.values = np.empty((0, len(self.units), 0))
+        self.static = pandas.DataFrame(index=self.units)
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+
+    def add_vintage(self, date, frame):
+        """
+        Features as of `date`, indexed by unit. The columns of every
+        vintage must be the same.
+        """
+        date = np.datetime64(pandas.Timestamp(date), "ns")
+        if not self.features:
+            self.features = list(frame.columns)
+            self.values = np.empty((0, len(self.units), len(self.features)))
+        values = frame.reindex(index=self.units,
+                               columns=self.features).values.astype(float)
+        at = np.searchsorted(self.dates, date)
+        if at < len(self.dates) and self.dates[at] == date:
+            self.values[at] = values
+        else:
+            self.dates = np.insert(self.dates, at, date)
+            self.values = np.insert(self.values, at, values, axis=0)
+        self._cache.clear()
+        return self
+
+    def add_static(self, frame):
+        """
+        Features that don't change with the date.
+        """
+        self.static = self.static.join(frame.reindex(self.units))
+        self._cache.clear()
+        return self
+
+    @property
+    def columns(self):
+        return self.features + list(self.static.columns)
+
+    def interpolate(self, date):
+        """
+        units x vintage features at `date`, linear between vintages.
+        """
+        date = np.datetime64(pandas.Timestamp(date), "ns")
+        dates = self.dates.astype("int64")
+        t = date.astype("int64")
+        hi = np.clip(np.searchsorted(dates, t), 1, len(dates) - 1)
+        lo = hi - 1
+        if len(dates) == 1:
+            return self.values[0]
+        frac = (t - dates[lo]) / float(dates[hi] - dates[lo])
+        frac = np.clip(frac, 0, 1)
+        return (1 - frac) * self.values[lo] + frac * self.values[hi]
+
+    def matrix(self, date, features=None, kind="raw", units=None):
+        """
+        The units x features matrix at `date`, raw, whitened or
+        standardized.
+        """
+        date = pandas.Timestamp(date)
+        features = tuple(features or self.columns)
+        units = None if units is None else tuple(units)
+        key = (date, features, kind, units)
+        cached = self._get(key)
+        if cached is not None:
+            return cached
+        if kind not in KINDS:
+            raise ValueError("kind must be one of %s" % ", ".join(KINDS))
+
+        full = (date, None, "raw", None)
+        X = self._get(full)
+        if X is None:
+            X = np.column_stack((self.interpolate(date),
+                                 self.static.values.astype(float)))
+            X.setflags(write=False)
+            self._put(full, X)
+        columns = self.columns
+        X = X[:, [columns.index(name) for name in features]]
+        if units is not None:
+            X = X[self.units.get_indexer(list(units))]
+        if kind == "whiten":
+            X = X / _scale(X)
+        elif kind == "standardize":
+            X = (X - X.mean(0)) / _scale(X)
+        X = np.ascontiguousarray(X)
+        X.setflags(write=False)
+        self._put(key, X)
+        return X
+
+    def _get(self, key):
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+        return cached
+
+    def _put(self, key, X):
+        self._cache[key] = X
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def frame(self, date, features=None, kind="raw", units=None):
+        """
+        matrix() as a DataFrame.
+        """
+        features = list(features or self.columns)
+        index = self.units if units is None else pandas.Index(units)
+        return pandas.DataFrame(self.matrix(date, features, kind, units),
+                                index=index, columns=features)
+
+
+def load_store(path="data/"):
+    """
+    The state features of pipeline.load_demographics, with the 2000
+    census as an earlier vintage. The current census is dated mid 2011,
+    the vintage of its population estimates.
+    """
+    demo_data = pipeline.load_demographics(path)
+    census_2000 = pandas.read_csv(path + "census_data_2000.csv",
+                                  index_col="State")
+    census = [c for c in demo_data.columns if c in census_2000.columns]
+    static = [c for c in demo_data.columns if c not in census]
+    store = FeatureStore(demo_data.index)
+    store.add_vintage("2000-04-01", census_2000[census])
+    store.add_vintage("2011-07-01", demo_data[census])
+    store.add_static(demo_data[static])
+    return store
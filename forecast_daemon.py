@@ -0,0 +1,264 @@
+"""
+Keep the forecast up to date as new polls come in.
+
+The daemon does one full run of the pipeline, keeps every intermediate
+result around and then watches the poll files (and an in-process ingest
+queue). When something changes it waits for the burst to settle, works out
+which (state, pollster) groups actually changed, and recomputes only
+
+    * MESS, time weights and the pollster average of those groups,
+    * the lowess trend of the clusters those states are in (all of them if
+      the national polls changed),
+    * trend * m_correction for the states in those clusters,
+
+before redoing the (cheap) snapshot and publishing a new
+2012-predicted.csv and EV tally. Both files are replaced atomically so
+readers never see a half written forecast. The cluster labels and
+m_correction are from the full run; call `full_run` to refresh them.
+`today`, the date the time weights count from, is fixed for the same
+reason: every poll's time weight changes with it, so to move it set
+`daemon.today` and call `full_run`. With a
+forecast_history.ForecastHistory every published forecast is also
+recorded there.
+
+Usage:
+
+    daemon = ForecastDaemon()
+    daemon.full_run()
+    daemon.watch()                  # blocks, Ctrl-C to stop
+
+    daemon.submit(new_polls)        # or push normalized polls directly
+"""
+import datetime
+import os
+import queue
+import threading
+import time
+
+import pandas
+
+import pipeline
+
+KEY = ["state", "pollster", "start_date", "end_date", "dem", "rep", "sample"]
+
+
+def _write_atomic(frame, path, **kwargs):
+    tmp = path + ".tmp"
+    frame.to_csv(tmp, **kwargs)
+    os.replace(tmp, path)
+
+
+def changed_groups(old, new):
+    """
+    (state, pollster) pairs whose polls differ between two poll tables.
+    """
+    old = old[KEY].astype(dict(state=str, pollster=str))
+    new = new[KEY].astype(dict(state=str, pollster=str))
+    both = old.merge(new, on=KEY, how="outer", indicator=True)
+    changed = both.loc[both["_merge"] != "both", ["state", "pollster"]]
+    # a group whose polls were only reordered also counts
+    for frame in (old, new):
+        frame["position"] = frame.groupby(["state", "pollster"]).cumcount()
+    moved = old.merge(new, on=KEY, how="inner")
+    moved = moved.loc[moved.position_x != moved.position_y,
+                      ["state", "pollster"]]
+    changed = pandas.concat((changed, moved)).drop_duplicates()
+    return set(map(tuple, changed.values))
+
+
+class ForecastDaemon(object):
+    def __init__(self, state_path="data/2012_poll_data_states.csv",
+                 national_path="data/2012_poll_data.csv",
+                 output="2012-predicted.csv", ev_output="2012-ev.csv",
+                 today=None, debounce=.5, interval=.25, history=None):
+        self.state_path = state_path
+        self.national_path = national_path
+        self.output = output
+        self.ev_output = ev_output
+        self.today = today or pipeline.today
+        self.debounce = debounce
+        self.interval = interval
+        self.history = history
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._mtimes = {}
+        # submitted polls not yet in the poll files, merged into every load
+        self.pending = []
+        self.version = 0
+
+    def _stat(self):
+        return dict((path, os.stat(path).st_mtime_ns)
+                    for path in (self.state_path, self.national_path))
+
+    def _load(self):
+        table = pipeline.load_state_polls(self.state_path,
+                                          weights=self.weights)
+        national = pipeline.load_national_polls(self.national_path)
+        # submitted polls that have since been written to the file are
+        # dropped from pending, the rest go on top of the file's
+        pending = []
+        for polls in self.pending:
+            on_file = polls[KEY].astype(dict(state=str, pollster=str)).merge(
+                        table[KEY].astype(dict(state=str, pollster=str)),
+                        on=KEY, how="left", indicator=True)["_merge"]
+            polls = polls[(on_file != "both").values]
+            if len(polls):
+                pending.append(polls)
+        self.pending = pending
+        if pending:
+            # newest polls go first, as in the RCP tables
+            table = pandas.concat(pending[::-1] + [table],
+                                  ignore_index=True)
+        return table, national
+
+    def full_run(self):
+        """
+        Run every stage and cache the results.
+        """
+        with self.lock:
+            self._mtimes = self._stat()
+            self.weights = pipeline.load_weights()
+            self.demo_data = pipeline.load_demographics()
+            self.table, self.national = self._load()
+            self.polls, self.averages = pipeline.state_averages(
+                                            self.table, self.today)
+            self.labels = pipeline.cluster_states(self.demo_data,
+                                                  random_state=0)
+            self.trends = pipeline.cluster_trends(self.polls, self.national,
+                                                  self.labels)
+            self.m_correction = pipeline.time_uncertainty(
+                                    self.polls, self.demo_data, self.today)
+            self.adjusted = pipeline.adjust_trends(self.trends,
+                                                   self.m_correction)
+            self._publish()
+
+    def update(self, table, national=None):
+        """
+        Move to a new poll table, recomputing only what depends on the
+        groups that changed. Returns the affected states.
+        """
+        with self.lock:
+            groups = changed_groups(self.table, table)
+            national_changed = national is not None and not (
+                national[KEY].equals(self.national[KEY]))
+            if not groups and not national_changed:
+                return set()
+
+            keys = list(zip(table["state"].astype(str),
+                            table["pollster"].astype(str)))
+            hit = pandas.Series([key in groups for key in keys],
+                                index=table.index)
+            redo, _ = pipeline.state_averages(table[hit.values], self.today)
+            keys = list(zip(self.polls["state"].astype(str),
+                            self.polls["pollster"].astype(str)))
+            keep = [key not in groups for key in keys]
+            self.polls = pandas.concat((self.polls[keep], redo),
+                                       ignore_index=True)
+            self.table = table
+
+            averages = self.averages.drop(list(groups), errors="ignore")
+            if len(redo):
+                averages = pandas.concat((averages,
+                                    pipeline.pollster_averages(redo)))
+            self.averages = averages.sort_index()
+
+            if national_changed:
+                self.national = national
+            states = set(pipeline.states_abbrev_dict.get(state, state)
+                         for state, _ in groups)
+            if national_changed:
+                clusters = set(self.labels)
+            else:
+                clusters = set(self.labels.reindex(list(states)).dropna())
+            in_clusters = self.polls["State"].map(self.labels).isin(clusters)
+            trends = pipeline.cluster_trends(self.polls[in_clusters.values],
+                                             self.national, self.labels)
+            # a state can drop out of a cluster's polls entirely
+            redone = self.labels.index[self.labels.isin(clusters)]
+            self.trends = pandas.concat((
+                self.trends.drop(redone, errors="ignore"),
+                trends)).sort_index(kind="mergesort")
+            self.trends.name = "trend"
+            adjusted = pipeline.adjust_trends(trends, self.m_correction)
+            self.adjusted = pandas.concat((
+                self.adjusted.drop(redone, errors="ignore"),
+                adjusted)).sort_index(kind="mergesort")
+            self.adjusted.name = "poll"
+            self._publish()
+            return set(redone) | states
+
+    def _publish(self):
+        self.results = pipeline.snapshot(self.averages, self.adjusted,
+                                         self.weights)
+        self.ev = pipeline.tally(self.results)
+        _write_atomic(self.results[["poll"]].reset_index(), self.output,
+                      index=False)
+        _write_atomic(pandas.DataFrame([self.ev]), self.ev_output,
+                      index=False)
+        self.version += 1
+        self.published = datetime.datetime.now()
+        if self.history is not None:
+            self.history.record(dict(results=self.results,
+                                     trends=self.trends,
+                                     m_correction=self.m_correction,
+                                     ev=self.ev), self.published)
+
+    def submit(self, polls):
+        """
+        Queue normalized polls (with PIE, Weight and State, as
+        pipeline.load_state_polls gives them) for the next update. They
+        are kept on top of the poll files, through reloads, until the
+        files have them too.
+        """
+        self.queue.put(polls)
+
+    def _drain(self):
+        new = []
+        while True:
+            try:
+                new.append(self.queue.get_nowait())
+            except queue.Empty:
+                return new
+
+    def step(self):
+        """
+        Check for new polls once. Returns the affected states, or None if
+        nothing changed.
+        """
+        if self._stat() == self._mtimes and self.queue.empty():
+            return None
+        # debounce, wait for the files to stop changing
+        while True:
+            mtimes = self._stat()
+            time.sleep(self.debounce)
+            if self._stat() == mtimes:
+                break
+        # the files can also have changed during the debounce
+        files_changed = mtimes != self._mtimes
+        self._mtimes = mtimes
+        submitted = self._drain()
+        if files_changed:
+            self.pending.extend(submitted)
+            table, national = self._load()
+        else:
+            table, national = self.table, None
+            if submitted:
+                self.pending.extend(submitted)
+                # newest polls go first, as in the RCP tables
+                table = pandas.concat(submitted[::-1] + [table],
+                                      ignore_index=True)
+        return self.update(table, national)
+
+    def watch(self, callback=None):
+        """
+        Poll for changes until `stop` is called.
+        """
+        while not self._stop.is_set():
+            affected = self.step()
+            if affected is not None and callback is not None:
+                callback(affected)
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
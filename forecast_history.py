@@ -0,0 +1,286 @@
+"""
+Append-only history of the forecast, run by run.
+
+Every run adds a row to a runs table (the run's timestamp, the EV tally
+and where its changes are) and its per-state values to a changes file.
+Only the (state, field) values that differ from the previous run are
+written, so a daemon update that touched two clusters costs a few records,
+not a full table; m_correction, which only changes on a full run, is
+almost free. Every `keyframe_every` runs the full table is written
+instead, so no query has to replay more than that many runs.
+
+Both files are flat arrays of fixed size records, appended to and read
+back memory-mapped, as in poll_archive. The runs table is sorted by
+timestamp so a timestamp is a searchsorted away from its run.
+
+    as_of(run)              the keyframe before the run plus the changes
+                            since, at most keyframe_every runs
+    state_history(state)    the changes of the last N runs (and the
+                            keyframe before them), filtered to the state
+
+Readers pick up new runs as the files grow; there is one writer.
+
+Usage:
+
+    history = ForecastHistory("data/history")
+    history.record(pipeline.run())
+    history.runs()                               # when, obama, romney
+    history.as_of("2012-10-02 12:00")            # states x FIELDS
+    history.state_history("Ohio", last=20)       # runs x FIELDS
+"""
+import json
+import os
+
+import numpy as np
+import pandas
+
+FIELDS = ["poll", "trend", "m_correction"]
+
+RUN = np.dtype([("when", np.int64), ("obama", np.int16),
+                ("romney", np.int16), ("keyframe", np.int32),
+                ("offset", np.int64), ("count", np.int32)])
+CHANGE = np.dtype([("state", np.int16), ("field", np.int8),
+                   ("value", np.float64)])
+
+
+def _read(path, dtype):
+    nrecords = os.path.getsize(path) // dtype.itemsize if (
+        os.path.exists(path)) else 0
+    if not nrecords:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(nrecords,))
+
+
+def _last(keys):
+    """
+    Position of the last occurrence of every key.
+    """
+    unique, first = np.unique(keys[::-1], return_index=True)
+    return unique, len(keys) - 1 - first
+
+
+class ForecastHistory(object):
+    """
+    Parameters
+    ----------
+    path : str
+        Directory of the store, created if needed.
+    keyframe_every : int
+        Runs between full tables, for a new store.
+    """
+    def __init__(self, path, keyframe_every=50):
+        self.path = path
+        self._meta_path = os.path.join(path, "meta.json")
+        self._runs_path = os.path.join(path, "runs.bin")
+        self._changes_path = os.path.join(path, "changes.bin")
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as fin:
+                self.meta = json.load(fin)
+        else:
+            if not os.path.exists(path):
+                os.makedirs(path)
+            self.meta = dict(states=[], fields=FIELDS,
+                             keyframe_every=keyframe_every)
+            self._write_meta()
+        self._size = None
+
+    def __len__(self):
+        return len(self._load()[0])
+
+    def _write_meta(self):
+        tmp = self._meta_path + ".tmp"
+        with open(tmp, "w") as fout:
+            json.dump(self.meta, fout)
+        os.replace(tmp, self._meta_path)
+
+    def _load(self):
+        # cheap when nothing was appended, a stat of the runs file
+        size = os.path.getsize(self._runs_path) if (
+            os.path.exists(self._runs_path)) else 0
+        if size != self._size:
+            with open(self._meta_path) as fin:
+                self.meta = json.load(fin)
+            self._runs = _read(self._runs_path, RUN)
+            self._changes = _read(self._changes_path, CHANGE)
+            self._size = size
+        return self._runs, self._changes
+
+    def _block(self, first, last):
+        """
+        The changes from the keyframe before run `first` through run
+        `last` and the run of each.
+        """
+        runs, changes = self._load()
+        start = runs["keyframe"][first]
+        lo = runs["offset"][start]
+        hi = runs["offset"][last] + runs["count"][last]
+        run = np.repeat(np.arange(start, last + 1),
+                        runs["count"][start:last + 1])
+        return changes[lo:hi], run, start
+
+    def run_at(self, when):
+        """
+        The last run at or before `when`, -1 if there is none.
+        """
+        runs, _ = self._load()
+        when = pandas.Timestamp(when).as_unit("ns").value
+        return int(np.searchsorted(runs["when"], when, side="right")) - 1
+
+    def _run(self, run, when):
+        nruns = len(self._load()[0])
+        if when is not None:
+            run = self.run_at(when)
+        elif run is None:
+            run = nruns - 1
+        elif run < 0:
+            run += nruns
+        if not 0 <= run < nruns:
+            raise IndexError("No run %s in a history of %d runs" %
+                             (when if when is not None else run, nruns))
+        return run
+
+    def _values(self, run):
+        states, fields = self.meta["states"], self.meta["fields"]
+        values = np.full((len(states), len(fields)), np.nan)
+        if run < 0:
+            return values
+        block, _, _ = self._block(run, run)
+        keys = (block["state"].astype(np.int64) * len(fields) +
+                block["field"])
+        keys, at = _last(keys)
+        values.flat[keys] = block["value"][at]
+        return values
+
+    def as_of(self, when=None, run=None):
+        """
+        Every state's values after a run, by timestamp (the last run at
+        or before it) or by run number. The latest run by default.
+        """
+        run = self._run(run, when)
+        return pandas.DataFrame(self._values(run),
+                                index=pandas.Index(self.meta["states"],
+                                                   name="State"),
+                                columns=self.meta["fields"])
+
+    def runs(self):
+        """
+        The runs table: when, obama and romney by run number.
+        """
+        runs, _ = self._load()
+        return pandas.DataFrame(dict(
+                    when=pandas.to_datetime(np.asarray(runs["when"]),
+                                            unit="ns"),
+                    obama=np.asarray(runs["obama"]),
+                    romney=np.asarray(runs["romney"])),
+                    index=pandas.RangeIndex(len(runs), name="run"))
+
+    def state_history(self, state, last=None, until=None):
+        """
+        One state's values over the `last` runs up to run `until` (the
+        latest by default), indexed by run timestamp.
+        """
+        runs, _ = self._load()
+        fields = self.meta["fields"]
+        until = self._run(until, None)
+        first = 0 if last is None else max(0, until - last + 1)
+        columns = fields + ["obama", "romney"]
+        if state not in self.meta["states"]:
+            raise KeyError(state)
+        code = self.meta["states"].index(state)
+        block, run, start = self._block(first, until)
+        mine = block["state"] == code
+        block, run = block[mine], run[mine] - start
+
+        nruns = until - start + 1
+        values = np.full((nruns, len(fields)), np.nan)
+        recorded = np.full((nruns, len(fields)), -1)
+        field = block["field"].astype(np.int64)
+        values[run, field] = block["value"]
+        recorded[run, field] = run
+        # carry every value forward to the runs that didn't change it
+        recorded = np.maximum.accumulate(recorded, axis=0)
+        values = np.where(recorded >= 0,
+                          values[np.maximum(recorded, 0),
+                                 np.arange(len(fields))], np.nan)
+
+        keep = slice(first - start, None)
+        frame = pandas.DataFrame(values[keep], columns=fields)
+        frame["obama"] = runs["obama"][first:until + 1]
+        frame["romney"] = runs["romney"][first:until + 1]
+        frame.index = pandas.to_datetime(
+                        np.asarray(runs["when"][first:until + 1]), unit="ns")
+        frame.index.name = "when"
+        return frame[columns]
+
+    def append(self, when, values, ev):
+        """
+        Add a run.
+
+        Parameters
+        ----------
+        when : datetime-like
+            The run's timestamp, no earlier than the last run's.
+        values : DataFrame
+            By state, with any of FIELDS as columns.
+        ev : dict
+            obama and romney electoral votes.
+        """
+        runs, changes = self._load()
+        when = pandas.Timestamp(when).as_unit("ns").value
+        if len(runs) and when < runs["when"][-1]:
+            raise ValueError("Runs must be appended in time order")
+        fields = self.meta["fields"]
+        nruns = len(runs)
+        previous = self._values(nruns - 1)
+
+        states = self.meta["states"]
+        new = [s for s in values.index.astype(str) if s not in states]
+        if new:
+            states.extend(new)
+            self._write_meta()
+        current = np.full((len(states), len(fields)), np.nan)
+        rows = pandas.Index(states).get_indexer(values.index.astype(str))
+        current[rows] = values.reindex(columns=fields).values.astype(float)
+        old = np.full(current.shape, np.nan)
+        old[:len(previous)] = previous
+
+        every = self.meta["keyframe_every"]
+        keyframe = nruns if not nruns else runs["keyframe"][-1]
+        if nruns - keyframe >= every:
+            keyframe = nruns
+        if keyframe == nruns:
+            changed = np.ones(current.shape, dtype=bool)
+        else:
+            changed = ~((current == old) |
+                        (np.isnan(current) & np.isnan(old)))
+        state, field = np.nonzero(changed)
+        block = np.empty(len(state), dtype=CHANGE)
+        block["state"], block["field"] = state, field
+        block["value"] = current[state, field]
+
+        offset = 0
+        if nruns:
+            offset = int(runs["offset"][-1]) + int(runs["count"][-1])
+        record = np.array([(when, ev["obama"], ev["romney"], keyframe,
+                            offset, len(block))], dtype=RUN)
+        # changes first, so a reader never sees a run without them. a
+        # crash in between leaves changes past the last run; drop them
+        with open(self._changes_path, "ab") as fout:
+            fout.truncate(offset * CHANGE.itemsize)
+            fout.write(block.tobytes())
+        with open(self._runs_path, "ab") as fout:
+            fout.write(record.tobytes())
+        self._size = None
+        return nruns
+
+    def record(self, out, when=None):
+        """
+        Add a run from the results of pipeline.run (or anything with
+        results, trends, m_correction and ev).
+        """
+        values = pandas.DataFrame(dict(
+                    poll=out["results"]["poll"],
+                    trend=out["trends"].reindex(out["results"].index),
+                    m_correction=out["m_correction"].reindex(
+                                    out["results"].index)))
+        return self.append(when or pandas.Timestamp.now(), values, out["ev"])
@@ -0,0 +1,274 @@
+"""
+Serve the forecast over HTTP from an in-memory, versioned snapshot.
+
+All responses are rendered to JSON bytes when a snapshot is built, so a
+request never touches the pipeline. A recompute runs the pipeline in a
+background process and swaps the new snapshot in when it's done;
+requests already in flight keep the snapshot they started with.
+
+Routes:
+
+    GET  /national            EV totals and the national summary
+    GET  /states              every state's margin and call
+    GET  /states/<State>      one state, e.g. /states/Ohio
+    GET  /trends              cluster trend and m_correction by state
+    GET  /version             snapshot version
+    POST /recompute           rerun the pipeline in the background
+    GET  /recompute           whether one is running and the last error
+
+Every GET carries an ETag and honors If-None-Match. A failed recompute
+is logged, the old snapshot stays up and the error is reported by
+GET /recompute until the next one succeeds.
+
+Usage:
+
+    python forecast_service.py --port 8538
+"""
+import argparse
+import asyncio
+import datetime
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import unquote
+
+import numpy as np
+
+import pipeline
+
+logger = logging.getLogger(__name__)
+
+REASONS = {200 : "OK", 202 : "Accepted", 304 : "Not Modified",
+           404 : "Not Found", 405 : "Method Not Allowed",
+           400 : "Bad Request"}
+
+
+def _etag_matches(header, etag):
+    """
+    Whether an If-None-Match header matches `etag`: "*" or any of its
+    listed tags, compared weakly (a W/ prefix is ignored).
+    """
+    if header is None:
+        return False
+    tags = re.findall(r'\*|(?:W/)?"[^"]*"', header)
+    return any(tag == "*" or tag.replace("W/", "", 1) == etag
+               for tag in tags)
+
+
+def _number(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return float(value)
+
+
+class Snapshot(object):
+    """
+    Pre-rendered responses for one pipeline run.
+    """
+    def __init__(self, out, version, created=None):
+        self.version = version
+        self.created = created or datetime.datetime.now()
+        results = out["results"]
+        trends = out["trends"]
+        m_correction = out["m_correction"]
+        adjusted = out["adjusted"]
+
+        states = {}
+        for state, row in results.iterrows():
+            states[state] = dict(state=state, poll=_number(row["poll"]),
+                                 votes=int(row["Votes"]),
+                                 obama=int(row["obama"]),
+                                 romney=int(row["romney"]),
+                                 trend=_number(trends.get(state)),
+                                 m_correction=_number(m_correction.get(state)),
+                                 adjusted_trend=_number(adjusted.get(state)))
+        national = dict(ev=out["ev"], version=version,
+                        created=self.created.isoformat(),
+                        states_called=int(results[["obama", "romney"]]
+                                          .values.sum()))
+        trend_table = dict((state, dict(trend=_number(trends.get(state)),
+                                        m_correction=_number(
+                                            m_correction.get(state))))
+                           for state in sorted(set(trends.index) |
+                                               set(m_correction.index)))
+
+        self.pages = {"/national" : national,
+                      "/states" : list(states.values()),
+                      "/trends" : trend_table,
+                      "/version" : dict(version=version,
+                                        created=self.created.isoformat())}
+        for state, body in states.items():
+            self.pages["/states/" + state] = body
+        self.rendered = {}
+        for path, body in self.pages.items():
+            data = json.dumps(body, sort_keys=True).encode()
+            etag = '"%d-%s"' % (version, hashlib.sha1(data).hexdigest()[:16])
+            self.rendered[path] = (data, etag)
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as fout:
+            pickle.dump(self, fout, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as fin:
+            return pickle.load(fin)
+
+
+def _compute():
+    out = pipeline.run()
+    # only what Snapshot needs goes back over the process boundary
+    return dict((key, out[key]) for key in ["results", "trends",
+                                            "m_correction", "adjusted", "ev"])
+
+
+class ForecastService(object):
+    def __init__(self, snapshot=None, compute=_compute,
+                 snapshot_path="data/snapshot.pkl"):
+        self.snapshot = snapshot
+        self.compute = compute
+        self.snapshot_path = snapshot_path
+        self._executor = ProcessPoolExecutor(1)
+        self._recompute = None
+        self.error = None
+        if self.snapshot is None and snapshot_path and os.path.exists(
+                snapshot_path):
+            self.snapshot = Snapshot.load(snapshot_path)
+
+    async def recompute(self):
+        """
+        Run the pipeline in the background worker and swap in the result.
+        """
+        loop = asyncio.get_running_loop()
+        out = await loop.run_in_executor(self._executor, self.compute)
+        version = self.snapshot.version + 1 if self.snapshot else 1
+        snapshot = await loop.run_in_executor(None, Snapshot, out, version)
+        if self.snapshot_path:
+            await loop.run_in_executor(None, snapshot.save,
+                                       self.snapshot_path)
+        # a single reference swap, in-flight requests hold the old one
+        self.snapshot = snapshot
+        return snapshot
+
+    def _finished(self, task):
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc is None:
+            self.error = None
+        else:
+            self.error = "%s: %s" % (type(exc).__name__, exc)
+            logger.error("recompute failed", exc_info=exc)
+
+    def trigger(self):
+        if self._recompute is None or self._recompute.done():
+            self._recompute = asyncio.ensure_future(self.recompute())
+            self._recompute.add_done_callback(self._finished)
+            return True
+        return False
+
+    def status(self):
+        running = self._recompute is not None and not self._recompute.done()
+        return dict(running=running, error=self.error,
+                    version=getattr(self.snapshot, "version", None))
+
+    def respond(self, method, path, headers):
+        """
+        Status, headers and body for one request.
+        """
+        path = unquote(path.split("?", 1)[0]).rstrip("/") or "/"
+        if path == "/recompute":
+            if method in ("GET", "HEAD"):
+                return 200, {"Cache-Control" : "no-cache"}, json.dumps(
+                                                    self.status()).encode()
+            if method != "POST":
+                return 405, {}, b""
+            started = self.trigger()
+            body = dict(self.status(), started=started)
+            return 202, {}, json.dumps(body).encode()
+        if method not in ("GET", "HEAD"):
+            return 405, {}, b""
+        snapshot = self.snapshot
+        if snapshot is None:
+            return 404, {}, b'{"error": "no snapshot yet"}'
+        if path not in snapshot.rendered:
+            return 404, {}, b'{"error": "not found"}'
+        data, etag = snapshot.rendered[path]
+        if _etag_matches(headers.get("if-none-match"), etag):
+            return 304, {"ETag" : etag}, b""
+        return 200, {"ETag" : etag, "Cache-Control" : "no-cache"}, data
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    method, path, version = line.decode("latin-1").split()
+                except ValueError:
+                    await self._send(writer, 400, {}, b"", False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get("content-length", 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._send(writer, 400, {}, b"", False)
+                    break
+                if length:
+                    await reader.readexactly(length)
+                keep_alive = (headers.get("connection", "").lower() !=
+                              "close" and version == "HTTP/1.1")
+                status, extra, body = self.respond(method, path, headers)
+                await self._send(writer, status, extra, body, keep_alive,
+                                 head=method == "HEAD")
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send(self, writer, status, headers, body, keep_alive,
+                    head=False):
+        """
+        Write a response. HEAD gets the headers GET would, body length
+        included, without the body.
+        """
+        lines = ["HTTP/1.1 %d %s" % (status, REASONS[status]),
+                 "Content-Type: application/json",
+                 "Content-Length: %d" % len(body),
+                 "Connection: %s" % ("keep-alive" if keep_alive else "close")]
+        lines += ["%s: %s" % item for item in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() +
+                     (b"" if head else body))
+        await writer.drain()
+
+    async def serve(self, host="127.0.0.1", port=8538):
+        if self.snapshot is None:
+            await self.recompute()
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8538)
+    args = parser.parse_args()
+    asyncio.run(ForecastService().serve(args.host, args.port))
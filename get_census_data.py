@@ -1,6 +1,29 @@
 """
 Census data downloaded from quickfacts.census.gov/qfd/download_data.html
+
+The QuickFacts files are read from a local directory (the URLs below are
+where to get them):
+
+    DataSet.txt           counties, states and the US, comma delimited
+    FIPS_CountyName.txt   FIPS code to name, fixed width
+
+DataDict.txt (data_info) describes the variables but isn't needed, the
+items are matched on their codes. Only the variables used are read, as
+float64 (FIPS as int64) and in chunks, keeping the state rows (FIPS
+xx000) of each chunk. Item codes end in the vintage, e.g. PST045211 is
+the 2011 population estimate, so variables are matched on the first six
+characters and the file's vintage is the latest suffix among them. The
+derived table is cached by vintage.
+
+Usage:
+
+    python get_census_data.py [path to the QuickFacts files]
+
+    census = load_census("data/census/")
 """
+import os
+import sys
+
 import pandas
 
 # this includes counties, state, and aggregate
@@ -11,83 +34,103 @@ data_info = "http://quickfacts.census.gov/qfd/download/DataDict.txt"
 # these are the mappings that we want - fixed width file
 fips_names = "http://quickfacts.census.gov/qfd/download/FIPS_CountyName.txt"
 
+# item code prefix -> name. the last three characters are the vintage
+variables = {"PST045" : "tot_pop",         # Total Pop
+             "AGE295" : "per_18",          # % Under 18
+             "AGE775" : "per_65",          # % Over 65
+             "RHI225" : "per_black",       # % Black
+             "RHI725" : "per_hisp",        # % Hispanic, not mutually excl.
+             "RHI825" : "per_white",       # % White, Non-Hispanic
+             "EDU635" : "educ_hs",         # % high school grad
+             "EDU685" : "educ_coll",       # % bachelor's degree
+             "INC910" : "average_income",  # per capita income
+             "INC110" : "median_income",   # median household income
+             "POP060" : "pop_density"}     # pop per sq mile
+
+COLUMNS = ["per_black", "per_hisp", "per_white", "educ_hs", "educ_coll",
+           "average_income", "median_income", "pop_density", "vote_pop",
+           "older_pop", "per_older", "per_vote"]
+
+
+def resolve_columns(path):
+    """
+    The DataSet.txt column of each variable and the file's vintage.
+    """
+    header = pandas.read_csv(path, nrows=0).columns
+    columns = {}
+    for code in header:
+        name = variables.get(code[:6])
+        if name is not None:
+            # keep the latest vintage if an item appears more than once
+            if name not in columns or code[6:] > columns[name][6:]:
+                columns[name] = code
+    missing = set(variables.values()) - set(columns)
+    if missing:
+        raise ValueError("%s has no column for %s" % (path,
+                                                      sorted(missing)))
+    vintage = max(code[6:] for code in columns.values())
+    return columns, vintage
+
+
+def read_fips_names(path):
+    return pandas.read_fwf(path, colspecs=[(0, 5), (6, None)],
+                           header=None, names=["FIPS", "name"],
+                           dtype={"FIPS" : int, "name" : str})
+
+
+def read_states(path, columns, chunksize=1000):
+    """
+    The state rows of DataSet.txt, for the resolved columns only.
+    """
+    dtypes = dict((code, "float64") for code in columns.values())
+    dtypes["FIPS"] = "int64"
+    reader = pandas.read_csv(path, usecols=["FIPS"] + list(columns.values()),
+                             dtype=dtypes, chunksize=chunksize)
+    parts = [chunk[(chunk["FIPS"] % 1000 == 0) & (chunk["FIPS"] > 0)]
+             for chunk in reader]
+    states = pandas.concat(parts, ignore_index=True)
+    return states.rename(columns=dict((code, name) for name, code
+                                      in columns.items()))
+
+
+def derive(states):
+    """
+    vote_pop, older_pop, per_older and per_vote, and the output columns.
+    """
+    tot_pop = states["tot_pop"]
+    older_pop = states["per_65"] / 100. * tot_pop
+    vote_pop = tot_pop - states["per_18"] / 100. * tot_pop - older_pop
+    states = states.assign(vote_pop=vote_pop, older_pop=older_pop,
+                           per_older=older_pop / tot_pop,
+                           per_vote=vote_pop / tot_pop)
+    return states.set_index("state")[COLUMNS]
+
+
+def load_census(path="data/census/", cache=True, chunksize=1000):
+    """
+    The state demographics of census_demographics.csv from the QuickFacts
+    files in `path`, cached there by vintage.
+    """
+    data_path = os.path.join(path, "DataSet.txt")
+    columns, vintage = resolve_columns(data_path)
+    cache_path = os.path.join(path, "census_states_%s.csv" % vintage)
+    if cache and os.path.exists(cache_path) and (
+            os.path.getmtime(cache_path) >= os.path.getmtime(data_path)):
+        return pandas.read_csv(cache_path, index_col="state")
+
+    states = read_states(data_path, columns, chunksize)
+    names = read_fips_names(os.path.join(path, "FIPS_CountyName.txt"))
+    states = states.merge(names, on="FIPS", how="left")
+    if states["name"].isnull().any() or len(states) != 51:
+        raise ValueError("Expected 51 named states, got %d" % len(states))
+    states["state"] = states["name"].str.upper()
+    census = derive(states)
+    if cache:
+        census.to_csv(cache_path + ".tmp")
+        os.replace(cache_path + ".tmp", cache_path)
+    return census
+
 
-full_data = pandas.read_csv(full_data_url)
-fips_names = pandas.read_fwf(fips_names, [(0,5),(6,-1)], header=None,
-                             names=["FIPS", "name"])
-#NOTE: this is fixed width and I'm not counting the stupid columns so
-#we're going to do it programmatically
-# note that one of the column headers is centered while the others aren't
-from urllib2 import urlopen
-import re
-headers = urlopen(data_info).readline()
-match = re.search("^(\w+\W)(\s{2}\s+\w+\s+\s{2})(\s{2}\w+\s+)"
-                  "(\w+\s+)(\w+\s+)(\w+)", headers)
-cols = [(headers.index(var_name), headers.index(var_name)+len(var_name)) for
-        var_name in match.groups()]
-var_info = pandas.read_fwf(data_info, cols)
-
-# convert numbers to state/county names
-fips_mapping = {}
-for _, (fips, name) in fips_names.iterrows():
-    fips_mapping.update({str(fips) : name})
-
-fips_names = full_data.FIPS.astype(str).replace(fips_mapping)
-del full_data['FIPS']
-full_data['FIPS'] = fips_names
-
-# just keep the states
-states = full_data.FIPS.ix[~full_data.FIPS.str.contains(",")]
-states = states.ix[~(states == "UNITED STATES")]
-assert len(states) == 51
-idx = states.index
-full_data_states = full_data.ix[idx]
-
-# Total Pop, 1
-# % Under 18, 6
-# Over 65, 7
-# % females, 8
-# % Black, 10
-# % Native American, 11
-# % Hispanic, 15
-# % White, Non-Hispanic, 16
-# % high school grad, 20
-# % bachelor's degree, 21
-# per capita income, 30
-# median household income, 31
-# pop per sq mile, 51
-rows = [1,6,7,8,10,11,15,16,20,21,30,31,51]
-var_info = var_info.ix[rows][["Data_Item","Item_Description"]]
-full_data_states = full_data_states.filter(var_info.Data_Item.tolist() +
-                                            ["FIPS"])
-
-tot_pop = full_data["PST045211"]
-per_18 = full_data["AGE295211"]/100. # under 18
-per_65 = full_data["AGE775211"]/100. # over 65
-older_pop = per_65*tot_pop
-vote_pop = tot_pop - per_18*tot_pop - older_pop
-full_data_states["vote_pop"] = vote_pop
-full_data_states["older_pop"] = older_pop
-del full_data_states["PST045211"]
-del full_data_states["AGE295211"]
-del full_data_states["AGE775211"]
-del full_data_states["SEX255211"] # % females - not enough variation
-del full_data_states["RHI325211"]
-full_data_states["per_older"] = older_pop / tot_pop
-full_data_states["per_vote"] = vote_pop / tot_pop
-
-full_data_states.rename(columns={
-                        "INC110210" : "median_income",
-                        "INC910210" : "average_income",
-                        "POP060210" : "pop_density",
-                        "EDU635210" : "educ_hs",
-                        "EDU685210" : "educ_coll",
-                        "RHI825211" : "per_white",
-                        "RHI725211" : "per_hisp", # not mutually excl.
-                        "FIPS"      : "state",
-                        "RHI225211" : "per_black",
-                                }, inplace=True)
-full_data_states.set_index("state", inplace=True)
-
-full_data_states.to_csv("/home/skipper/school/seaboldgit/talks/pydata/"
-                        "data/census_demographics.csv")
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "data/census/"
+    load_census(path).to_csv("data/census_demographics.csv")
@@ -0,0 +1,177 @@
+"""
+How much each pollster, or each poll, moves the snapshot.
+
+A state's number is a ratio of weighted sums: every (state, pollster)
+average is sum(w * spread) / sum(w) over its polls, with w the time weight
+times the MESS, and the state is sum(Weight * average) / sum(Weight) over
+its pollsters and the national trend. Keeping those numerators and
+denominators around, dropping a pollster is a subtraction from each sum,
+so every leave-one-pollster-out state average and EV tally comes out of
+one pass instead of one pipeline run per pollster.
+
+The cluster trends, m_correction and so the national trend term of every
+state are held at their values on all the polls; a pipeline rerun without
+a pollster refits the lowess trend of its clusters too, which moves the
+states by up to a few tenths of a point more. A state left without any
+polls gets no trend and no average, as in the pipeline. With the trend
+held fixed, MESS only depends on the earlier polls of the same
+(state, pollster), so leaving out a pollster is otherwise exact. Leaving
+out a single poll keeps the MESS of the later polls from that pollster as
+they were.
+
+Usage:
+
+    out = pipeline.run()
+    loo = leave_one_pollster_out(out["polls"], out["results"],
+                                 out["adjusted"])
+    loo["delta"].loc["Rasmussen"], loo["ev"].loc["Rasmussen"]
+    polls = leave_one_poll_out(out["polls"], out["results"], out["adjusted"])
+"""
+import numpy as np
+import pandas
+from scipy import sparse
+
+import pipeline
+from poll_schema import states_abbrev_dict
+
+
+class _Sums(object):
+    """
+    Numerators and denominators of the state averages.
+    """
+    def __init__(self, polls, results, adjusted=None, natl_weight=None):
+        state = polls["state"].astype(str).map(
+                    lambda s : states_abbrev_dict.get(s, s)).values
+        pollster = polls["pollster"].astype(str).values
+        self.group, groups = pandas.factorize(
+                    pandas.MultiIndex.from_arrays([state, pollster]))
+        self.states = results.index
+        self.state = self.states.get_indexer(groups.get_level_values(0))
+        if (self.state < 0).any():
+            raise ValueError("Polls for states missing from results")
+        self.pollster, self.pollsters = pandas.factorize(
+                                            groups.get_level_values(1))
+        ngroups = len(groups)
+
+        self.w = (polls["time_weight"] * polls["MESS"]).values
+        self.wy = self.w * polls["spread"].values
+        self.num = np.bincount(self.group, self.wy, ngroups)
+        self.den = np.bincount(self.group, self.w, ngroups)
+        self.npolls = np.bincount(self.group, minlength=ngroups)
+        weight = pandas.Series(polls["Weight"].values, index=self.group)
+        self.weight = weight.groupby(level=0).first().sort_index().values
+        self.average = self.num / self.den
+
+        nstates = len(self.states)
+        self.state_num = np.bincount(self.state, self.weight * self.average,
+                                     nstates)
+        self.state_den = np.bincount(self.state, self.weight, nstates)
+        # the pollster weight alone; without any polls there's no trend
+        self.poll_den = self.state_den.copy()
+        if adjusted is not None:
+            if natl_weight is None:
+                natl_weight = pipeline.load_weights().Weight.mean()
+            trend = adjusted.reindex(self.states).values
+            has = np.isfinite(trend)
+            self.state_num[has] += natl_weight * trend[has]
+            self.state_den[has] += natl_weight
+
+    def estimate(self):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.state_num / self.state_den
+
+
+def leave_one_pollster_out(polls, results, adjusted=None, natl_weight=None):
+    """
+    Every state average and EV tally with each pollster left out.
+
+    Parameters
+    ----------
+    polls : DataFrame
+        Polls with state, pollster, spread, time_weight, MESS and Weight, as
+        pipeline.state_averages returns them.
+    results : DataFrame
+        The snapshot, indexed by State with poll and Votes.
+    adjusted : Series, optional
+        trend * m_correction by state, weighted in as the "National"
+        pollster as in the snapshot.
+    natl_weight : float, optional
+        Weight of the national trend. Defaults to the mean weight in
+        pollster_weights.csv.
+
+    Returns
+    -------
+    dict with
+
+    poll : DataFrame
+        pollsters x states, the state averages without the pollster, with
+        the trend held fixed. NaN where the pollster was all a state had.
+    delta : DataFrame
+        poll minus the full snapshot.
+    ev : DataFrame
+        obama and romney EV by pollster left out, and the change in
+        obama's EV.
+    """
+    sums = _Sums(polls, results, adjusted, natl_weight)
+    shape = (len(sums.pollsters), len(sums.states))
+    # what each pollster contributes to each state
+    contrib_num = sparse.csr_matrix((sums.weight * sums.average,
+                                     (sums.pollster, sums.state)), shape)
+    contrib_den = sparse.csr_matrix((sums.weight,
+                                     (sums.pollster, sums.state)), shape)
+    num = sums.state_num - contrib_num.toarray()
+    den = sums.state_den - contrib_den.toarray()
+    polled = sums.poll_den - contrib_den.toarray() > 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        poll = np.where(polled, num / np.where(polled, den, 1), np.nan)
+    full = sums.estimate()
+
+    obama, romney = pipeline.call_states(poll.T, sums.states)
+    votes = results["Votes"].astype(float).values
+    base_obama, _ = pipeline.call_states(full[:, None], sums.states)
+    ev = pandas.DataFrame(dict(obama=np.dot(votes, obama).astype(int),
+                               romney=np.dot(votes, romney).astype(int)),
+                          index=pandas.Index(sums.pollsters, name="Pollster"))
+    ev["obama_change"] = ev["obama"] - int(np.dot(votes, base_obama[:, 0]))
+
+    index = pandas.Index(sums.pollsters, name="Pollster")
+    poll = pandas.DataFrame(poll, index=index, columns=sums.states)
+    delta = poll - full
+    return dict(poll=poll, delta=delta, ev=ev)
+
+
+def leave_one_poll_out(polls, results, adjusted=None, natl_weight=None):
+    """
+    The state average and EV with each poll left out.
+
+    Returns a DataFrame on the index of `polls` with State, the state
+    average without the poll (loo), its change from the full snapshot
+    (delta) and the change in obama's EV (ev_change).
+    """
+    sums = _Sums(polls, results, adjusted, natl_weight)
+    g = sums.group
+    s = sums.state[g]
+    weight = sums.weight[g]
+    # the (state, pollster) average without the poll
+    rest_num = sums.num[g] - sums.wy
+    rest_den = sums.den[g] - sums.w
+    alone = sums.npolls[g] == 1
+    with np.errstate(invalid="ignore", divide="ignore"):
+        average = np.where(alone, 0., rest_num / np.where(alone, 1.,
+                                                          rest_den))
+    num = sums.state_num[s] - weight * sums.average[g] + np.where(
+                                            alone, 0., weight * average)
+    den = sums.state_den[s] - np.where(alone, weight, 0.)
+    polled = sums.poll_den[s] - np.where(alone, weight, 0.) > 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        loo = np.where(polled, num / np.where(polled, den, 1), np.nan)
+    full = sums.estimate()
+
+    votes = results["Votes"].astype(float).values
+    states = sums.states[s]
+    new_obama, _ = pipeline.call_states(loo, states)
+    old_obama, _ = pipeline.call_states(full[s], states)
+    return pandas.DataFrame(dict(State=states, loo=loo, delta=loo - full[s],
+                                 ev_change=votes[s] * (new_obama -
+                                                       old_obama)),
+                            index=polls.index)
@@ -0,0 +1,246 @@
+"""
+Persist fitted models with a fingerprint of their training inputs.
+
+The regressions and clusterings in silver_model.py and
+historical_adjustment.py (dummy_model, m_model, KNN, k_means, the vq
+kmeans and the poll_change ols) are refit on every run. The registry
+keeps just the fitted parameters of each one on disk, keyed by a hash of
+the data and settings it was fit with, and hands back a small artifact
+that can predict without refitting or going back through patsy.
+
+Usage:
+
+    registry = ModelRegistry("data/models")
+    m_model = registry.fit("m_model",
+                           lambda : wls(formula, data=m_regression_data,
+                                        weights=time_weights).fit(),
+                           formula, m_regression_data, time_weights)
+    state_m = m_model.predict(exog)
+
+    # intraday, predictions only from the morning's fit
+    m_model = registry.load("m_model")
+"""
+import datetime
+import hashlib
+import os
+import pickle
+import re
+
+import numpy as np
+import pandas
+
+
+def fingerprint(*inputs):
+    """
+    Hash the training inputs of a model. Frames and Series are hashed
+    by value (including the index), arrays by their bytes and anything
+    else by its repr.
+    """
+    sha = hashlib.sha1()
+    for obj in inputs:
+        if isinstance(obj, (pandas.DataFrame, pandas.Series)):
+            names = (obj.columns if isinstance(obj, pandas.DataFrame)
+                     else [obj.name])
+            sha.update(repr(list(names)).encode())
+            sha.update(pandas.util.hash_pandas_object(obj).values.tobytes())
+        elif isinstance(obj, np.ndarray):
+            sha.update(str(obj.dtype).encode())
+            sha.update(np.ascontiguousarray(obj).tobytes())
+        else:
+            sha.update(repr(obj).encode())
+    return sha.hexdigest()
+
+
+class LinearFit(object):
+    """
+    Coefficients of a fitted (W)LS model and how to rebuild its design
+    columns from raw data.
+
+    Column names are the ones patsy gives, so "Intercept", "PVI",
+    "np.log(median_income)", "C(kmeans_groups)[T.3]" and interactions
+    like "no_party:np.log(median_income)" are all understood. "const" is
+    accepted as the intercept for exog built by hand.
+    """
+    def __init__(self, params, exog_names, categories=None):
+        self.params = pandas.Series(np.asarray(params), index=exog_names)
+        self.exog_names = list(exog_names)
+        # factor code -> list of levels as they were in the training data
+        self.categories = categories or {}
+
+    @classmethod
+    def from_results(cls, results):
+        categories = {}
+        data = results.model.data
+        design_info = getattr(data, "design_info",
+                              getattr(data.orig_exog, "design_info", None))
+        if design_info is not None:
+            for factor, info in design_info.factor_infos.items():
+                if info.type == "categorical":
+                    categories[factor.code] = list(info.categories)
+        return cls(results.params, results.model.exog_names, categories)
+
+    def _factor(self, code, data):
+        match = re.match(r"^(C\(.+\))\[T\.(.+)\]$", code)
+        if match:
+            factor, level = match.groups()
+            levels = self.categories.get(factor, [])
+            var = re.match(r"^C\((\w+)\)", factor).group(1)
+            if level in [str(lvl) for lvl in levels]:
+                level = levels[[str(lvl) for lvl in levels].index(level)]
+                return (np.asarray(data[var]) == level).astype(float)
+            return (np.asarray(data[var]).astype(str) == level).astype(float)
+        if code in data:
+            return np.asarray(data[code], dtype=float)
+        return np.asarray(eval(code, {"np" : np}, data), dtype=float)
+
+    def design(self, data):
+        """
+        Build the design matrix for `data` in the order of `exog_names`.
+        """
+        nobs = len(data)
+        columns = []
+        for name in self.exog_names:
+            if name in ("Intercept", "const"):
+                columns.append(np.ones(nobs))
+                continue
+            column = np.ones(nobs)
+            for code in name.split(":"):
+                column = column * self._factor(code, data)
+            columns.append(column)
+        return np.column_stack(columns)
+
+    def predict(self, exog):
+        if isinstance(exog, pandas.DataFrame):
+            index = exog.index
+            exog = self.design(exog)
+        else:
+            index = None
+        fitted = np.dot(np.asarray(exog, dtype=float), self.params.values)
+        if index is not None:
+            return pandas.Series(fitted, index=index)
+        return fitted
+
+
+class ClusterFit(object):
+    """
+    Cluster centroids (from KMeans or vq.kmeans) and the training labels.
+    """
+    def __init__(self, centers, labels=None):
+        self.cluster_centers_ = np.asarray(centers)
+        self.labels_ = None if labels is None else np.asarray(labels)
+
+    def predict(self, data):
+        # same as choose_group in silver_model.py
+        data = np.asarray(data)
+        distances = ((data[:, None] - self.cluster_centers_)**2).sum(-1)
+        return distances.argmin(1)
+
+
+class NeighborsFit(object):
+    """
+    The training points of a nearest neighbors fit and every training
+    point's neighborhood, computed once at fit time.
+    """
+    def __init__(self, data, n_neighbors, index=None):
+        self.data = np.asarray(data, dtype=float)
+        self.n_neighbors = n_neighbors
+        self.index = None if index is None else list(index)
+        self.distances, self.neighbors = self.kneighbors(self.data)
+
+    def kneighbors(self, points, n_neighbors=None):
+        n_neighbors = n_neighbors or self.n_neighbors
+        points = np.atleast_2d(points)
+        dist = np.sqrt(((points[:, None] - self.data)**2).sum(-1))
+        idx = np.argsort(dist, axis=1, kind="mergesort")[:, :n_neighbors]
+        return np.take_along_axis(dist, idx, 1), idx
+
+    def neighborhood(self, label):
+        """
+        Nearest neighbors of a training point, by label.
+        """
+        if self.index is None:
+            raise ValueError("neighborhood needs the labels of the training "
+                             "points, pass index when building the fit")
+        i = self.index.index(label)
+        names = [self.index[j] for j in self.neighbors[i]]
+        return names, self.distances[i]
+
+
+def to_artifact(fitted, data=None, index=None):
+    """
+    Reduce a fitted model to the parameters needed to predict.
+
+    A scikit-learn nearest neighbors fit doesn't expose its training
+    points, so they have to be passed as `data`, and `index` labels them
+    for NeighborsFit.neighborhood.
+    """
+    if isinstance(fitted, (LinearFit, ClusterFit, NeighborsFit)):
+        return fitted
+    if hasattr(fitted, "params") and hasattr(fitted, "model"):
+        return LinearFit.from_results(fitted)
+    if hasattr(fitted, "cluster_centers_"):
+        return ClusterFit(fitted.cluster_centers_,
+                          getattr(fitted, "labels_", None))
+    if hasattr(fitted, "kneighbors"):
+        if data is None:
+            raise ValueError("Storing a nearest neighbors fit needs the "
+                             "data it was fit on")
+        if len(data) != fitted.n_samples_fit_:
+            raise ValueError("data has %d rows, the fit had %d" %
+                             (len(data), fitted.n_samples_fit_))
+        return NeighborsFit(data, fitted.n_neighbors, index)
+    if isinstance(fitted, tuple): # vq.kmeans returns (codebook, distortion)
+        return ClusterFit(fitted[0])
+    if isinstance(fitted, np.ndarray):
+        return ClusterFit(fitted)
+    raise ValueError("Don't know how to store %s" % type(fitted))
+
+
+class ModelRegistry(object):
+    def __init__(self, path="data/models"):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def _file(self, name):
+        return os.path.join(self.path, name + ".pkl")
+
+    def save(self, name, fitted, key, data=None, index=None):
+        artifact = to_artifact(fitted, data, index)
+        record = dict(fingerprint=key, artifact=artifact,
+                      created=datetime.datetime.now())
+        tmp = self._file(name) + ".tmp"
+        with open(tmp, "wb") as fout:
+            pickle.dump(record, fout, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._file(name))
+        return artifact
+
+    def record(self, name):
+        if not os.path.exists(self._file(name)):
+            return None
+        with open(self._file(name), "rb") as fin:
+            return pickle.load(fin)
+
+    def load(self, name, key=None):
+        """
+        Load the stored fit for `name`. If `key` is given it has to match
+        the fingerprint the model was stored with.
+        """
+        record = self.record(name)
+        if record is None:
+            raise KeyError("No fitted model stored for %s" % name)
+        if key is not None and record["fingerprint"] != key:
+            raise KeyError("Stored %s was fit on different inputs" % name)
+        return record["artifact"]
+
+    def fit(self, name, fit_func, *inputs, **kwargs):
+        """
+        Return the stored fit for `name` if it was fit on the same
+        `inputs`, else call `fit_func()`, store the result and return it.
+        `data` and `index` keywords go to to_artifact.
+        """
+        key = fingerprint(*inputs)
+        record = self.record(name)
+        if record is not None and record["fingerprint"] == key:
+            return record["artifact"]
+        return self.save(name, fit_func(), key, **kwargs)
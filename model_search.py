@@ -0,0 +1,205 @@
+"""
+Screen many specifications of the historical_adjustment.py regression at
+once.
+
+The design matrix of the largest candidate model is built once, and so is
+its Gram matrix [X y]'[X y]. Every candidate is a subset of its terms, and
+everything needed to score an OLS on a subset of columns is a slice of
+the Gram matrix: the coefficients solve G[S, S] b = G[S, y] and the
+residual sum of squares is G[y, y] - G[S, y]'b. K-fold cross validation
+works the same way with one Gram matrix per fold, since the training Gram
+is the total minus the fold's and the fold's squared error only needs the
+fold's Gram. Candidates are column subsets of the full design, so a
+categorical keeps the coding it has there. No candidate touches the n
+rows again, so thousands of them cost little more than one fit, and
+they're spread over processes.
+
+Usage:
+
+    formula = ("poll_change ~ C(kmeans_groups) + per_older*per_white + "
+               "per_hisp + no_party*np.log(median_income) + PVI")
+    table = search(formula, changes, jobs=4)
+    table.sort_values("bic").head()
+"""
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas
+import patsy
+from scipy import linalg
+
+_shared = {}
+
+
+class Design(object):
+    """
+    The full design matrix of a formula, its Gram matrices and the columns
+    of each term.
+
+    Parameters
+    ----------
+    formula : str
+        patsy formula of the largest model.
+    data : DataFrame
+    extra_terms : list, optional
+        More right hand side terms to consider, e.g. ["PVI:per_hisp"].
+    folds : int
+        Number of cross validation folds. 0 turns CV off.
+    """
+    def __init__(self, formula, data, extra_terms=None, folds=10, seed=None):
+        if extra_terms:
+            formula = formula + " + " + " + ".join(extra_terms)
+        y, X = patsy.dmatrices(formula, data, return_type="dataframe")
+        info = X.design_info
+        self.nobs = len(y)
+        self.exog_names = list(X.columns)
+        self.terms = [term for term in info.terms if term.factors]
+        self.term_names = [term.name() for term in self.terms]
+        self.columns = [np.arange(info.term_slices[term].start,
+                                  info.term_slices[term].stop)
+                        for term in self.terms]
+        self.fixed = np.concatenate([np.arange(s.start, s.stop)
+                                     for term, s in info.term_slices.items()
+                                     if not term.factors] +
+                                    [np.array([], dtype=int)])
+        Z = np.column_stack((X.values, y.values[:, 0]))
+        self.gram = np.dot(Z.T, Z)
+        self.fold_grams = None
+        if folds:
+            rng = np.random.default_rng(seed)
+            fold = rng.permutation(self.nobs) % folds
+            self.fold_grams = np.array([np.dot(Z[fold == f].T, Z[fold == f])
+                                        for f in range(folds)])
+
+    def candidates(self, required=(), max_terms=None, min_terms=0,
+                   hierarchical=True):
+        """
+        Term subsets, as tuples of term positions. With hierarchical, an
+        interaction only appears with all of its lower order terms.
+        """
+        required = [self.term_names.index(name) for name in required]
+        free = [i for i in range(len(self.terms)) if i not in required]
+        factors = [set(term.factors) for term in self.terms]
+        max_terms = len(free) if max_terms is None else max_terms
+        for size in range(min_terms, max_terms + 1):
+            for subset in itertools.combinations(free, size):
+                subset = tuple(sorted(required + list(subset)))
+                if hierarchical and not _is_hierarchical(subset, factors):
+                    continue
+                yield subset
+
+    def formula(self, subset):
+        names = [self.term_names[i] for i in subset]
+        return " + ".join(names) if names else "1"
+
+    def columns_of(self, subset):
+        return np.concatenate([self.fixed] +
+                              [self.columns[i] for i in subset]).astype(int)
+
+
+def _is_hierarchical(subset, factors):
+    present = [factors[i] for i in subset]
+    for these in present:
+        for lower in factors:
+            if lower < these and lower not in present:
+                return False
+    return True
+
+
+def _solve(gram, cols, y):
+    G = gram[np.ix_(cols, cols)]
+    b = gram[cols, y]
+    try:
+        return linalg.solve(G, b, assume_a="pos"), len(cols)
+    except (linalg.LinAlgError, ValueError):
+        beta, _, rank, _ = linalg.lstsq(G, b)
+        return beta, rank
+
+
+def _sse(gram, cols, y, beta):
+    G = gram[np.ix_(cols, cols)]
+    return (gram[y, y] - 2 * np.dot(beta, gram[cols, y]) +
+            np.dot(beta, np.dot(G, beta)))
+
+
+def score(gram, cols, nobs, fold_grams=None):
+    """
+    rss, r2, aic, bic and cv_mse of the OLS on the columns `cols` of the
+    Gram matrix. AIC and BIC are statsmodels' for OLS.
+    """
+    y = gram.shape[0] - 1
+    beta, k = _solve(gram, cols, y)
+    rss = gram[y, y] - np.dot(beta, gram[cols, y])
+    # centered total sum of squares, from the Gram of the constant
+    ybar = gram[0, y] / nobs if cols.size and cols[0] == 0 else 0.
+    tss = gram[y, y] - nobs * ybar**2
+    llf = -nobs / 2. * (np.log(2 * np.pi) + np.log(rss / nobs) + 1)
+    cv_mse = np.nan
+    if fold_grams is not None:
+        sse = 0.
+        for fold in fold_grams:
+            train_beta, _ = _solve(gram - fold, cols, y)
+            sse += _sse(fold, cols, y, train_beta)
+        cv_mse = sse / nobs
+    return dict(k=k, rss=rss, r2=1 - rss / tss, aic=-2 * llf + 2 * k,
+                bic=-2 * llf + np.log(nobs) * k, cv_mse=cv_mse)
+
+
+def _init(gram, fold_grams, nobs):
+    _shared.update(gram=gram, fold_grams=fold_grams, nobs=nobs)
+
+
+def _score_chunk(chunk):
+    return [score(_shared["gram"], cols, _shared["nobs"],
+                  _shared["fold_grams"]) for cols in chunk]
+
+
+def search(formula, data, extra_terms=None, required=(), max_terms=None,
+           min_terms=0, hierarchical=True, folds=10, jobs=1, chunk=500,
+           seed=0):
+    """
+    Fit and score every term subset of `formula`.
+
+    Parameters
+    ----------
+    formula : str
+        The largest model. Every candidate keeps its intercept.
+    data : DataFrame
+    extra_terms : list, optional
+        Terms to consider besides the formula's, such as interactions.
+    required : list
+        Term names every candidate must have, e.g. ["C(kmeans_groups)"].
+    max_terms, min_terms : int
+        Bounds on the number of optional terms.
+    hierarchical : bool
+        Only consider interactions along with their lower order terms.
+    folds : int
+        Cross validation folds, 0 to skip CV.
+    jobs : int
+        Processes to spread the candidates over.
+
+    Returns
+    -------
+    DataFrame with one row per candidate: formula, k (columns), rss, r2,
+    aic, bic and cv_mse, sorted by aic.
+    """
+    design = Design(formula, data, extra_terms, folds, seed)
+    subsets = list(design.candidates(required, max_terms, min_terms,
+                                     hierarchical))
+    cols = [design.columns_of(subset) for subset in subsets]
+    if jobs > 1:
+        chunks = [cols[i:i + chunk] for i in range(0, len(cols), chunk)]
+        with ProcessPoolExecutor(jobs, initializer=_init,
+                                 initargs=(design.gram, design.fold_grams,
+                                           design.nobs)) as pool:
+            scores = [s for part in pool.map(_score_chunk, chunks)
+                      for s in part]
+    else:
+        scores = [score(design.gram, c, design.nobs, design.fold_grams)
+                  for c in cols]
+    table = pandas.DataFrame(scores)
+    lhs = formula.split("~")[0].strip()
+    table.insert(0, "formula", [lhs + " ~ " + design.formula(subset)
+                                for subset in subsets])
+    return table.sort_values("aic").reset_index(drop=True)
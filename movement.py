@@ -0,0 +1,200 @@
+"""
+Poll movement at every horizon before Election Day, for the reversion to
+the mean model of historical_adjustment.py.
+
+historical_adjustment.py measures one horizon, the Oct 2 average against
+the Election Day average, with two get_state_averages calls per cycle.
+Here the averages for every day before the election come out of one pass
+over the sorted polls. Weighting a poll by .5**((t - date) / 30) as of day
+t is the same as weighting it by 2**((date - election) / 30), up to a
+factor that cancels in each average, so a (state, pollster) average as
+of any day is a ratio of two running sums down its polls, read off at
+the last poll on or before that day.
+
+The state average weights each pollster's average by its Weight once.
+get_state_averages merges the pollster averages with the poll rows, which
+counts a pollster once for each of its polls in every state; that
+duplication is not reproduced.
+
+Usage:
+
+    panel = movement_panel(horizons=range(0, 121))
+    oct2 = panel.xs(35, level="horizon")
+    panel.loc[("Ohio", 2008)]
+"""
+import datetime
+
+import numpy as np
+import pandas
+
+import pipeline
+import poll_schema
+from poll_schema import states_abbrev_dict
+
+elections = {2004 : datetime.datetime(2004, 11, 2),
+             2008 : datetime.datetime(2008, 11, 4),
+             2012 : datetime.datetime(2012, 11, 6)}
+
+
+def load_state_polls(cycles=(2004, 2008), weights=None, path="data/"):
+    """
+    State polls of the given cycles merged (inner) with the pollster
+    weights, with the full state name in State.
+    """
+    polls = poll_schema.load_all_polls(
+                pollster_map=path + "pollster_map.pkl")
+    polls = polls[polls["cycle"].isin(cycles) &
+                  (polls["state"].astype(str) != "USA")]
+    if weights is None:
+        weights = pipeline.load_weights(path + "pollster_weights.csv")
+    polls = polls.assign(pollster=polls["pollster"].astype(str))
+    polls = polls.merge(weights, how="inner", left_on="pollster",
+                        right_on="Pollster")
+    del polls["Pollster"]
+    polls["State"] = polls["state"].astype(str).map(states_abbrev_dict)
+    return polls
+
+
+def horizon_averages(polls, horizons=range(0, 121), half_life=30.,
+                     elections=elections):
+    """
+    The time weighted state average as of every horizon.
+
+    Parameters
+    ----------
+    polls : DataFrame
+        Polls with cycle, State, pollster, poll_date, spread and Weight.
+    horizons : sequence of int
+        Days before the election.
+
+    Returns
+    -------
+    DataFrame indexed by (State, cycle, horizon) with poll (the average
+    using polls up to that day), npolls and npollsters.
+    """
+    horizons = np.asarray(horizons, dtype=int)
+    election = polls["cycle"].map(elections)
+    day = (polls["poll_date"] - election).dt.days.values
+    polls = polls.assign(day=day)
+    polls = polls.sort_values(["cycle", "State", "pollster", "day"],
+                              kind="mergesort")
+    day = polls["day"].values
+    group, groups = pandas.factorize(pandas.MultiIndex.from_arrays(
+                        [polls["cycle"].values, polls["State"].values,
+                         polls["pollster"].values]))
+    # the groups come out in sorted order, so each one is a run of rows
+    starts = np.r_[0, np.flatnonzero(np.diff(group)) + 1]
+    ngroups = len(groups)
+
+    weight = .5**(-day / half_life)
+    num = np.cumsum(weight * polls["spread"].values)
+    den = np.cumsum(weight)
+    # subtract what the running sums carry in from earlier groups
+    num_before = np.r_[0, num][starts]
+    den_before = np.r_[0, den][starts]
+
+    # last poll of each group on or before each horizon, via one search
+    # over (group, day) keys
+    lo = min(day.min(), -horizons.max()) - 1
+    span = max(day.max(), -horizons.min()) - lo + 1
+    keys = group * span + (day - lo)
+    targets = (np.arange(ngroups)[:, None] * span +
+               (-horizons[None, :] - lo))
+    last = np.searchsorted(keys, targets, side="right") - 1
+    has = last >= starts[:, None]
+    last = np.where(has, last, 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        average = ((num[last] - num_before[:, None]) /
+                   (den[last] - den_before[:, None]))
+    count = np.where(has, last - starts[:, None] + 1, 0)
+
+    pollster_weight = polls["Weight"].values[starts]
+    state, states = pandas.factorize(pandas.MultiIndex.from_arrays(
+                        [groups.get_level_values(1),
+                         groups.get_level_values(0)]))
+    w = pollster_weight[:, None] * has
+    nstates = len(states)
+    state_num = np.zeros((nstates, len(horizons)))
+    state_den = np.zeros((nstates, len(horizons)))
+    npolls = np.zeros((nstates, len(horizons)), dtype=int)
+    npollsters = np.zeros((nstates, len(horizons)), dtype=int)
+    np.add.at(state_num, state, w * np.where(has, average, 0.))
+    np.add.at(state_den, state, w)
+    np.add.at(npolls, state, count)
+    np.add.at(npollsters, state, has.astype(int))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        poll = state_num / state_den
+
+    index = pandas.MultiIndex.from_arrays(
+                [np.repeat(states.get_level_values(0), len(horizons)),
+                 np.repeat(states.get_level_values(1), len(horizons)),
+                 np.tile(horizons, nstates)],
+                names=["State", "cycle", "horizon"])
+    return pandas.DataFrame(dict(poll=poll.ravel(), npolls=npolls.ravel(),
+                                 npollsters=npollsters.ravel()), index=index)
+
+
+def load_features(path="data/", econ=None):
+    """
+    Features by (State, cycle), the way historical_adjustment.py builds
+    them: the 2000 census for 2004, the mean of the 2000 census and the
+    current one for 2008 and the current one for 2012, each with the
+    current PVI and party affiliation. With an econ_store.SeriesStore as
+    `econ`, the cycle's econ averages are added to every state.
+    """
+    demo_data = pipeline.load_demographics(path)
+    census_2012 = demo_data.drop(["PVI", "dem_adv", "no_party",
+                                  "obama_give", "romney_give"], axis=1)
+    census_2000 = pandas.read_csv(path + "census_data_2000.csv",
+                                  index_col="State")
+    common = census_2000.columns.intersection(census_2012.columns)
+    census_2005 = (census_2000[common] + census_2012[common]) / 2.
+    census = pandas.concat({2004 : census_2000[common],
+                            2008 : census_2005,
+                            2012 : census_2012[common]}, names=["cycle"])
+    census = census.swaplevel().sort_index()
+    partisan = demo_data[["PVI", "dem_adv", "no_party"]]
+    features = census.join(partisan, on="State")
+    if econ is not None:
+        features = features.join(econ.econ_by_cycle(), on="cycle")
+    return features
+
+
+def movement_panel(polls=None, horizons=range(0, 121), features=None,
+                   updated_only=True, half_life=30., elections=elections):
+    """
+    The (State, cycle, horizon) panel of poll_change, the Election Day
+    average minus the average as of `horizon` days before, joined to the
+    features.
+
+    Parameters
+    ----------
+    polls : DataFrame, optional
+        State polls, load_state_polls() by default.
+    features : DataFrame, optional
+        Indexed by (State, cycle). load_features() by default; False for
+        none.
+    updated_only : bool
+        Keep only states with a poll after the horizon, as
+        historical_adjustment.py does.
+    """
+    if polls is None:
+        polls = load_state_polls()
+    horizons = np.union1d(horizons, [0])
+    averages = horizon_averages(polls, horizons, half_life, elections)
+    final = averages.xs(0, level="horizon")["poll"]
+    final = final.reindex(averages.index.droplevel("horizon")).values
+    panel = averages.rename(columns={"poll" : "poll_horizon"})
+    panel.insert(0, "poll_change", final - panel["poll_horizon"].values)
+    panel["poll_final"] = final
+    npolls_final = averages.xs(0, level="horizon")["npolls"]
+    npolls_final = npolls_final.reindex(
+                        averages.index.droplevel("horizon")).values
+    panel["updated"] = npolls_final > panel["npolls"].values
+    if updated_only:
+        panel = panel[panel["updated"] & panel["poll_horizon"].notnull()]
+    if features is None:
+        features = load_features()
+    if features is not False:
+        panel = panel.join(features, on=["State", "cycle"])
+    return panel
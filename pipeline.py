@@ -0,0 +1,466 @@
+"""
+The silver_model.py polling average, trend and snapshot stages as
+functions over the poll_schema table, with an option to run the stages
+that are independent per state or per cluster concurrently.
+
+Usage:
+
+    out = run()                          # serial
+    out = run(jobs=4)                    # threads
+    out = run(jobs=4, backend="process") # processes over shared memory
+    out["results"], out["ev"]
+
+Stages that are split up when jobs > 1:
+
+    calculate_mess       per state (groups are State, Pollster)
+    pollster_averages    per state
+    cluster_trends       per kmeans label
+    adjust_trends        per state (trend * m_correction)
+
+Each partition runs exactly the code the serial path runs on the same
+rows in the same order and the pieces are put back in the original row
+(or sorted key) order, so the output is identical to the serial run.
+"""
+import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas
+import statsmodels.api as sm
+from statsmodels.formula.api import ols, wls
+from scipy import cluster as sp_cluster
+from sklearn import cluster
+
+import poll_schema
+import shared_data
+from poll_schema import states_abbrev_dict
+
+today = datetime.datetime(2012, 10, 2)
+election = datetime.datetime(2012, 11, 6)
+
+red_states = ["Alabama", "Alaska", "Arkansas", "Idaho", "Kentucky",
+              "Louisiana", "Oklahoma", "Wyoming"]
+blue_states = ["Delaware", "District of Columbia"]
+
+M_FORMULA = "m ~ PVI + per_hisp + per_black + average_income + educ_coll"
+
+
+def exp_decay(days, half_life=30.):
+    # defensive coding, accepts timedeltas
+    days = getattr(days, "days", days)
+    return .5 ** (days/half_life)
+
+
+def average_error(nobs, p=50.):
+    return p*nobs**-.5
+
+
+def effective_sample(total_error, p=50.):
+    return p**2 * (total_error**-2.)
+
+
+# <headingcell level=3>
+# Running stages by partition
+
+def _run_part(args):
+    func, handle, positions, fargs = args
+    frame = shared_data.attach_frame(handle).iloc[positions]
+    return func(frame, *fargs)
+
+
+def map_partitions(func, frame, key, jobs=1, backend="thread", args=()):
+    """
+    Call `func(part, *args)` on every partition of `frame` by `key` and
+    return the results in sorted key order.
+
+    With the process backend the frame is published to shared memory once
+    and workers only get a handle and the row positions of their part.
+    """
+    codes = frame.groupby(key, sort=True, observed=True).indices
+    keys = sorted(codes)
+    if jobs == 1 or len(keys) < 2:
+        return [func(frame.iloc[codes[k]], *args) for k in keys]
+    if backend == "thread":
+        with ThreadPoolExecutor(jobs) as pool:
+            return list(pool.map(lambda k : func(frame.iloc[codes[k]], *args),
+                                 keys))
+    elif backend == "process":
+        with shared_data.publish(frame) as shared:
+            tasks = [(func, shared.handle, codes[k], args) for k in keys]
+            with ProcessPoolExecutor(jobs) as pool:
+                return list(pool.map(_run_part, tasks))
+    raise ValueError("backend must be 'thread' or 'process'")
+
+
+def _concat_rows(parts, index):
+    # put row-wise results back in the original row order
+    return pandas.concat(parts).reindex(index)
+
+
+# <headingcell level=3>
+# Data
+
+def load_state_polls(path="data/2012_poll_data_states.csv",
+                     weights="data/pollster_weights.csv",
+                     pollster_map="data/pollster_map.pkl"):
+    """
+    The 2012 state polls, merged (inner) with the pollster weights.
+    """
+    pollster_map = poll_schema.load_pollster_map(pollster_map)
+    polls = poll_schema.load_polls(path, "2012_state", pollster_map)
+    if isinstance(weights, str):
+        weights = pandas.read_table(weights)
+    polls["pollster"] = polls["pollster"].astype(str)
+    polls = polls.merge(weights, how="inner", left_on="pollster",
+                        right_on="Pollster")
+    del polls["Pollster"]
+    polls["State"] = polls["state"].astype(str).map(states_abbrev_dict)
+    return polls
+
+
+def load_national_polls(path="data/2012_poll_data.csv",
+                        pollster_map="data/pollster_map.pkl"):
+    pollster_map = poll_schema.load_pollster_map(pollster_map)
+    return poll_schema.load_polls(path, "2012_national", pollster_map)
+
+
+def _capitalize(s):
+    s = s.title()
+    s = s.replace("Of", "of")
+    return s
+
+
+def load_demographics(path="data/"):
+    """
+    Census, party affiliation, PVI and FEC giving by state, as demo_data
+    in silver_model.py.
+    """
+    pvi = pandas.read_csv(path + "partisan_voting.csv")
+    pvi.set_index("State", inplace=True)
+    pvi.PVI = pvi.PVI.replace({"EVEN" : "0"})
+    pvi.PVI = pvi.PVI.str.replace(r"R\+", "-", regex=True)
+    pvi.PVI = pvi.PVI.str.replace(r"D\+", "", regex=True)
+    pvi.PVI = pvi.PVI.astype(float)
+
+    party_affil = pandas.read_csv(path + "gallup_electorate.csv")
+    party_affil.Democrat = party_affil.Democrat.str.replace("%", "").astype(float)
+    party_affil.Republican = party_affil.Republican.str.replace("%", "").astype(float)
+    party_affil.set_index("State", inplace=True)
+    party_affil.rename(columns={"Democrat Advantage" : "dem_adv"}, inplace=True)
+    party_affil["no_party"] = 100 - party_affil.Democrat - party_affil.Republican
+
+    census_data = pandas.read_csv(path + "census_demographics.csv")
+    census_data["State"] = census_data.state.map(_capitalize)
+    del census_data["state"]
+    census_data.set_index("State", inplace=True)
+
+    obama_give = pandas.read_csv(path + "obama_indiv_state.csv",
+                                 header=None, names=["State", "obama_give"])
+    romney_give = pandas.read_csv(path + "romney_indiv_state.csv",
+                                  header=None, names=["State", "romney_give"])
+    obama_give.State = obama_give.State.replace(states_abbrev_dict)
+    romney_give.State = romney_give.State.replace(states_abbrev_dict)
+    obama_give.set_index("State", inplace=True)
+    romney_give.set_index("State", inplace=True)
+
+    demo_data = census_data.join(party_affil[["dem_adv", "no_party"]]).join(pvi)
+    demo_data = demo_data.join(obama_give).join(romney_give)
+    giving = demo_data[["obama_give", "romney_give"]].div(
+                demo_data[["vote_pop", "older_pop"]].sum(axis=1), axis=0)
+    demo_data[["obama_give", "romney_give"]] = giving
+    return demo_data
+
+
+def load_weights(path="data/pollster_weights.csv"):
+    return pandas.read_table(path)
+
+
+# <headingcell level=3>
+# Polling Average
+
+def calculate_mess(polls, keys=("state", "pollster")):
+    """
+    Effective and marginal effective sample size of each poll, going down
+    each (state, pollster), or each group of `keys`, in table order.
+    """
+    groups = polls.groupby(list(keys), sort=False, observed=True)
+    cumulative = groups["sample"].cumsum()
+    ess = effective_sample(average_error(cumulative) + polls["PIE"])
+    mess = ess - ess.groupby(groups.ngroup()).shift(1)
+    # fill in the first one of each group with its ESS. like
+    # silver_model.py, anything else left missing gets the first ESS too
+    codes = groups.ngroup().values
+    first = np.unique(codes, return_index=True)[1]
+    mess = mess.fillna(pandas.Series(ess.values[first][codes],
+                                     index=mess.index))
+    return pandas.DataFrame(dict(ESS=ess, MESS=mess))
+
+
+def weighted_mean(group):
+    weights1 = group["time_weight"]
+    weights2 = group["MESS"]
+    return np.sum(weights1*weights2*group["spread"]/(weights1*weights2).sum())
+
+
+def pollster_averages(polls):
+    """
+    Time and MESS weighted average spread of each (state, pollster).
+    """
+    w = polls["time_weight"] * polls["MESS"]
+    keys = [polls["state"].astype(str), polls["pollster"].astype(str)]
+    # same arithmetic as weighted_mean, without apply
+    averages = (w * polls["spread"] / w.groupby(keys).transform("sum"))
+    averages = averages.groupby(keys).sum()
+    averages.index.names = ["state", "pollster"]
+    return averages
+
+
+# <headingcell level=3>
+# Clustering States by Demographics
+
+def cluster_states(demo_data, n_clusters=5, n_init=50, random_state=None,
+                   clean_data=None):
+    """
+    KMeans labels on the whitened demographics, indexed by state.
+    `clean_data` can pass the whitened matrix in, e.g. from feature_store.
+    """
+    if clean_data is None:
+        clean_data = sp_cluster.vq.whiten(demo_data.values)
+    k_means = cluster.KMeans(n_clusters=n_clusters, n_init=n_init,
+                             random_state=random_state)
+    k_means.fit(clean_data)
+    return pandas.Series(k_means.labels_, index=demo_data.index,
+                         name="kmeans_labels")
+
+
+def _cluster_trend(group, national, frac, it):
+    data = pandas.concat((group[["poll_date", "spread"]],
+                          national[["poll_date", "spread"]]))
+    # sort on the spread too so ties don't depend on the table order
+    data = data.sort_values(["poll_date", "spread"], kind="mergesort")
+    dates = pandas.DatetimeIndex(data.poll_date).as_unit("ns").asi8
+    loess_res = sm.nonparametric.lowess(data.spread.values, dates,
+                                        frac=frac, it=it)
+    trend = loess_res[-7:, 1].mean()
+    states = np.sort(np.asarray(group["State"].unique(), dtype=object))
+    return pandas.Series(trend, index=pandas.Index(states, name="State"))
+
+
+def cluster_trends(polls, national, labels, frac=.1, it=3, jobs=1,
+                   backend="thread"):
+    """
+    The lowess trend of each cluster's polls plus the national polls,
+    averaged over the last 7 points and given to every state in it.
+    """
+    polls = polls.assign(kmeans_labels=polls["State"].map(labels).values)
+    parts = map_partitions(_cluster_trend, polls, "kmeans_labels", jobs,
+                           backend, args=(national, frac, it))
+    trends = pandas.concat(parts)
+    trends.name = "trend"
+    return trends.sort_index(kind="mergesort")
+
+
+# <headingcell level=4>
+# Adjust for sensitivity to time-trends
+
+def m_regression_data(polls, demo_data):
+    """
+    The per-poll m of silver_model.py, the spread net of the pollster-state
+    and date effects of a dummy regression, joined to the demographics.
+    """
+    data = polls[["State", "pollster", "poll_date", "spread"]].copy()
+    data["pollster_state"] = data["pollster"] + "-" + data["State"]
+    data = data.sort_values(["pollster_state", "poll_date"], kind="mergesort")
+    dummy_model = ols("spread ~ C(pollster_state) + C(poll_date)",
+                      data=data).fit()
+    params = dummy_model.params
+    intercept = params["Intercept"]
+
+    pollster_state = np.sort(data["pollster_state"].unique())
+    X = pandas.Series(intercept, index=pollster_state, name="X")
+    names = ["C(pollster_state)[T.%s]" % ps for ps in pollster_state[1:]]
+    X.iloc[1:] += params.reindex(names).fillna(0).values
+
+    dates = np.sort(data["poll_date"].unique())
+    Z = pandas.Series(intercept, index=dates, name="Z")
+    names = ["C(poll_date)[T.%s]" % pandas.Timestamp(d) for d in dates[1:]]
+    Z.iloc[1:] += params.reindex(names).fillna(0).values
+    # Drop the ones less than 1.
+    Z = Z[np.abs(Z) > 1]
+
+    data = data.merge(X.rename_axis("pollster_state").reset_index(),
+                      on="pollster_state", sort=False)
+    data = data.merge(Z.rename_axis("poll_date").reset_index(),
+                      on="poll_date", sort=False)
+    data["m"] = data["spread"].sub(data["X"].div(data["Z"]))
+
+    m_size = data.groupby("pollster_state").size()
+    keep = m_size.index[m_size > 1]
+    data = data[data.pollster_state.isin(keep)]
+
+    return data.merge(demo_data.reset_index(), on="State")
+
+
+def scale_m(state_m):
+    """
+    Predicted m by state, scaled to [0, 2].
+    """
+    unit_m = (state_m - state_m.min())/(state_m.max() - state_m.min())
+    unit_m *= 2
+    return unit_m
+
+
+def time_uncertainty(polls, demo_data, today=today):
+    """
+    The m_correction of silver_model.py: the per-state sensitivity of the
+    polls to the time trend, predicted from demographics and scaled to
+    [0, 2].
+    """
+    data = m_regression_data(polls, demo_data)
+    time_weights = (today - data["poll_date"]).dt.days
+    time_weights = exp_decay(time_weights.values)
+    m_model = wls(M_FORMULA, data=data,
+                  weights=time_weights).fit()
+
+    exog = demo_data.drop("District of Columbia", errors="ignore")
+    unit_m = scale_m(m_model.predict(exog))
+    return pandas.Series(np.asarray(unit_m), index=exog.index,
+                         name="m_correction")
+
+
+def _adjust(part, m_correction):
+    return part["trend"].mul(m_correction.reindex(part.index))
+
+
+def adjust_trends(trends, m_correction, jobs=1, backend="thread"):
+    """
+    trend * m_correction for every state that has both.
+    """
+    frame = trends.to_frame("trend")
+    if jobs > 1:
+        parts = map_partitions(_adjust, frame, frame.index, jobs, backend,
+                               args=(m_correction,))
+        adjusted = pandas.concat(parts)
+    else:
+        adjusted = _adjust(frame, m_correction)
+    adjusted = adjusted.dropna()
+    adjusted.name = "poll"
+    return adjusted
+
+
+# <headingcell level=3>
+# Snapshot: Combine Trend Estimates and State Polls
+
+def snapshot(state_polls, adjusted, weights,
+             electoral_votes="data/electoral_votes.csv"):
+    """
+    Weight the pollster averages and the national trend by pollster
+    weight, call each state and tally the electoral votes.
+    """
+    state_polls = state_polls.rename("poll").reset_index()
+    state_polls.rename(columns={"state" : "State", "pollster" : "Pollster"},
+                       inplace=True)
+    state_polls.State = state_polls.State.replace(states_abbrev_dict)
+
+    trends = adjusted.rename("poll").reset_index()
+    trends["Pollster"] = "National"
+    polls = pandas.concat((state_polls, trends), sort=True)
+
+    natl_weight = pandas.DataFrame([["National", weights.Weight.mean(),
+                                     weights.PIE.mean()]],
+                                   columns=["Pollster", "Weight", "PIE"])
+    weights = pandas.concat((weights, natl_weight)).reset_index(drop=True)
+    polls = polls.merge(weights, on="Pollster", how="left")
+
+    weighted = polls["poll"] * polls["Weight"]
+    results = (weighted.groupby(polls["State"]).sum() /
+               polls["Weight"].groupby(polls["State"]).sum())
+    results = results.rename("poll").reset_index()
+
+    if isinstance(electoral_votes, str):
+        electoral_votes = pandas.read_csv(electoral_votes)
+    electoral_votes = electoral_votes.sort_values("State").reset_index(
+                                                                drop=True)
+    results = electoral_votes.merge(results, on="State", how="left")
+    results = results.set_index("State")
+    results["obama"] = (results["poll"] > 0).astype(int)
+    results["romney"] = (results["poll"] < 0).astype(int)
+    results.loc[red_states, "romney"] = 1
+    results.loc[red_states, "obama"] = 0
+    results.loc[blue_states, "obama"] = 1
+    results.loc[blue_states, "romney"] = 0
+    return results
+
+
+def call_states(poll, states):
+    """
+    obama and romney calls from state averages, a states x ... array,
+    with the red and blue states fixed as in snapshot.
+    """
+    obama = (poll > 0).astype(int)
+    romney = (poll < 0).astype(int)
+    red = states.isin(red_states)
+    blue = states.isin(blue_states)
+    obama[red], romney[red] = 0, 1
+    obama[blue], romney[blue] = 1, 0
+    return obama, romney
+
+
+def tally(results):
+    return dict(obama=int(results["Votes"].mul(results["obama"]).sum()),
+                romney=int(results["Votes"].mul(results["romney"]).sum()))
+
+
+# <headingcell level=3>
+# Everything
+
+def state_averages(polls, today=today, half_life=30., jobs=1,
+                   backend="thread"):
+    """
+    MESS and time weights for every poll and the (state, pollster)
+    averages.
+    """
+    if jobs > 1:
+        mess = map_partitions(calculate_mess, polls, "state", jobs, backend)
+        mess = _concat_rows(mess, polls.index)
+    else:
+        mess = calculate_mess(polls)
+    polls = polls.join(mess)
+    days = (today - polls["poll_date"]).dt.days.values
+    polls["time_weight"] = exp_decay(days, half_life)
+    if jobs > 1:
+        parts = map_partitions(pollster_averages, polls, "state", jobs,
+                               backend)
+        averages = pandas.concat(parts).sort_index()
+    else:
+        averages = pollster_averages(polls).sort_index()
+    return polls, averages
+
+
+def run(today=today, jobs=1, backend="thread", labels=None,
+        m_correction=None, random_state=0):
+    """
+    Run the polling average, trend and snapshot stages end to end.
+
+    `labels` (kmeans labels by state) and `m_correction` can be passed in
+    from an earlier run to skip the clustering and the m regression.
+    """
+    weights = load_weights()
+    polls = load_state_polls(weights=weights)
+    national = load_national_polls()
+    demo_data = load_demographics()
+
+    polls, averages = state_averages(polls, today, jobs=jobs, backend=backend)
+    if labels is None:
+        labels = cluster_states(demo_data, random_state=random_state)
+    trends = cluster_trends(polls, national, labels, jobs=jobs,
+                            backend=backend)
+    if m_correction is None:
+        m_correction = time_uncertainty(polls, demo_data, today)
+    adjusted = adjust_trends(trends, m_correction, jobs=jobs,
+                             backend=backend)
+    results = snapshot(averages, adjusted, weights)
+    return dict(polls=polls, national=national, demo_data=demo_data,
+                weights=weights, state_polls=averages, labels=labels,
+                trends=trends, m_correction=m_correction,
+                adjusted=adjusted, results=results, ev=tally(results))
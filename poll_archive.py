@@ -0,0 +1,213 @@
+"""
+Append-only, memory-mapped poll archive with point-in-time queries.
+
+Polls from `poll_schema` are written as segments of column files (.npy),
+each segment sorted by state and then by release date, with a per-state
+offset index. A poll is considered known from its `end_date` (or a
+`release_date` column, if one is given). Reading "everything known as of
+a date" is then a searchsorted inside each state's block and the result
+is a slice of the memory-mapped columns, not a filtered copy of a CSV.
+
+Usage:
+
+    archive = PollArchive("data/archive")
+    archive.append(poll_schema.load_all_polls())
+    ohio = archive.as_of("2008-10-02", states=["OH"])     # dict of arrays
+    ohio = archive.as_of_frame("2008-10-02", states=["OH"])  # poll table
+"""
+import json
+import os
+
+import numpy as np
+import pandas
+
+from poll_schema import COLUMNS, POPULATIONS
+
+NUMERIC = ["dem", "rep", "spread", "sample", "moe"]
+DATES = ["start_date", "end_date", "poll_date", "release_date"]
+CODES = dict(state=np.int16, pollster=np.int32, population=np.int8)
+
+
+class PollArchive(object):
+    """
+    An on-disk poll store. Segments are only ever added, never rewritten,
+    except by an explicit `compact`.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._meta_path = os.path.join(path, "meta.json")
+        self._columns = {}
+        if not os.path.exists(path):
+            os.makedirs(path)
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as fin:
+                self.meta = json.load(fin)
+        else:
+            self.meta = dict(states=[], pollsters=[], segments=[])
+        # archives written before the counter; only ever goes up
+        self.meta.setdefault("next_segment", 1 + max(
+            [int(seg["name"][3:]) for seg in self.meta["segments"]] or [-1]))
+
+    def __len__(self):
+        return sum(seg["nrows"] for seg in self.meta["segments"])
+
+    @property
+    def states(self):
+        return list(self.meta["states"])
+
+    def _write_meta(self):
+        tmp = self._meta_path + ".tmp"
+        with open(tmp, "w") as fout:
+            json.dump(self.meta, fout)
+        os.replace(tmp, self._meta_path)
+
+    def _encode(self, values, name):
+        # codes stay valid forever since categories are only appended
+        cats = self.meta[name + "s"]
+        unique = pandas.unique(values)
+        new = unique[pandas.Index(cats).get_indexer(unique) < 0]
+        cats.extend(new.tolist())
+        return pandas.Index(cats).get_indexer(values).astype(CODES[name])
+
+    def _write_segment(self, columns):
+        """
+        Write the column files of a new segment and return its name. The
+        counter is saved before anything is written and the files go to a
+        temporary directory renamed into place, so a crash leaves at
+        most an unused directory whose name is never handed out again.
+        """
+        name = "seg%05d" % self.meta["next_segment"]
+        self.meta["next_segment"] += 1
+        self._write_meta()
+        seg_path = os.path.join(self.path, name)
+        tmp = seg_path + ".tmp"
+        os.makedirs(tmp)
+        for col, values in columns.items():
+            np.save(os.path.join(tmp, col + ".npy"), values)
+        os.replace(tmp, seg_path)
+        return name
+
+    def append(self, polls):
+        """
+        Write a normalized poll table as a new segment.
+        """
+        if not len(polls):
+            return
+        release = polls.get("release_date", polls["end_date"])
+        state = self._encode(polls["state"].astype(str).values, "state")
+        pollster = self._encode(polls["pollster"].astype(str).values,
+                                "pollster")
+        release = pandas.DatetimeIndex(release).as_unit("ns").asi8
+        order = np.lexsort((release, state))
+
+        columns = dict(state=state[order], pollster=pollster[order],
+                       release_date=release[order],
+                       cycle=polls["cycle"].values.astype(np.int16)[order])
+        population = pandas.Categorical(polls["population"],
+                                        categories=POPULATIONS)
+        columns["population"] = population.codes.astype(np.int8)[order]
+        for name in NUMERIC:
+            columns[name] = polls[name].values.astype(np.float64)[order]
+        for name in DATES[:-1]:
+            dates = pandas.DatetimeIndex(polls[name]).as_unit("ns").asi8
+            columns[name] = dates[order]
+
+        offsets = np.searchsorted(columns["state"],
+                                  np.arange(len(self.meta["states"]) + 1))
+        name = self._write_segment(columns)
+        self.meta["segments"].append(dict(name=name, nrows=len(order),
+                                          offsets=offsets.tolist()))
+        self._write_meta()
+
+    def _segment(self, seg):
+        name = seg["name"]
+        if name not in self._columns:
+            seg_path = os.path.join(self.path, name)
+            self._columns[name] = {
+                col[:-4] : np.load(os.path.join(seg_path, col),
+                                   mmap_mode="r")
+                for col in os.listdir(seg_path)}
+        return self._columns[name]
+
+    def _slices(self, date, states):
+        date = pandas.Timestamp(date).as_unit("ns").value
+        codes = dict(zip(self.meta["states"],
+                         range(len(self.meta["states"]))))
+        if states is None:
+            states = self.meta["states"]
+        for seg in self.meta["segments"]:
+            columns = self._segment(seg)
+            offsets = seg["offsets"]
+            for state in states:
+                code = codes.get(state)
+                if code is None or code + 1 >= len(offsets):
+                    continue
+                lo, hi = offsets[code], offsets[code + 1]
+                n = np.searchsorted(columns["release_date"][lo:hi], date,
+                                    side="right")
+                if n:
+                    yield columns, lo, lo + n
+
+    def as_of(self, date, states=None, columns=None):
+        """
+        All polls released on or before `date`, as a dict of arrays.
+
+        When the answer is a single block of a single segment, as it is
+        for one state in a compacted archive, the arrays are read-only
+        views on the memory-mapped files. Otherwise the blocks are
+        concatenated. States and pollsters are integer codes into
+        `archive.meta["states"]` and `archive.meta["pollsters"]`.
+        """
+        columns = columns or (["state", "pollster", "cycle", "population",
+                               "release_date"] + DATES[:-1] + NUMERIC)
+        blocks = list(self._slices(date, states))
+        if len(blocks) == 1:
+            data, lo, hi = blocks[0]
+            return {col : data[col][lo:hi] for col in columns}
+        if not blocks:
+            return {col : np.array([]) for col in columns}
+        return {col : np.concatenate([data[col][lo:hi]
+                                      for data, lo, hi in blocks])
+                for col in columns}
+
+    def as_of_frame(self, date, states=None):
+        """
+        Same as `as_of`, decoded back into a poll_schema table.
+        """
+        data = self.as_of(date, states)
+        if not len(data["state"]):
+            return pandas.DataFrame(columns=COLUMNS + ["release_date"])
+        frame = pandas.DataFrame({col : data[col] for col in NUMERIC})
+        frame["cycle"] = data["cycle"]
+        frame["state"] = pandas.Categorical.from_codes(
+                            data["state"], self.meta["states"])
+        frame["pollster"] = pandas.Categorical.from_codes(
+                            data["pollster"], self.meta["pollsters"])
+        frame["population"] = pandas.Categorical.from_codes(
+                            data["population"], POPULATIONS)
+        for col in DATES:
+            frame[col] = pandas.to_datetime(data[col])
+        return frame[COLUMNS + ["release_date"]]
+
+    def compact(self):
+        """
+        Merge all segments into one so per-state queries are zero-copy.
+        """
+        if len(self.meta["segments"]) < 2:
+            return
+        everything = self.as_of(pandas.Timestamp.max)
+        old = self.meta["segments"]
+        order = np.lexsort((everything["release_date"], everything["state"]))
+        name = self._write_segment({col : values[order] for col, values
+                                    in everything.items()})
+        offsets = np.searchsorted(everything["state"][order],
+                                  np.arange(len(self.meta["states"]) + 1))
+        self.meta["segments"] = [dict(name=name, nrows=len(order),
+                                      offsets=offsets.tolist())]
+        self._write_meta()
+        self._columns.clear()
+        for seg in old:
+            seg_path = os.path.join(self.path, seg["name"])
+            for col in os.listdir(seg_path):
+                os.remove(os.path.join(seg_path, col))
+            os.rmdir(seg_path)
@@ -0,0 +1,296 @@
+"""
+Map the different poll files into one typed, columnar poll table.
+
+Each election's polls come in their own shape: 2004 state polls have
+Kerry/Bush and a single "Oct 25" Date, 2008 state polls have Obama/McCain
+and Start/End, and the tab-separated RCP files have "9/24 - 10/1" ranges
+with no year, Sample strings like "500 LV" and MoE values of "--". A
+schema describes where each field lives in a source and `normalize_polls`
+turns the raw frame into the common layout in one vectorized pass.
+
+Usage:
+
+    polls = load_polls("data/2012_poll_data_states.csv", "2012_state")
+    polls = load_all_polls()  # every known source, stacked
+
+The columns of the normalized table are
+
+    cycle, state, pollster, start_date, end_date, poll_date,
+    dem, rep, spread, sample, population, moe
+
+`state` is the two letter postal code ("USA" for national polls),
+`pollster` has been cleaned with the pollster map, `poll_date` is the
+median day the poll was in the field, `spread` is dem - rep and
+`population` is one of LV, RV or A.
+"""
+import datetime
+import pickle
+
+import numpy as np
+import pandas
+
+states_abbrev_dict = {
+        'AK': 'Alaska',
+        'AL': 'Alabama',
+        'AR': 'Arkansas',
+        'AS': 'American Samoa',
+        'AZ': 'Arizona',
+        'CA': 'California',
+        'CO': 'Colorado',
+        'CT': 'Connecticut',
+        'DC': 'District of Columbia',
+        'DE': 'Delaware',
+        'FL': 'Florida',
+        'GA': 'Georgia',
+        'GU': 'Guam',
+        'HI': 'Hawaii',
+        'IA': 'Iowa',
+        'ID': 'Idaho',
+        'IL': 'Illinois',
+        'IN': 'Indiana',
+        'KS': 'Kansas',
+        'KY': 'Kentucky',
+        'LA': 'Louisiana',
+        'MA': 'Massachusetts',
+        'MD': 'Maryland',
+        'ME': 'Maine',
+        'MI': 'Michigan',
+        'MN': 'Minnesota',
+        'MO': 'Missouri',
+        'MP': 'Northern Mariana Islands',
+        'MS': 'Mississippi',
+        'MT': 'Montana',
+        'NA': 'National',
+        'NC': 'North Carolina',
+        'ND': 'North Dakota',
+        'NE': 'Nebraska',
+        'NH': 'New Hampshire',
+        'NJ': 'New Jersey',
+        'NM': 'New Mexico',
+        'NV': 'Nevada',
+        'NY': 'New York',
+        'OH': 'Ohio',
+        'OK': 'Oklahoma',
+        'OR': 'Oregon',
+        'PA': 'Pennsylvania',
+        'PR': 'Puerto Rico',
+        'RI': 'Rhode Island',
+        'SC': 'South Carolina',
+        'SD': 'South Dakota',
+        'TN': 'Tennessee',
+        'TX': 'Texas',
+        'UT': 'Utah',
+        'VA': 'Virginia',
+        'VI': 'Virgin Islands',
+        'VT': 'Vermont',
+        'WA': 'Washington',
+        'WI': 'Wisconsin',
+        'WV': 'West Virginia',
+        'WY': 'Wyoming'
+}
+
+# date kinds
+#   "mon_day"      : one column like "Oct 25"
+#   "mon_day_pair" : start and end columns like "Oct 27"
+#   "md_range"     : one column like "9/24 - 10/1", year inferred
+SCHEMAS = {
+    "2004_state" : dict(cycle=2004, sep=",", state="State",
+                        pollster="Pollster", dem="Kerry", rep="Bush",
+                        dates=("mon_day", "Date")),
+    "2008_state" : dict(cycle=2008, sep=",", state="State",
+                        pollster="Pollster", dem="Obama", rep="McCain",
+                        dates=("mon_day_pair", "Start", "End")),
+    "2004_national" : dict(cycle=2004, sep="\t", state=None,
+                           pollster="Poll", dem="Kerry (D)", rep="Bush (R)",
+                           dates=("md_range", "Date"), sample="Sample"),
+    "2012_national" : dict(cycle=2012, sep="\t", state=None,
+                           pollster="Poll", dem="Obama (D)",
+                           rep="Romney (R)", dates=("md_range", "Date"),
+                           sample="Sample", moe="MoE"),
+    "2012_state" : dict(cycle=2012, sep="\t", state="State",
+                        pollster="Poll", dem="Obama (D)", rep="Romney (R)",
+                        dates=("md_range", "Date"), sample="Sample",
+                        moe="MoE", stale_check=True),
+}
+
+SOURCES = [("data/2004-pres-polls.csv", "2004_state"),
+           ("data/2008-pres-polls.csv", "2008_state"),
+           ("data/2004_poll_data.csv", "2004_national"),
+           ("data/2012_poll_data.csv", "2012_national"),
+           ("data/2012_poll_data_states.csv", "2012_state")]
+
+# the dates the data was pulled, used to place undated 2012 polls
+AS_OF = {2004 : datetime.datetime(2004, 11, 2),
+         2008 : datetime.datetime(2008, 11, 4),
+         2012 : datetime.datetime(2012, 10, 2)}
+
+# summary rows in the RCP tables that aren't polls
+NOT_POLLS = ["RCP Average", "Final Results"]
+
+COLUMNS = ["cycle", "state", "pollster", "start_date", "end_date",
+           "poll_date", "dem", "rep", "spread", "sample", "population",
+           "moe"]
+
+POPULATIONS = ["LV", "RV", "A"]
+
+
+def load_pollster_map(path="data/pollster_map.pkl"):
+    return pickle.load(open(path, "rb"))
+
+
+def _to_float(col):
+    return pandas.to_numeric(col.str.strip(), errors="coerce")
+
+
+def _mon_day(col, year):
+    # 2004 has some "Nov 00" dates
+    col = col.str.strip().str.replace(" 00$", " 01", regex=True)
+    return pandas.to_datetime(col + " " + str(year), format="%b %d %Y")
+
+
+def _md_range(col, groups, year, stale_after=None):
+    parts = col.str.strip().str.extract(r"^(\d+)/(\d+)\s*-\s*(\d+)/(\d+)$")
+    parts = parts.astype(float)
+    start_month, start_day = parts[0], parts[1]
+    prev = start_month.groupby(groups, sort=False).shift(1)
+    rollback = (start_month > prev).astype(int)
+    years = year - rollback.groupby(groups, sort=False).cumsum()
+    if stale_after is not None:
+        # soft check for ones that haven't polled in a year
+        # could be wrong for some... once a poll is stale, every older
+        # poll from the same pollster is too
+        stale = ((years == year) & (start_month > stale_after.month) &
+                 (start_day > stale_after.day)).astype(int)
+        years = years - stale.groupby(groups, sort=False).cummax()
+    start = pandas.to_datetime(dict(year=years, month=start_month,
+                                    day=start_day))
+    end = pandas.to_datetime(dict(year=years, month=parts[2], day=parts[3]))
+    return start, end
+
+
+def _median_date(start, end):
+    # same as the middle of pandas.date_range(start, end), rounding up
+    ndays = (end - start).dt.days + 1
+    return start + pandas.to_timedelta(ndays // 2, unit="D")
+
+
+def normalize_polls(raw, schema, pollster_map=None, as_of=None):
+    """
+    Normalize one raw poll frame into the common typed layout.
+
+    Parameters
+    ----------
+    raw : DataFrame
+        The source as read from disk, preferably with dtype=str.
+    schema : str or dict
+        A key into SCHEMAS or a schema dict.
+    pollster_map : dict, optional
+        Raw pollster names -> names used in pollster_weights.csv.
+    as_of : datetime, optional
+        When the data was pulled. Defaults to AS_OF[cycle].
+    """
+    if isinstance(schema, str):
+        schema = SCHEMAS[schema]
+    cycle = schema["cycle"]
+    as_of = as_of or AS_OF[cycle]
+
+    raw = raw.astype(str)
+    pollster = raw[schema["pollster"]].str.strip()
+    keep = ~pollster.isin(NOT_POLLS).values
+    raw = raw.loc[keep].reset_index(drop=True)
+    pollster = pollster.loc[keep].reset_index(drop=True)
+
+    if schema["state"] is None:
+        state = pandas.Series("USA", index=raw.index)
+    else:
+        state = raw[schema["state"]].str.strip()
+
+    kind = schema["dates"][0]
+    if kind == "mon_day":
+        start = end = _mon_day(raw[schema["dates"][1]], cycle)
+    elif kind == "mon_day_pair":
+        start = _mon_day(raw[schema["dates"][1]], cycle)
+        end = _mon_day(raw[schema["dates"][2]], cycle)
+    elif kind == "md_range":
+        # year inference uses the raw pollster names to match the tables.
+        # one code array, a list of keys as long as the frame would be
+        # taken for a single key
+        groups = pandas.factorize(pandas.MultiIndex.from_arrays(
+                                    [state.values, pollster.values]))[0]
+        stale_after = as_of if schema.get("stale_check") else None
+        start, end = _md_range(raw[schema["dates"][1]], groups, cycle,
+                               stale_after)
+    else:
+        raise ValueError("Unknown date kind %s" % kind)
+
+    if pollster_map:
+        pollster = pollster.replace(pollster_map)
+
+    dem = _to_float(raw[schema["dem"]])
+    rep = _to_float(raw[schema["rep"]])
+
+    if schema.get("sample"):
+        sample = raw[schema["sample"]].str.extract(
+                                r"^\s*(\d+)?\s*(LV|RV|A)?\s*$")
+        population = sample[1]
+        sample = sample[0].astype(float)
+    else:
+        sample = pandas.Series(np.nan, index=raw.index)
+        population = pandas.Series(np.nan, index=raw.index, dtype=object)
+
+    if schema.get("moe"):
+        moe = _to_float(raw[schema["moe"]])
+    else:
+        moe = pandas.Series(np.nan, index=raw.index)
+
+    polls = pandas.DataFrame(dict(
+                cycle=np.repeat(np.int16(cycle), len(raw)),
+                state=state.values,
+                pollster=pollster.values,
+                start_date=start.values,
+                end_date=end.values,
+                poll_date=_median_date(start, end).values,
+                dem=dem.values,
+                rep=rep.values,
+                spread=(dem - rep).values,
+                sample=sample.values,
+                population=pandas.Categorical(population.values,
+                                              categories=POPULATIONS),
+                moe=moe.values,
+                ), columns=COLUMNS)
+    polls["state"] = polls["state"].astype("category")
+    polls["pollster"] = polls["pollster"].astype("category")
+    return polls
+
+
+def load_polls(path, schema, pollster_map=None, as_of=None):
+    """
+    Read and normalize a single poll file.
+    """
+    if isinstance(schema, str):
+        schema = SCHEMAS[schema]
+    raw = pandas.read_csv(path, sep=schema["sep"], dtype=str,
+                          keep_default_na=False)
+    return normalize_polls(raw, schema, pollster_map, as_of)
+
+
+def concat_polls(frames):
+    """
+    Stack normalized poll tables, unioning the categories.
+    """
+    polls = pandas.concat(frames, ignore_index=True)
+    for name in ["state", "pollster"]:
+        cats = sorted(set().union(*[f[name].cat.categories for f in frames]))
+        polls[name] = pandas.Categorical(polls[name].astype(object),
+                                         categories=cats)
+    return polls
+
+
+def load_all_polls(sources=SOURCES, pollster_map="data/pollster_map.pkl"):
+    """
+    Load every poll source into one table keyed by cycle.
+    """
+    if isinstance(pollster_map, str):
+        pollster_map = load_pollster_map(pollster_map)
+    return concat_polls([load_polls(path, schema, pollster_map)
+                         for path, schema in sources])
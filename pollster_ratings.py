@@ -0,0 +1,133 @@
+"""
+Rate pollsters from the poll archives, to regenerate the PIE and Weight
+columns of pollster_weights.csv.
+
+For every poll taken within `window` days of an election the error is its
+spread minus the actual result, halved to the vote share scale that PIE
+is on (pipeline.calculate_mess adds PIE to average_error, the sampling
+error of a share). From there, for all pollsters and cycles at once:
+
+    * Race difficulty. The squared errors of a race (cycle, state) are
+      shifted by how much that race's mean squared error differs from the
+      overall one, so a pollster isn't punished for polling hard races.
+    * Sampling error. What sample size alone explains, average_error(n)**2
+      (n defaults to `sample` when a poll doesn't give one), is taken
+      out; what's left is the pollster induced error, PIE.
+    * Regression to the mean. A pollster's PIE**2 is shrunk toward the
+      all-pollster mean as if it had `prior_polls` more polls at the mean.
+    * Weight. The effective sample size of a `sample` sized poll with the
+      pollster's PIE, relative to one with the mean PIE.
+
+The state results aren't in data/, so they're passed in as a table of
+cycle, state (two letter code, or "USA"), dem and rep. The 2004 national
+result is read from the "Final Results" row of 2004_poll_data.csv.
+
+Usage:
+
+    results = pandas.read_csv("state_results.csv")
+    ratings = rate_pollsters(results)
+    write_weights(ratings, "data/pollster_weights.csv")
+"""
+import csv
+
+import numpy as np
+import pandas
+
+import pipeline
+import poll_schema
+from movement import elections
+
+HISTORICAL = [source for source in poll_schema.SOURCES
+              if poll_schema.SCHEMAS[source[1]]["cycle"] < 2012]
+
+
+def national_results(path="data/2004_poll_data.csv",
+                     schema="2004_national"):
+    """
+    The "Final Results" row of an RCP national table as cycle, state,
+    dem and rep.
+    """
+    schema = poll_schema.SCHEMAS[schema]
+    raw = pandas.read_csv(path, sep=schema["sep"])
+    final = raw[raw[schema["pollster"]].astype(str).str.strip() ==
+                "Final Results"]
+    return pandas.DataFrame(dict(cycle=schema["cycle"], state="USA",
+                                 dem=final[schema["dem"]].astype(float).values,
+                                 rep=final[schema["rep"]].astype(float).values))
+
+
+def poll_errors(polls, results, window=21, elections=elections):
+    """
+    Polls within `window` days of their election, with the actual spread
+    and the error on the share scale.
+    """
+    results = results.assign(state=results["state"].astype(str),
+                             actual=results["dem"] - results["rep"])
+    days = (polls["cycle"].map(elections) - polls["poll_date"]).dt.days
+    polls = polls[(days >= 0) & (days <= window)]
+    polls = polls.assign(state=polls["state"].astype(str),
+                         pollster=polls["pollster"].astype(str))
+    polls = polls.merge(results[["cycle", "state", "actual"]],
+                        on=["cycle", "state"], how="inner")
+    polls["error"] = (polls["spread"] - polls["actual"]) / 2.
+    return polls
+
+
+def rate(errors, prior_polls=10., sample=600.):
+    """
+    PIE and Weight for every pollster in `errors` (from poll_errors).
+
+    Returns a DataFrame indexed by Pollster with Weight, PIE, the number
+    of polls rated and the unshrunk PIE.
+    """
+    sq = errors["error"].values**2
+    race = pandas.factorize(pandas.MultiIndex.from_arrays(
+                [errors["cycle"].values, errors["state"].values]))[0]
+    race_mse = np.bincount(race, sq) / np.bincount(race)
+    sq_adj = sq - (race_mse[race] - sq.mean())
+
+    nobs = errors["sample"].fillna(sample).values
+    sampling = pipeline.average_error(nobs)**2
+
+    code, pollsters = pandas.factorize(errors["pollster"])
+    npolls = np.bincount(code)
+    excess = np.bincount(code, sq_adj - sampling) / npolls
+    raw = np.maximum(excess, 0.)
+    prior = np.dot(npolls, raw) / npolls.sum()
+    pie2 = (npolls * raw + prior_polls * prior) / (npolls + prior_polls)
+    pie = np.sqrt(pie2)
+
+    base = pipeline.average_error(sample)
+    ess = pipeline.effective_sample(base + pie)
+    weight = ess / pipeline.effective_sample(base + np.sqrt(prior))
+    return pandas.DataFrame(dict(Weight=weight, PIE=pie, polls=npolls,
+                                 raw_PIE=np.sqrt(raw)),
+                            index=pandas.Index(pollsters, name="Pollster")
+                            ).sort_index()
+
+
+def rate_pollsters(results, sources=HISTORICAL, window=21, prior_polls=10.,
+                   sample=600., pollster_map="data/pollster_map.pkl"):
+    """
+    Load the historical archives and rate every pollster in them.
+
+    `results` is a table of cycle, state, dem and rep for the races to
+    score against. The national results found in the archives are added.
+    """
+    polls = poll_schema.load_all_polls(sources, pollster_map)
+    national = [national_results(path, schema) for path, schema in sources
+                if poll_schema.SCHEMAS[schema]["state"] is None]
+    results = pandas.concat([results] + national, ignore_index=True)
+    results = results.drop_duplicates(["cycle", "state"], keep="first")
+    errors = poll_errors(polls, results, window)
+    return rate(errors, prior_polls, sample)
+
+
+def write_weights(ratings, path="data/pollster_weights.csv", decimals=2):
+    """
+    Write Pollster, Weight and PIE in the tab separated, quoted format of
+    pollster_weights.csv.
+    """
+    table = ratings[["Weight", "PIE"]].round(decimals).reset_index()
+    table.to_csv(path, sep="\t", index=False,
+                 quoting=csv.QUOTE_NONNUMERIC)
@@ -0,0 +1,136 @@
+"""
+Project today's snapshot forward to Election Day.
+
+Each state's margin follows a random walk from today's snapshot, one
+step per day. The daily step is the sum of a national shock, a shock
+shared by the state's KMeans cluster and a state shock, and the whole
+step is scaled by the state's m_correction (its sensitivity to the time
+trend, 1 for states without one). Paths are drawn in batches of
+simulations x days x shocks, so every remaining day is projected at once.
+
+Usage:
+
+    out = pipeline.run()
+    proj = project(out["results"], out["m_correction"], out["labels"])
+    proj["win_prob"]          # days x states, P(Obama ahead)
+    proj["ev_quantiles"]      # days x quantiles of Obama's EV
+    proj["margin_fan"][.9]    # days x states, 90th percentile margin
+"""
+import datetime
+
+import numpy as np
+import pandas
+from scipy import stats
+
+today = datetime.datetime(2012, 10, 2)
+election = datetime.datetime(2012, 11, 6)
+
+QUANTILES = [.05, .25, .5, .75, .95]
+
+
+def starting_margins(results, safe_margin=20.):
+    """
+    Today's margin by state. States without polls get +/- `safe_margin`
+    on the side they were called for.
+    """
+    margins = results["poll"].astype(float).copy()
+    called = safe_margin * (results["obama"] - results["romney"])
+    return margins.fillna(called)
+
+
+def state_volatility(states, m_correction):
+    """
+    m_correction by state, with 1 (an average state) where it's missing.
+    """
+    return m_correction.reindex(states).fillna(1.).values
+
+
+def project(results, m_correction, labels, today=today, election=election,
+            national_sd=.35, cluster_sd=.25, state_sd=.4, nsims=10000,
+            chunk=2000, quantiles=QUANTILES, seed=None):
+    """
+    Simulate daily margin paths for every state from `today` through
+    `election`.
+
+    Parameters
+    ----------
+    results : DataFrame
+        The snapshot, indexed by State with poll, Votes, obama, romney.
+    m_correction : Series
+        Time uncertainty by state, from pipeline.time_uncertainty.
+    labels : Series
+        KMeans label by state, from pipeline.cluster_states.
+    national_sd, cluster_sd, state_sd : float
+        Standard deviation of one day's shock, in points of margin.
+    nsims : int
+        Number of simulated paths.
+    chunk : int
+        Paths drawn at once. Bounds memory at chunk x days x states.
+
+    Returns
+    -------
+    dict with the projection dates and
+
+    win_prob : DataFrame
+        days x states, probability the Democrat leads on that day.
+    obama_win : Series
+        Probability of 270+ electoral votes on each day.
+    ev_mean : Series
+        Expected Democratic EV on each day.
+    ev_quantiles : DataFrame
+        days x quantiles of Democratic EV.
+    margin_fan : dict
+        quantile -> days x states DataFrame of margins.
+    """
+    states = results.index
+    margins = starting_margins(results).values
+    votes = results["Votes"].astype(float).values
+    vol = state_volatility(states, m_correction)
+    codes, clusters = pandas.factorize(labels.reindex(states).fillna(-1))
+    nclusters = len(clusters)
+    nstates = len(states)
+
+    ndays = max((election - today).days, 1)
+    dates = pandas.date_range(today + datetime.timedelta(1), periods=ndays)
+    total_ev = int(votes.sum())
+
+    rng = np.random.default_rng(seed)
+    ahead = np.zeros((ndays, nstates))
+    ev_hist = np.zeros((ndays, total_ev + 1))
+    done = 0
+    while done < nsims:
+        n = min(chunk, nsims - done)
+        draws = rng.standard_normal((n, ndays, 1 + nclusters + nstates),
+                                    dtype=np.float32)
+        steps = (national_sd * draws[:, :, :1] +
+                 cluster_sd * draws[:, :, 1:1 + nclusters][:, :, codes] +
+                 state_sd * draws[:, :, 1 + nclusters:])
+        paths = margins + vol * np.cumsum(steps, axis=1)
+        leads = paths > 0
+        ahead += leads.sum(0)
+        ev = np.dot(leads, votes).astype(int)
+        flat = (np.arange(ndays) * (total_ev + 1) + ev).ravel()
+        ev_hist += np.bincount(flat, minlength=ev_hist.size).reshape(
+                                                            ev_hist.shape)
+        done += n
+
+    win_prob = pandas.DataFrame(ahead / nsims, index=dates, columns=states)
+    ev_hist /= nsims
+    ev_cdf = np.cumsum(ev_hist, axis=1)
+    ev_quantiles = pandas.DataFrame(
+            [[np.searchsorted(cdf, q) for q in quantiles] for cdf in ev_cdf],
+            index=dates, columns=quantiles)
+    obama_win = pandas.Series(ev_hist[:, 270:].sum(1), index=dates)
+    ev_mean = pandas.Series(np.dot(ev_hist, np.arange(total_ev + 1)),
+                            index=dates)
+
+    # the margins are Gaussian random walks, so the fan is exact
+    step_sd = np.sqrt(national_sd**2 + cluster_sd**2 + state_sd**2)
+    sd = vol * step_sd * np.sqrt(np.arange(1, ndays + 1))[:, None]
+    margin_fan = dict((q, pandas.DataFrame(margins + stats.norm.ppf(q) * sd,
+                                           index=dates, columns=states))
+                      for q in quantiles)
+    return dict(dates=dates, win_prob=win_prob, obama_win=obama_win,
+                ev_mean=ev_mean, ev_quantiles=ev_quantiles,
+                ev_distribution=pandas.DataFrame(ev_hist, index=dates),
+                margin_fan=margin_fan)
@@ -0,0 +1,228 @@
+"""
+Run the polling stages over many races at once: Senate, governor and
+House contests alongside, or instead of, the presidential states.
+
+Every poll carries a race code, e.g. "2012-SEN-OH" or "2012-HOUSE-CA-07",
+and every stage is keyed by it rather than by state:
+
+    house effects   the pollster house effects, from a Series or fit with
+                    house_effects over all races together, are taken out
+                    of the spreads
+    trend           spreads are moved by how far the national lowess
+                    trend has moved since the poll was taken
+    MESS            pipeline.calculate_mess keyed by (race, pollster)
+    averaging       time and MESS weighted (race, pollster) averages,
+                    then Weight weighted race averages, all bincounts
+    seat tally      races are simulated with a national swing shared by
+                    all of them, in batches, and seats are counted by
+                    office
+
+There's no loop over races anywhere; cost grows with the number of polls
+and the batch size, not with the number of races.
+
+The presidential trend of pipeline.py is a spread level, which doesn't
+carry over to other offices, so the trend enters here as a swing since
+the poll date instead.
+
+Usage:
+
+    polls = pandas.read_csv("race_polls.csv", parse_dates=["poll_date"])
+    races = pandas.read_csv("races.csv")     # race, office, prior
+    out = run(polls, races, national=pipeline.load_national_polls())
+    out["margins"], out["seats"].loc["SEN"], out["expected_seats"]
+"""
+import numpy as np
+import pandas
+import statsmodels.api as sm
+
+import pipeline
+from pipeline import average_error, exp_decay
+
+
+def from_state_polls(polls, office="PRES", cycle=2012):
+    """
+    Key the presidential state polls as races, "2012-PRES-OH" and so on.
+    """
+    race = ("%d-%s-" % (cycle, office)) + polls["state"].astype(str)
+    return polls.assign(race=race.values, office=office)
+
+
+def remove_house_effects(polls, house):
+    """
+    Spreads net of each pollster's house effect. `house` is a Series by
+    pollster, or "fit" to estimate it from these polls with
+    house_effects.house_effects, races standing in for states.
+    """
+    if isinstance(house, str) and house == "fit":
+        import house_effects
+        fit = house_effects.house_effects(polls.assign(State=polls["race"]),
+                                          dates=False)
+        house = fit["pollsters"]
+    effect = house.reindex(polls["pollster"].astype(str).values).fillna(0.)
+    return polls.assign(spread=polls["spread"].values - effect.values)
+
+
+def national_swing(polls, national, today=pipeline.today, frac=.1, it=3):
+    """
+    The change in the national lowess trend from each poll's date to
+    `today`.
+    """
+    national = national.sort_values(["poll_date", "spread"],
+                                    kind="mergesort")
+    dates = pandas.DatetimeIndex(national["poll_date"]).as_unit("ns").asi8
+    fit = sm.nonparametric.lowess(national["spread"].values, dates,
+                                  frac=frac, it=it)
+    x, trend = fit[:, 0], fit[:, 1]
+    when = pandas.DatetimeIndex(polls["poll_date"]).as_unit("ns").asi8
+    now = pandas.Timestamp(today).as_unit("ns").value
+    return np.interp(now, x, trend) - np.interp(when, x, trend)
+
+
+def race_averages(polls, today=pipeline.today, half_life=30.):
+    """
+    The MESS and time weighted average of every race.
+
+    Returns a DataFrame indexed by race with margin, npolls, npollsters
+    and ess, the time weighted effective sample size behind it.
+    """
+    mess = pipeline.calculate_mess(polls, keys=("race", "pollster"))
+    days = (today - polls["poll_date"]).dt.days.values
+    w = exp_decay(days, half_life) * mess["MESS"].values
+
+    group, groups = pandas.factorize(pandas.MultiIndex.from_arrays(
+                        [polls["race"].values,
+                         polls["pollster"].astype(str).values]))
+    ngroups = len(groups)
+    num = np.bincount(group, w * polls["spread"].values, ngroups)
+    den = np.bincount(group, w, ngroups)
+    weight = np.zeros(ngroups)
+    weight[group] = polls["Weight"].values
+
+    race, races = pandas.factorize(groups.get_level_values(0))
+    nraces = len(races)
+    margin = (np.bincount(race, weight * num / den, nraces) /
+              np.bincount(race, weight, nraces))
+    race_of_poll = race[group]
+    return pandas.DataFrame(dict(
+                margin=margin,
+                npolls=np.bincount(race_of_poll, minlength=nraces),
+                npollsters=np.bincount(race, minlength=nraces),
+                ess=np.bincount(race_of_poll, w, nraces)),
+                index=pandas.Index(races, name="race"))
+
+
+def race_uncertainty(averages, races, base_sd=3., prior_sd=10.):
+    """
+    Margin and standard deviation for every race in `races`. Polled
+    races have the sampling error of their effective sample on top of
+    `base_sd`; unpolled ones fall back on their prior with `prior_sd`.
+    """
+    table = races.set_index("race")
+    margin = averages["margin"].reindex(table.index)
+    ess = averages["ess"].reindex(table.index)
+    # the spread's error is twice the share's
+    sampling = 2 * average_error(ess)
+    sd = np.sqrt(base_sd**2 + sampling**2)
+    polled = margin.notnull()
+    prior = table["prior"] if "prior" in table else 0.
+    table["margin"] = margin.where(polled, prior)
+    table["sd"] = sd.where(polled, prior_sd)
+    table["polled"] = polled
+    return table
+
+
+def seat_distribution(table, national_sd=2., held=None, nsims=10000,
+                      chunk=2000, seed=None):
+    """
+    Simulate every race with a shared national swing and count the
+    Democratic seats by office.
+
+    Parameters
+    ----------
+    table : DataFrame
+        By race, with office, margin and sd.
+    held : dict, optional
+        Democratic seats by office that aren't up, e.g. {"SEN" : 30}.
+
+    Returns
+    -------
+    dict with win_prob by race, seats (offices x seat count
+    probabilities) and expected_seats by office.
+    """
+    rng = np.random.default_rng(seed)
+    held = held or {}
+    office, offices = pandas.factorize(table["office"])
+    noffices = len(offices)
+    nraces = len(table)
+    margin = table["margin"].values
+    sd = table["sd"].values
+    max_seats = nraces
+    wins = np.zeros(nraces)
+    hist = np.zeros((noffices, max_seats + 1))
+    indicator = np.zeros((nraces, noffices))
+    indicator[np.arange(nraces), office] = 1
+    done = 0
+    while done < nsims:
+        n = min(chunk, nsims - done)
+        swing = national_sd * rng.standard_normal((n, 1))
+        outcome = margin + swing + sd * rng.standard_normal((n, nraces))
+        won = outcome > 0
+        wins += won.sum(0)
+        seats = np.dot(won, indicator).astype(int)
+        flat = (seats + (max_seats + 1) * np.arange(noffices)).ravel()
+        hist += np.bincount(flat, minlength=hist.size).reshape(hist.shape)
+        done += n
+    hist /= nsims
+    shift = np.array([held.get(o, 0) for o in offices])
+    seats = pandas.DataFrame(0., index=pandas.Index(offices, name="office"),
+                             columns=np.arange(max_seats + shift.max() + 1))
+    for i in range(noffices):
+        seats.iloc[i, shift[i]:shift[i] + max_seats + 1] = hist[i]
+    seats = seats.loc[:, seats.sum(axis=0) > 0]
+    expected = pandas.Series(np.dot(seats.values, seats.columns.values),
+                             index=seats.index, name="expected_seats")
+    return dict(win_prob=pandas.Series(wins / nsims, index=table.index),
+                seats=seats, expected_seats=expected)
+
+
+def run(polls, races=None, national=None, house=None, today=pipeline.today,
+        half_life=30., base_sd=3., prior_sd=10., national_sd=2., held=None,
+        nsims=10000, seed=None):
+    """
+    Every stage for every race.
+
+    Parameters
+    ----------
+    polls : DataFrame
+        Polls with race, pollster, poll_date, spread, sample, PIE and
+        Weight.
+    races : DataFrame, optional
+        race, office and optionally prior (the margin to use without
+        polls). Defaults to the polled races, with the office taken from
+        the polls.
+    national : DataFrame, optional
+        National polls for the trend; without them there's no trend
+        adjustment.
+    house : Series or "fit", optional
+        House effects to take out.
+
+    Returns
+    -------
+    dict with margins (by race: office, margin, sd, polled, win_prob),
+    averages, seats and expected_seats.
+    """
+    polls = polls[polls["poll_date"] <= today]
+    if house is not None:
+        polls = remove_house_effects(polls, house)
+    if national is not None:
+        polls = polls.assign(spread=polls["spread"].values +
+                             national_swing(polls, national, today))
+    averages = race_averages(polls, today, half_life)
+    if races is None:
+        races = polls.groupby("race", sort=True)["office"].first()
+        races = races.reset_index()
+    table = race_uncertainty(averages, races, base_sd, prior_sd)
+    sims = seat_distribution(table, national_sd, held, nsims, seed=seed)
+    table["win_prob"] = sims["win_prob"]
+    return dict(margins=table, averages=averages, seats=sims["seats"],
+                expected_seats=sims["expected_seats"])
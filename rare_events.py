@@ -0,0 +1,192 @@
+"""
+Tail probabilities of the electoral vote, such as a 269-269 tie or 350+
+electoral votes, without brute force sampling.
+
+State margins are modeled as
+
+    margin_s = poll_s + national_sd * z + state_sd_s * e_s
+
+with one national swing z and independent state errors e_s. Three things
+keep the number of draws small:
+
+    * Importance sampling of the national swing. A pilot pass over a grid
+      of z finds where the event actually happens and z is drawn from a
+      normal fit to that region (mixed with the original N(0, 1) so the
+      weights stay bounded).
+    * Stratification on the tossup states. Given z the tossups are
+      independent, so instead of sampling them every one of the 2**k win
+      and loss combinations is weighed by its exact probability.
+    * A control variate. The expected Democratic EV is known in closed
+      form, and its estimate from the same draws soaks up much of the
+      remaining noise.
+
+Usage:
+
+    out = pipeline.run()
+    est = estimate(out["results"], tie)
+    est = estimate(out["results"], at_least(350))
+    est["estimate"], est["ci"], est["ess"]
+"""
+import numpy as np
+import pandas
+from scipy import stats
+
+import projection
+
+tossup = ["Colorado", "Florida", "Iowa", "New Hampshire", "Nevada",
+          "Ohio", "Virginia", "Wisconsin"]
+
+
+def tie(ev):
+    return ev == 269
+
+
+def at_least(votes):
+    def event(ev):
+        return ev >= votes
+    event.__name__ = "at_least_%d" % votes
+    return event
+
+
+def at_most(votes):
+    def event(ev):
+        return ev <= votes
+    event.__name__ = "at_most_%d" % votes
+    return event
+
+
+class _Model(object):
+    def __init__(self, results, national_sd, state_sd, tossups):
+        self.mu = projection.starting_margins(results).values
+        self.votes = results["Votes"].astype(float).values
+        if np.isscalar(state_sd):
+            state_sd = np.repeat(float(state_sd), len(self.mu))
+        else:
+            state_sd = pandas.Series(state_sd).reindex(results.index).values
+        self.sd = state_sd
+        self.national_sd = national_sd
+        is_tossup = results.index.isin(tossups)
+        self.toss = np.flatnonzero(is_tossup)
+        self.rest = np.flatnonzero(~is_tossup)
+        k = len(self.toss)
+        # every win/loss combination of the tossups
+        self.combos = ((np.arange(2**k)[:, None] >> np.arange(k)) & 1)
+        self.combo_ev = np.dot(self.combos, self.votes[self.toss])
+        # E[EV] in closed form
+        total_sd = np.sqrt(national_sd**2 + self.sd**2)
+        self.expected_ev = np.dot(self.votes, stats.norm.cdf(self.mu /
+                                                             total_sd))
+
+    def conditional(self, z, e, event):
+        """
+        P(event | z, e) and E[EV | z, e], summing over the tossups.
+        """
+        swing = self.national_sd * z
+        rest = self.mu[self.rest] + swing[:, None] + self.sd[self.rest] * e
+        ev_rest = np.dot(rest > 0, self.votes[self.rest])
+        p = stats.norm.cdf((self.mu[self.toss] + swing[:, None]) /
+                           self.sd[self.toss])
+        p = np.clip(p, 1e-300, 1 - 1e-16)
+        log_p = (np.dot(np.log(p), self.combos.T) +
+                 np.dot(np.log1p(-p), 1 - self.combos.T))
+        prob = np.exp(log_p)
+        hits = event(ev_rest[:, None] + self.combo_ev[None, :])
+        cond_p = (prob * hits).sum(1)
+        cond_ev = ev_rest + np.dot(p, self.votes[self.toss])
+        return cond_p, cond_ev
+
+
+def _proposal(model, event, rng, grid=np.linspace(-5, 5, 101), npilot=200):
+    """
+    Normal fit to where P(event | z) * phi(z) lives.
+    """
+    e = rng.standard_normal((npilot, len(model.rest)))
+    mass = np.empty(len(grid))
+    for i, z in enumerate(grid):
+        cond_p, _ = model.conditional(np.repeat(z, npilot), e, event)
+        mass[i] = cond_p.mean() * stats.norm.pdf(z)
+    if mass.sum() <= 0:
+        return 0., 1.
+    mass /= mass.sum()
+    mean = np.dot(mass, grid)
+    sd = np.sqrt(np.dot(mass, (grid - mean)**2))
+    return mean, max(sd, grid[1] - grid[0])
+
+
+def estimate(results, event, national_sd=3., state_sd=3., tossups=tossup,
+             nsims=20000, chunk=5000, defensive=.1, level=.95, seed=None):
+    """
+    Estimate P(event(Democratic EV)) with a confidence interval.
+
+    Parameters
+    ----------
+    results : DataFrame
+        The snapshot, indexed by State with poll, Votes, obama, romney.
+    event : callable
+        Takes an array of Democratic EV totals and returns a boolean array.
+    national_sd : float
+        Standard deviation of the national swing, in points.
+    state_sd : float or Series
+        Standard deviation of each state's own error, in points.
+    tossups : list
+        States to stratify on. 2**len(tossups) combinations are summed over
+        per draw.
+    defensive : float
+        Share of the proposal that stays at N(0, 1).
+
+    Returns
+    -------
+    dict with estimate, se, ci, ess (Kish effective sample size of the
+    importance weights), nsims, and brute_force_equivalent, the number of
+    plain Monte Carlo draws that would give the same standard error.
+    """
+    rng = np.random.default_rng(seed)
+    model = _Model(results, national_sd, state_sd, tossups)
+    theta, scale = _proposal(model, event, rng)
+
+    f, c, w = [], [], []
+    done = 0
+    while done < nsims:
+        n = min(chunk, nsims - done)
+        from_prior = rng.random(n) < defensive
+        z = np.where(from_prior, rng.standard_normal(n),
+                     theta + scale * rng.standard_normal(n))
+        q = (defensive * stats.norm.pdf(z) +
+             (1 - defensive) * stats.norm.pdf(z, theta, scale))
+        weights = stats.norm.pdf(z) / q
+        e = rng.standard_normal((n, len(model.rest)))
+        cond_p, cond_ev = model.conditional(z, e, event)
+        f.append(weights * cond_p)
+        c.append(weights * cond_ev - model.expected_ev)
+        w.append(weights)
+        done += n
+    f, c, w = map(np.concatenate, (f, c, w))
+
+    # control variate, E[c] is 0
+    cov = np.cov(f, c)
+    beta = cov[0, 1] / cov[1, 1] if cov[1, 1] > 0 else 0.
+    adjusted = f - beta * c
+    p = adjusted.mean()
+    se = adjusted.std(ddof=1) / np.sqrt(len(adjusted))
+    crit = stats.norm.ppf(.5 + level / 2.)
+    ess = w.sum()**2 / (w**2).sum()
+    brute = p * (1 - p) / se**2 if se > 0 else np.inf
+    return dict(event=getattr(event, "__name__", repr(event)), estimate=p,
+                se=se, ci=(max(p - crit * se, 0.), min(p + crit * se, 1.)),
+                ess=ess, nsims=nsims, proposal=(theta, scale),
+                brute_force_equivalent=brute)
+
+
+def brute_force(results, event, national_sd=3., state_sd=3., nsims=100000,
+                seed=None):
+    """
+    Plain Monte Carlo, for checking `estimate`.
+    """
+    rng = np.random.default_rng(seed)
+    model = _Model(results, national_sd, state_sd, [])
+    z = rng.standard_normal(nsims)
+    e = rng.standard_normal((nsims, len(model.mu)))
+    margins = model.mu + national_sd * z[:, None] + model.sd * e
+    hits = event(np.dot(margins > 0, model.votes))
+    p = hits.mean()
+    return dict(estimate=p, se=np.sqrt(p * (1 - p) / nsims))
@@ -0,0 +1,193 @@
+"""
+Weighted least squares that is updated instead of refit.
+
+The m_model of silver_model.py is a WLS of m on demographics with time
+weights .5**(days / 30), days counted back from today. Moving today
+forward a day multiplies every weight by the same factor, so the weighted
+sufficient statistics X'WX and X'Wy can be carried from day to day:
+
+    advance(days)   X'WX, X'Wy *= .5**(days / half_life)
+    add(X, y, date) X'WX += w x x', X'Wy += w x y for each new row
+
+The inverse of X'WX is kept alongside and updated with Sherman-Morrison
+for each added row (and divided by the decay factor when advancing), so
+an update and the coefficients are O(p**2) rather than a refit.
+
+Usage:
+
+    data = pipeline.m_regression_data(polls, demo_data)
+    m_model = RecursiveWLS.from_frame(pipeline.M_FORMULA, data, today)
+    m_model.advance(1)
+    m_model.add_frame(new_data)
+    m_correction = m_model.m_correction(demo_data)
+"""
+import datetime
+
+import numpy as np
+import pandas
+import patsy
+
+import pipeline
+
+
+class RecursiveWLS(object):
+    """
+    WLS with exponentially forgotten weights.
+
+    Parameters
+    ----------
+    exog_names : list
+        Names of the design columns.
+    today : datetime
+        The date the weights are counted back from.
+    half_life : float
+        Days for a weight to halve, as in pipeline.exp_decay.
+    design_info : patsy DesignInfo, optional
+        Used by predict on DataFrames.
+    """
+    def __init__(self, exog_names, today=pipeline.today, half_life=30.,
+                 design_info=None):
+        k = len(exog_names)
+        self.exog_names = list(exog_names)
+        self.today = pandas.Timestamp(today)
+        self.half_life = half_life
+        self.design_info = design_info
+        self.endog_info = None
+        self.xtwx = np.zeros((k, k))
+        self.xtwy = np.zeros(k)
+        self.ytwy = 0.
+        self.sum_w = 0.
+        self.nobs = 0
+        self._inv = None
+
+    @classmethod
+    def from_frame(cls, formula, data, today=pipeline.today, half_life=30.,
+                   date="poll_date"):
+        """
+        Start from a formula and a table with a date column.
+        """
+        y, X = patsy.dmatrices(formula, data, return_type="dataframe")
+        model = cls(X.columns, today, half_life, X.design_info)
+        model.endog_info = y.design_info
+        model.add(X.values, y.values[:, 0], data.loc[X.index, date])
+        return model
+
+    def decay(self, dates):
+        """
+        Time weights of rows dated `dates`, as of today.
+        """
+        dates = pandas.to_datetime(pandas.Series(np.asarray(dates)))
+        days = (self.today - dates).dt.days.values
+        return pipeline.exp_decay(days, self.half_life)
+
+    def advance(self, days=1, to=None):
+        """
+        Move today forward by `days` (or to the date `to`), forgetting
+        every row by the same factor.
+        """
+        if to is not None:
+            elapsed = pandas.Timestamp(to) - self.today
+            days = elapsed.total_seconds() / 86400.
+        factor = .5**(days / self.half_life)
+        self.today = self.today + datetime.timedelta(days=days)
+        self.xtwx *= factor
+        self.xtwy *= factor
+        self.ytwy *= factor
+        self.sum_w *= factor
+        if self._inv is not None:
+            self._inv /= factor
+        return self
+
+    def add(self, exog, endog, dates=None, weights=None):
+        """
+        Add rows. Their weight is the time weight of `dates` as of today,
+        or `weights` if given.
+        """
+        X = np.atleast_2d(np.asarray(exog, dtype=float))
+        y = np.atleast_1d(np.asarray(endog, dtype=float))
+        if weights is None:
+            if dates is None:
+                raise ValueError("add needs dates or weights")
+            weights = self.decay(dates)
+        w = np.broadcast_to(np.asarray(weights, dtype=float), y.shape)
+
+        if self._inv is None:
+            self.xtwx += np.dot(X.T * w, X)
+            self._start()
+        else:
+            for x, wi in zip(X, w):
+                self.xtwx += wi * np.outer(x, x)
+                # Sherman-Morrison for (A + w x x')^-1
+                Ax = np.dot(self._inv, x)
+                self._inv -= np.outer(Ax, Ax) * (wi / (1. + wi *
+                                                       np.dot(x, Ax)))
+        self.xtwy += np.dot(X.T, w * y)
+        self.ytwy += np.dot(w * y, y)
+        self.sum_w += w.sum()
+        self.nobs += len(y)
+        return self
+
+    def add_frame(self, data, date="poll_date"):
+        """
+        Add the rows of a table like the one from_frame was given.
+        """
+        y, X = patsy.build_design_matrices(
+                    [self.endog_info, self.design_info], data,
+                    return_type="dataframe")
+        return self.add(X.values, y.values[:, 0], data.loc[X.index, date])
+
+    def _start(self):
+        # invert once, when X'WX first has full rank
+        if np.linalg.matrix_rank(self.xtwx) == len(self.exog_names):
+            self._inv = np.linalg.inv(self.xtwx)
+
+    def refresh(self):
+        """
+        Reinvert X'WX, to clear any rounding built up by the updates.
+        """
+        self._inv = None
+        self._start()
+        return self
+
+    @property
+    def params(self):
+        if self._inv is None:
+            raise ValueError("Not enough observations for %d parameters"
+                             % len(self.exog_names))
+        return pandas.Series(np.dot(self._inv, self.xtwy),
+                             index=self.exog_names)
+
+    @property
+    def ssr(self):
+        """
+        Weighted sum of squared residuals.
+        """
+        beta = np.dot(self._inv, self.xtwy)
+        return self.ytwy - np.dot(beta, self.xtwy)
+
+    @property
+    def bse(self):
+        scale = self.ssr / (self.nobs - len(self.exog_names))
+        return pandas.Series(np.sqrt(scale * np.diag(self._inv)),
+                             index=self.exog_names)
+
+    def predict(self, exog):
+        """
+        Fitted values for a design matrix, or for a DataFrame of the
+        formula's right hand side variables.
+        """
+        if isinstance(exog, pandas.DataFrame) and self.design_info:
+            X = patsy.build_design_matrices([self.design_info], exog,
+                                            return_type="dataframe")[0]
+            return pandas.Series(np.dot(X.values, self.params.values),
+                                 index=X.index)
+        return np.dot(np.asarray(exog, dtype=float), self.params.values)
+
+    def m_correction(self, demo_data):
+        """
+        pipeline.time_uncertainty's m_correction from the current fit.
+        """
+        exog = demo_data.drop("District of Columbia", errors="ignore")
+        unit_m = pipeline.scale_m(self.predict(exog))
+        return pandas.Series(np.asarray(unit_m), index=exog.index,
+                             name="m_correction")
@@ -0,0 +1,192 @@
+"""
+Evaluate many what-if scenarios on the snapshot at once.
+
+A scenario is a dict of perturbations:
+
+    name               label for the row
+    shift              list of dict(points=..., state=..., pollster=...),
+                       points added to the spread of the matching polls
+                       (state and pollster are optional filters, state is
+                       a code or a full name)
+    weights            {pollster : Weight} overrides
+    half_life          days, instead of 30
+    exclude_pollsters  pollsters to drop
+    exclude_states     states whose polls are dropped
+
+Every scenario becomes a column: of a spread matrix (polls x scenarios),
+of a time and MESS weight matrix with the exclusions zeroed and of a
+pollster weight matrix. Two sparse products then give all the
+(state, pollster) averages and two more all the state averages, and the
+calls and EV totals follow for every scenario together.
+
+The cluster trends and m_correction, and so the national trend term of
+every state, are held at their values on all the polls, as in
+influence.py; a pipeline rerun would refit the lowess trends too. A state
+left without any polls gets no trend and no margin, as in the pipeline.
+MESS is kept as computed on all the polls; it only depends on earlier
+polls of the same (state, pollster), so dropping whole pollsters or
+states leaves it as it would be.
+
+Pollster and state names that aren't in the polls or the results raise
+KeyError rather than matching nothing.
+
+Usage:
+
+    out = pipeline.run()
+    table = evaluate(out["polls"], out["results"], out["adjusted"], [
+                dict(name="ohio_d2", shift=[dict(state="OH", points=-2)]),
+                dict(name="no_rasmussen", exclude_pollsters=["Rasmussen"]),
+                dict(name="half_life_21", half_life=21)])
+    table["margins"].loc["ohio_d2", "Ohio"], table["ev"]
+"""
+import numpy as np
+import pandas
+from scipy import sparse
+
+import pipeline
+from pipeline import exp_decay
+from poll_schema import states_abbrev_dict
+
+BASELINE = dict(name="baseline")
+
+
+def _states(names, states):
+    """
+    Full state names for codes or names, all of them in `states`.
+    """
+    names = [states_abbrev_dict.get(name, name) for name in names]
+    missing = [name for name in names if name not in states]
+    if missing:
+        raise KeyError("Unknown states %s" % missing)
+    return names
+
+
+def _pollsters(names, pollsters):
+    """
+    `names`, all of them among `pollsters`.
+    """
+    names = list(names)
+    missing = [name for name in names if name not in pollsters]
+    if missing:
+        raise KeyError("Unknown pollsters %s" % missing)
+    return names
+
+
+def _matches(polls, state, pollster, spec, states, pollsters):
+    match = np.ones(len(polls), dtype=bool)
+    if spec.get("state") is not None:
+        match &= state == _states([spec["state"]], states)[0]
+    if spec.get("pollster") is not None:
+        match &= pollster == _pollsters([spec["pollster"]], pollsters)[0]
+    return match
+
+
+def evaluate(polls, results, adjusted=None, scenarios=(BASELINE,),
+             today=pipeline.today, natl_weight=None, weights=None):
+    """
+    State margins and EV totals under every scenario.
+
+    Parameters
+    ----------
+    polls : DataFrame
+        Polls with state, pollster, poll_date, spread, MESS and Weight, as
+        pipeline.state_averages returns them.
+    results : DataFrame
+        The snapshot, indexed by State with Votes.
+    adjusted : Series, optional
+        trend * m_correction by state, the "National" pollster.
+    scenarios : list of dict
+    natl_weight : float, optional
+        Weight of the national trend, the mean of `weights` by default.
+    weights : DataFrame, optional
+        The pollster weights table, pollster_weights.csv by default.
+
+    Returns
+    -------
+    dict with margins (scenarios x states) and ev (obama and romney by
+    scenario).
+    """
+    scenarios = list(scenarios)
+    names = [s.get("name", "scenario_%d" % i)
+             for i, s in enumerate(scenarios)]
+    nscen = len(scenarios)
+    state = polls["state"].astype(str).map(
+                lambda s : states_abbrev_dict.get(s, s)).values
+    pollster = polls["pollster"].astype(str).values
+    group, groups = pandas.factorize(
+                pandas.MultiIndex.from_arrays([state, pollster]))
+    states = results.index
+    group_state = states.get_indexer(groups.get_level_values(0))
+    if (group_state < 0).any():
+        raise KeyError("Polls for states missing from results %s" %
+                       list(np.unique(groups.get_level_values(0)[
+                                                    group_state < 0])))
+    group_pollster = np.asarray(groups.get_level_values(1))
+    pollsters = set(group_pollster)
+    npolls, ngroups, nstates = len(polls), len(groups), len(states)
+
+    days = (today - polls["poll_date"]).dt.days.values.astype(float)
+    mess = polls["MESS"].values
+    spread = polls["spread"].values
+
+    half_life = np.array([s.get("half_life", 30.) for s in scenarios])
+    w = mess[:, None] * exp_decay(days[:, None], half_life[None, :])
+    Y = np.repeat(spread[:, None], nscen, axis=1)
+    pollster_weight = np.zeros(ngroups)
+    pollster_weight[group] = polls["Weight"].values
+    W = np.repeat(pollster_weight[:, None], nscen, axis=1)
+
+    for j, scenario in enumerate(scenarios):
+        for spec in scenario.get("shift", []):
+            Y[_matches(polls, state, pollster, spec, states, pollsters),
+              j] += spec["points"]
+        overrides = scenario.get("weights", {})
+        for name in _pollsters(overrides, pollsters):
+            W[group_pollster == name, j] = overrides[name]
+        dropped = np.isin(pollster, _pollsters(
+                            scenario.get("exclude_pollsters", []), pollsters))
+        excluded_states = _states(scenario.get("exclude_states", []),
+                                  states)
+        dropped |= np.isin(state, excluded_states)
+        w[dropped, j] = 0.
+
+    to_group = sparse.csr_matrix((np.ones(npolls),
+                                  (group, np.arange(npolls))),
+                                 shape=(ngroups, npolls))
+    to_state = sparse.csr_matrix((np.ones(ngroups),
+                                  (group_state, np.arange(ngroups))),
+                                 shape=(nstates, ngroups))
+    num = to_group @ (w * Y)
+    den = to_group @ w
+    has = den > 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        average = np.where(has, num / np.where(has, den, 1.), 0.)
+    Wg = W * has
+    state_num = to_state @ (Wg * average)
+    state_den = to_state @ Wg
+    # without any polls left there's no trend either
+    polled = (to_state @ has.astype(float)) > 0
+
+    if adjusted is not None:
+        if natl_weight is None:
+            if weights is None:
+                weights = pipeline.load_weights()
+            natl_weight = weights.Weight.mean()
+        trend = adjusted.reindex(states).values[:, None]
+        ok = np.isfinite(trend) & polled
+        state_num += np.where(ok, natl_weight * np.nan_to_num(trend), 0.)
+        state_den += np.where(ok, natl_weight, 0.)
+
+    ok = polled & (state_den > 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        margins = np.where(ok, state_num / np.where(ok, state_den, 1),
+                           np.nan)
+    obama, romney = pipeline.call_states(margins, states)
+    votes = results["Votes"].astype(float).values
+    index = pandas.Index(names, name="scenario")
+    ev = pandas.DataFrame(dict(obama=np.dot(votes, obama).astype(int),
+                               romney=np.dot(votes, romney).astype(int)),
+                          index=index)
+    return dict(margins=pandas.DataFrame(margins.T, index=index,
+                                         columns=states),
+                ev=ev)
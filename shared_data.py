@@ -0,0 +1,214 @@
+"""
+Publish typed columns once and hand workers cheap handles to them.
+
+A process pool that gets `state_data2012`, `demo_data` and the weights
+frames as arguments pickles all of them into every task. Instead, publish
+the columns into one block of shared memory (or a memory-mapped file) in
+the parent and send the `DatasetHandle`, which only holds names, dtypes
+and offsets. Workers `attach` the handle and get NumPy views on the same
+memory without copying anything.
+
+Usage:
+
+    with publish(polls, name="polls") as shared:
+        pool.map(work, [(shared.handle, state) for state in states])
+
+    def work(args):
+        handle, state = args
+        polls = attach(handle)            # dict of read-only arrays
+        frame = attach_frame(handle)      # or a DataFrame
+
+Categorical and string columns are stored as integer codes and the
+categories travel with the handle. Datetimes are stored as int64
+nanoseconds and come back as datetime64[ns].
+"""
+import collections
+import mmap
+import os
+import sys
+import uuid
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas
+
+ALIGN = 64
+
+DatasetHandle = collections.namedtuple("DatasetHandle",
+                    ["name", "backend", "nbytes", "columns", "categories",
+                     "index"])
+# one column: name, dtype string, shape, byte offset
+ColumnSpec = collections.namedtuple("ColumnSpec",
+                    ["name", "dtype", "shape", "offset"])
+
+# attached buffers in this process, so a worker attaches a dataset once
+_attached = {}
+
+
+def _columns(data):
+    """
+    Split a frame (or dict of arrays) into plain arrays plus categories.
+    """
+    arrays = collections.OrderedDict()
+    categories = {}
+    if isinstance(data, pandas.DataFrame):
+        items = [(col, data[col]) for col in data.columns]
+    else:
+        items = list(data.items())
+    for name, values in items:
+        if isinstance(values, pandas.Series):
+            if isinstance(values.dtype, pandas.CategoricalDtype):
+                categories[name] = list(values.cat.categories)
+                values = values.cat.codes.values
+            elif values.dtype.kind in "OSUT" or str(values.dtype) == "str":
+                codes, uniques = pandas.factorize(values, sort=True)
+                categories[name] = list(uniques)
+                values = codes
+            elif values.dtype.kind == "M":
+                values = pandas.DatetimeIndex(values).as_unit("ns").values
+            else:
+                values = values.values
+        values = np.asarray(values)
+        if values.dtype.kind == "O":
+            codes, uniques = pandas.factorize(values, sort=True)
+            categories[name] = list(uniques)
+            values = codes
+        arrays[name] = values
+    return arrays, categories
+
+
+def _layout(arrays):
+    specs = []
+    offset = 0
+    for name, values in arrays.items():
+        specs.append(ColumnSpec(name, values.dtype.str, values.shape, offset))
+        offset += -(-values.nbytes // ALIGN) * ALIGN
+    return specs, max(offset, 1)
+
+
+class SharedDataset(object):
+    """
+    The owning side of a published dataset. Closing it (or leaving the
+    with block) releases the memory; handles become invalid after that.
+    """
+    def __init__(self, data, name=None, backend="shm", path=None):
+        arrays, categories = _columns(data)
+        specs, nbytes = _layout(arrays)
+        index = None
+        if isinstance(data, pandas.DataFrame) and not isinstance(
+                data.index, pandas.RangeIndex):
+            index = data.index
+        name = name or "538-" + uuid.uuid4().hex[:12]
+        self._shm = self._mmap = None
+        if backend == "shm":
+            self._shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            buf = self._shm.buf
+            location = self._shm.name
+        elif backend == "file":
+            path = path or os.path.join("/dev/shm" if os.path.isdir(
+                                        "/dev/shm") else ".", name + ".bin")
+            with open(path, "wb") as fout:
+                fout.truncate(nbytes)
+            self._fd = open(path, "r+b")
+            self._mmap = mmap.mmap(self._fd.fileno(), nbytes)
+            buf = self._mmap
+            location = path
+        else:
+            raise ValueError("backend must be 'shm' or 'file'")
+        for spec in specs:
+            view = np.ndarray(spec.shape, dtype=spec.dtype, buffer=buf,
+                              offset=spec.offset)
+            view[...] = arrays[spec.name]
+        self.backend = backend
+        self.handle = DatasetHandle(location, backend, nbytes, tuple(specs),
+                                    categories, index)
+
+    def close(self):
+        if self.backend == "shm" and self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+        elif self.backend == "file" and self._mmap is not None:
+            self._mmap.close()
+            self._fd.close()
+            os.remove(self.handle.name)
+            self._mmap = None
+        _attached.pop(self.handle.name, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def publish(data, name=None, backend="shm", path=None):
+    """
+    Copy the columns of `data` into shared memory once.
+    """
+    return SharedDataset(data, name, backend, path)
+
+
+def _buffer(handle):
+    if handle.name in _attached:
+        return _attached[handle.name][1]
+    if handle.backend == "shm":
+        # the parent owns the block and unlinks it. Before 3.13 workers
+        # share the parent's resource tracker, so registering again is
+        # harmless
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(handle.name, track=False)
+        else:
+            shm = shared_memory.SharedMemory(handle.name)
+        owner, buf = shm, shm.buf
+    else:
+        fd = open(handle.name, "rb")
+        owner = buf = mmap.mmap(fd.fileno(), handle.nbytes,
+                                access=mmap.ACCESS_READ)
+        fd.close()
+    _attached[handle.name] = (owner, buf)
+    return buf
+
+
+def attach(handle, columns=None):
+    """
+    Rebuild read-only NumPy views on a published dataset.
+    """
+    buf = _buffer(handle)
+    arrays = collections.OrderedDict()
+    for spec in handle.columns:
+        if columns is not None and spec.name not in columns:
+            continue
+        view = np.ndarray(spec.shape, dtype=spec.dtype, buffer=buf,
+                          offset=spec.offset)
+        view.flags.writeable = False
+        arrays[spec.name] = view
+    return arrays
+
+
+def attach_frame(handle, columns=None):
+    """
+    Rebuild a DataFrame from a published dataset. Numeric columns are
+    backed by the shared buffer where pandas allows it.
+    """
+    arrays = attach(handle, columns)
+    frame = pandas.DataFrame(index=handle.index)
+    for name, values in arrays.items():
+        if name in handle.categories:
+            frame[name] = pandas.Categorical.from_codes(
+                                values, handle.categories[name])
+        else:
+            frame[name] = values
+    return frame
+
+
+def detach(handle):
+    """
+    Drop this process's mapping of a published dataset.
+    """
+    owner, buf = _attached.pop(handle.name, (None, None))
+    if owner is not None and hasattr(owner, "close"):
+        try:
+            owner.close()
+        except BufferError: # views still alive
+            _attached[handle.name] = (owner, buf)
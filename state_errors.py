@@ -0,0 +1,248 @@
+"""
+Correlated state polling errors as a low-rank factor model.
+
+The error in every state's margin is
+
+    error = L f + e,    f ~ N(0, I),  e ~ N(0, D)
+
+so the states x states covariance is L L' + D, with the columns of L
+
+    national       one factor, every state loads national_sd
+    cluster        one factor per KMeans cluster, cluster_sd on its states
+    regional       the leading smooth modes of the KNN neighbor graph,
+                   the eigenvectors of its normalized adjacency after the
+                   trivial one; neighboring states load alike
+    demographic    the leading principal components of the whitened
+                   demographics
+
+and D the idiosyncratic state variance. Each block is scaled so that its
+average variance across states is its sd squared. With k factors a draw
+costs O(states x k) and conditioning on the errors observed in some
+states (early returns, say) is a k x k solve by Woodbury, so the dense
+covariance is never formed or inverted; `covariance` is only there to
+look at.
+
+The loadings are cached on a fingerprint of the inputs and settings, so
+building the model again in a run is a dictionary lookup. The cache keeps
+the CACHE_SIZE most recently built models.
+
+Usage:
+
+    out = pipeline.run()
+    errors = state_errors(out["demo_data"], out["labels"])
+    draws = errors.sample(10000, seed=0)            # sims x states
+    margins = projection.starting_margins(out["results"]).values + draws
+    rest = errors.condition({"Ohio" : -2.5, "Florida" : -1.})
+    rest.mean, rest.sd()
+"""
+import collections
+
+import numpy as np
+import pandas
+from scipy import linalg
+from scipy.cluster import vq
+
+from model_registry import NeighborsFit, fingerprint
+
+CACHE_SIZE = 16
+_cache = collections.OrderedDict()
+
+
+class StateErrors(object):
+    """
+    Parameters
+    ----------
+    loadings : DataFrame
+        states x factors, L.
+    idiosyncratic : Series
+        The state variances, D.
+    mean : Series, optional
+        Zero by default; conditioning moves it.
+    """
+    def __init__(self, loadings, idiosyncratic, mean=None):
+        self.loadings = loadings
+        self.idiosyncratic = idiosyncratic.reindex(loadings.index)
+        if mean is None:
+            mean = pandas.Series(0., index=loadings.index)
+        self.mean = mean.reindex(loadings.index)
+        self._L = np.ascontiguousarray(loadings.values, dtype=float)
+        self._D = self.idiosyncratic.values.astype(float)
+
+    @property
+    def states(self):
+        return self.loadings.index
+
+    def sd(self):
+        """
+        The marginal standard deviation of every state's error.
+        """
+        return pandas.Series(np.sqrt((self._L**2).sum(1) + self._D),
+                             index=self.states, name="sd")
+
+    def covariance(self):
+        """
+        The dense states x states covariance. Not needed for sampling or
+        conditioning.
+        """
+        cov = np.dot(self._L, self._L.T) + np.diag(self._D)
+        return pandas.DataFrame(cov, index=self.states, columns=self.states)
+
+    def sample(self, nsims, seed=None, dtype=np.float64):
+        """
+        nsims x states draws of the errors.
+        """
+        rng = np.random.default_rng(seed)
+        nstates, nfactors = self._L.shape
+        factors = rng.standard_normal((nsims, nfactors), dtype=dtype)
+        state = rng.standard_normal((nsims, nstates), dtype=dtype)
+        draws = np.dot(factors, self._L.T.astype(dtype))
+        draws += np.sqrt(self._D).astype(dtype) * state
+        draws += self.mean.values.astype(dtype)
+        return draws
+
+    def condition(self, observed, noise=0.):
+        """
+        The errors of the other states given the errors in `observed`.
+
+        Parameters
+        ----------
+        observed : dict or Series
+            state -> observed error.
+        noise : float or Series
+            Variance of the observations on top of the model, if they
+            are themselves uncertain.
+
+        Returns
+        -------
+        A StateErrors over the unobserved states, with the conditional
+        mean and the conditional covariance in factor form.
+        """
+        observed = pandas.Series(observed, dtype=float)
+        at = self.states.get_indexer(observed.index)
+        if (at < 0).any():
+            raise KeyError("Unknown states %s" %
+                           list(observed.index[at < 0]))
+        rest = np.setdiff1d(np.arange(len(self.states)), at)
+        L_o = self._L[at]
+        d_o = self._D[at] + np.asarray(
+                    pandas.Series(noise, index=observed.index), dtype=float)
+        resid = observed.values - self.mean.values[at]
+        # posterior of the factors: precision I + L_o' D_o^-1 L_o
+        precision = np.eye(L_o.shape[1]) + np.dot(L_o.T / d_o, L_o)
+        chol = linalg.cho_factor(precision)
+        factor_mean = linalg.cho_solve(chol, np.dot(L_o.T, resid / d_o))
+        # L_u P^-1 L_u' = (L_u C^-T)(L_u C^-T)' with P = C C'
+        lower = linalg.cholesky(precision, lower=True)
+        L_u = linalg.solve_triangular(lower, self._L[rest].T,
+                                      lower=True).T
+        states = self.states[rest]
+        mean = self.mean.values[rest] + np.dot(self._L[rest], factor_mean)
+        return StateErrors(pandas.DataFrame(L_u, index=states,
+                                            columns=self.loadings.columns),
+                           pandas.Series(self._D[rest], index=states),
+                           pandas.Series(mean, index=states))
+
+
+def neighbor_modes(clean_data, n_neighbors=7, nmodes=3):
+    """
+    The leading nontrivial eigenvectors of the symmetrically normalized
+    adjacency of the KNN graph, unit norm, states x nmodes.
+    """
+    knn = NeighborsFit(clean_data, n_neighbors)
+    nstates = len(clean_data)
+    adjacency = np.zeros((nstates, nstates))
+    rows = np.repeat(np.arange(nstates), knn.neighbors.shape[1])
+    adjacency[rows, knn.neighbors.ravel()] = 1.
+    np.fill_diagonal(adjacency, 0.)
+    adjacency = np.maximum(adjacency, adjacency.T)
+    degree = adjacency.sum(1)
+    scaled = adjacency / np.sqrt(np.outer(degree, degree))
+    _, vectors = linalg.eigh(scaled)
+    # eigh sorts ascending; the largest is the trivial sqrt(degree) mode
+    return vectors[:, ::-1][:, 1:nmodes + 1]
+
+
+def principal_components(clean_data, ncomponents=3):
+    """
+    The leading principal components of the whitened data, unit norm,
+    and the share of the variance each explains.
+    """
+    centered = clean_data - clean_data.mean(0)
+    u, s, _ = linalg.svd(centered, full_matrices=False)
+    share = s**2 / (s**2).sum()
+    return u[:, :ncomponents], share[:ncomponents]
+
+
+def _block(vectors, sd):
+    # unit norm columns scaled to an average variance of sd**2
+    nstates, ncols = vectors.shape
+    return vectors * sd * np.sqrt(nstates / float(max(ncols, 1)))
+
+
+def state_errors(demo_data, labels, clean_data=None, national_sd=2.,
+                 cluster_sd=1.5, regional_sd=1., demo_sd=1., state_sd=2.,
+                 n_neighbors=7, nregional=3, ndemographic=3, scale=None):
+    """
+    Build the factor model of state errors.
+
+    Parameters
+    ----------
+    demo_data : DataFrame
+        State demographics, as pipeline.load_demographics gives them.
+    labels : Series
+        KMeans labels by state, from pipeline.cluster_states.
+    clean_data : array, optional
+        The whitened demographics, vq.whiten(demo_data.values) by
+        default, e.g. feature_store's matrix(kind="whiten").
+    national_sd, cluster_sd, regional_sd, demo_sd, state_sd : float
+        Standard deviation of each component, in points of margin.
+    n_neighbors : int
+        Neighborhood size of the KNN graph (including the state).
+    nregional, ndemographic : int
+        Number of neighbor graph modes and principal components.
+    scale : Series, optional
+        A multiplier by state on all of its error, e.g.
+        projection.state_volatility.
+
+    Returns
+    -------
+    StateErrors
+    """
+    states = demo_data.index
+    if clean_data is None:
+        clean_data = vq.whiten(demo_data.values)
+    clean_data = np.asarray(clean_data, dtype=float)
+    key = fingerprint(clean_data, labels.reindex(states), scale,
+                      list(states), national_sd, cluster_sd, regional_sd,
+                      demo_sd, state_sd, n_neighbors, nregional,
+                      ndemographic)
+    cached = _cache.get(key)
+    if cached is not None:
+        _cache.move_to_end(key)
+        return cached
+
+    nstates = len(states)
+    codes, clusters = pandas.factorize(labels.reindex(states))
+    membership = np.zeros((nstates, len(clusters)))
+    membership[codes >= 0, codes[codes >= 0]] = cluster_sd
+    regional = neighbor_modes(clean_data, n_neighbors, nregional)
+    demographic, _ = principal_components(clean_data, ndemographic)
+
+    loadings = np.column_stack((np.full(nstates, national_sd), membership,
+                                _block(regional, regional_sd),
+                                _block(demographic, demo_sd)))
+    names = (["national"] + ["cluster_%s" % c for c in clusters] +
+             ["regional_%d" % i for i in range(regional.shape[1])] +
+             ["demographic_%d" % i for i in range(demographic.shape[1])])
+    variance = np.full(nstates, float(state_sd)**2)
+    if scale is not None:
+        scale = scale.reindex(states).fillna(1.).values
+        loadings = loadings * scale[:, None]
+        variance = variance * scale**2
+    errors = StateErrors(pandas.DataFrame(loadings, index=states,
+                                          columns=names),
+                         pandas.Series(variance, index=states))
+    _cache[key] = errors
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return errors
@@ -0,0 +1,20 @@
+import os
+
+import pytest
+
+import pipeline
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(autouse=True)
+def in_root(monkeypatch):
+    # the data paths are relative to the repository
+    monkeypatch.chdir(ROOT)
+
+
+@pytest.fixture(scope="session")
+def out():
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(ROOT)
+        return pipeline.run()
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas
+import pytest
+
+import bootstrap
+
+
+def test_estimate_is_the_snapshot(out):
+    boot = bootstrap.bootstrap(out["polls"], adjusted=out["adjusted"],
+                               nboot=200, seed=0)
+    poll = out["results"]["poll"].reindex(boot.index)
+    np.testing.assert_allclose(boot["estimate"], poll)
+    assert (boot[.05] <= boot[.95]).all()
+
+
+def test_counts_stay_in_their_groups():
+    group = np.array([2, 0, 1, 0, 2, 2, 0])
+    counts = bootstrap._resample_counts(group, 1000,
+                                        np.random.default_rng(0))
+    assert counts.shape == (1000, len(group))
+    for g in range(3):
+        np.testing.assert_array_equal(counts[:, group == g].sum(1),
+                                      (group == g).sum())
+    # every member equally likely
+    np.testing.assert_allclose(counts.mean(0), 1., atol=.1)
+
+
+def test_se_of_a_plain_mean():
+    rng = np.random.default_rng(1)
+    spread = rng.normal(3., 4., 40)
+    polls = pandas.DataFrame(dict(state="OH", pollster="A", spread=spread,
+                                  time_weight=1., MESS=1., Weight=1.))
+    boot = bootstrap.bootstrap(polls, nboot=20000, seed=0)
+    np.testing.assert_allclose(boot.loc["Ohio", "estimate"], spread.mean())
+    # the bootstrap se of a mean is the plug-in sd / sqrt(n)
+    np.testing.assert_allclose(boot.loc["Ohio", "se"],
+                               spread.std() / np.sqrt(len(spread)),
+                               rtol=.03)
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas
+import pytest
+import statsmodels.api as sm
+from statsmodels.formula.api import ols, wls
+from statsmodels.stats.outliers_influence import OLSInfluence
+
+import diagnostics
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    frame = pandas.DataFrame(dict(x1=rng.normal(size=80),
+                                  x2=rng.uniform(size=80),
+                                  w=rng.uniform(.5, 2, 80)),
+                             index=["row%d" % i for i in range(80)])
+    frame["y"] = 1 + frame["x1"] - 2 * frame["x2"] + rng.standard_t(3, 80)
+    return frame
+
+
+def test_summary_frame_matches_statsmodels(data):
+    results = ols("y ~ x1 + x2", data=data).fit()
+    table = diagnostics.influence(results).summary_frame()
+    expected = results.get_influence().summary_frame()
+    pandas.testing.assert_frame_equal(table[expected.columns], expected,
+                                      rtol=1e-8)
+    press = OLSInfluence(results).resid_press
+    np.testing.assert_allclose(table["press_resid"], press)
+
+
+def test_wls_matches_statsmodels(data):
+    results = wls("y ~ x1 + x2", data=data, weights=data["w"]).fit()
+    infl = diagnostics.influence(results)
+    # WLS results have no get_influence, so OLS on the whitened data
+    root = np.sqrt(data["w"].values)
+    expected = sm.OLS(results.model.endog * root,
+                      results.model.exog * root[:, None]).fit(
+                                                    ).get_influence()
+    np.testing.assert_allclose(infl.hat_diag, expected.hat_matrix_diag)
+    np.testing.assert_allclose(infl.resid_studentized_external,
+                               expected.resid_studentized_external)
+    np.testing.assert_allclose(infl.cooks_distance, expected.cooks_distance[0])
+
+
+@pytest.mark.parametrize("method", ["bonf", "fdr_bh"])
+def test_outlier_test_matches_statsmodels(data, method):
+    results = ols("y ~ x1 + x2", data=data).fit()
+    table = diagnostics.influence(results).outlier_test(method)
+    expected = results.outlier_test(method)
+    np.testing.assert_allclose(table.values, expected.values)
+    assert list(table.index) == list(data.index)
+
+
+def test_press_is_the_leave_one_out_error(data):
+    X = sm.add_constant(data[["x1", "x2"]].values)
+    y = data["y"].values
+    infl = diagnostics.Influence(X, y)
+    errors = []
+    for i in range(len(y)):
+        keep = np.arange(len(y)) != i
+        beta = np.linalg.lstsq(X[keep], y[keep], rcond=None)[0]
+        errors.append(y[i] - np.dot(X[i], beta))
+    np.testing.assert_allclose(infl.resid_press, errors)
+    np.testing.assert_allclose(infl.press, np.dot(errors, errors))
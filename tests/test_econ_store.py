@@ -0,0 +1,64 @@
+import numpy as np
+import pandas
+import pytest
+
+import econ_store
+
+
+@pytest.fixture
+def indicators(tmp_path):
+    rng = np.random.default_rng(0)
+    dates = pandas.date_range("2000-10-01", "2012-09-01", freq="MS")
+    data = pandas.DataFrame(
+                dict((name, 100 * np.exp(np.cumsum(rng.normal(.002, .01,
+                                                              len(dates)))))
+                     for name in econ_store.series),
+                index=pandas.DatetimeIndex(dates, name="DATE"))
+    path = str(tmp_path / "indicators.csv")
+    data.to_csv(path)
+    return path, data
+
+
+def test_updates_only_append(tmp_path, indicators):
+    path, data = indicators
+    store = econ_store.SeriesStore(str(tmp_path / "econ"))
+    early = str(tmp_path / "early.csv")
+    data.loc[:"2008-12-01"].to_csv(early)
+    added = store.update(econ_store.FileSource(early))
+    assert set(added.values()) == {len(data.loc[:"2008-12-01"])}
+    added = store.update(econ_store.FileSource(path))
+    assert set(added.values()) == {len(data.loc["2009-01-01":])}
+    assert set(store.update(econ_store.FileSource(path)).values()) == {0}
+    loaded = store.load()
+    np.testing.assert_allclose(loaded[data.columns].values, data.values)
+    assert store.last_date("PAYEMS") == data.index[-1]
+
+
+def test_econ_matches_historical_adjustment(tmp_path, indicators):
+    path, data = indicators
+    store = econ_store.SeriesStore(str(tmp_path / "econ"))
+    store.update(econ_store.FileSource(path))
+    growth = store.quarterly_growth()
+    expected = (np.log(data.resample("QE").mean()).diff() * 400).dropna()
+    np.testing.assert_allclose(growth[data.columns].values, expected.values)
+    # historical_adjustment.py's positional slices of the same growth
+    slices = {2004 : slice(None, 15), 2008 : slice(15, 31),
+              2012 : slice(32, None)}
+    for cycle, rows in slices.items():
+        part = expected.iloc[rows]
+        np.testing.assert_allclose(
+                store.econ(cycle)[data.columns].values,
+                part.resample("YE").mean().mean().values)
+
+
+def test_transforms_are_recomputed_after_an_update(tmp_path, indicators):
+    path, data = indicators
+    store = econ_store.SeriesStore(str(tmp_path / "econ"))
+    early = str(tmp_path / "early.csv")
+    data.loc[:"2008-12-01"].to_csv(early)
+    store.update(econ_store.FileSource(early))
+    before = store.quarterly_growth()
+    cached = econ_store.SeriesStore(store.path).quarterly_growth()
+    assert len(cached) == len(before)
+    store.update(econ_store.FileSource(path))
+    assert len(store.quarterly_growth()) > len(before)
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas
+import pytest
+from scipy.cluster import vq
+
+import feature_store
+import pipeline
+
+
+@pytest.fixture(scope="module")
+def store():
+    return feature_store.load_store()
+
+
+def test_current_vintage_matches_demographics(store):
+    demo_data = pipeline.load_demographics()
+    frame = store.frame("2011-07-01")
+    pandas.testing.assert_frame_equal(frame, demo_data[store.columns].astype(float),
+                                      check_names=False)
+    np.testing.assert_allclose(store.matrix("2011-07-01", kind="whiten"),
+                               vq.whiten(demo_data[store.columns].values))
+
+
+def test_midpoint_is_the_average_of_the_vintages(store):
+    first, last = store.dates
+    middle = first + (last - first) / 2
+    census = store.features
+    np.testing.assert_allclose(
+        store.matrix(middle, census),
+        (store.matrix(first, census) + store.matrix(last, census)) / 2)
+    # flat outside the vintages
+    np.testing.assert_array_equal(store.matrix("1990-01-01", census),
+                                  store.matrix(first, census))
+
+
+def test_standardize(store):
+    X = store.matrix("2012-10-02", ["per_black", "PVI"], kind="standardize")
+    np.testing.assert_allclose(X.mean(0), 0, atol=1e-12)
+    np.testing.assert_allclose(X.std(0), 1)
+    assert not X.flags.writeable
+
+
+def test_constant_column_is_left_unscaled():
+    store = feature_store.FeatureStore(["a", "b", "c"])
+    store.add_vintage("2000-01-01", pandas.DataFrame(
+                          dict(x=[1., 2., 3.], flat=[5., 5., 5.]),
+                          index=["a", "b", "c"]))
+    with pytest.warns(RuntimeWarning):
+        X = store.matrix("2000-01-01", kind="whiten")
+    with pytest.warns(RuntimeWarning):
+        expected = vq.whiten(np.array([[1., 5.], [2., 5.], [3., 5.]]))
+    np.testing.assert_allclose(X, expected)
+    with pytest.warns(RuntimeWarning):
+        X = store.matrix("2000-01-01", kind="standardize")
+    np.testing.assert_array_equal(X[:, 1], 0.)
+
+
+def test_cache_is_bounded():
+    store = feature_store.load_store()
+    store.cache_size = 3
+    first = store.matrix("2004-01-01")
+    for year in range(2005, 2010):
+        store.matrix("%d-01-01" % year)
+    assert len(store._cache) == 3
+    np.testing.assert_array_equal(store.matrix("2004-01-01"), first)
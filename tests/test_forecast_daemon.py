@@ -0,0 +1,92 @@
+import os
+import shutil
+
+import numpy as np
+import pandas
+import pytest
+
+import forecast_daemon
+import pipeline
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def daemon(tmp_path, monkeypatch):
+    monkeypatch.chdir(ROOT)
+    paths = {}
+    for name in ("2012_poll_data_states.csv", "2012_poll_data.csv"):
+        paths[name] = str(tmp_path / name)
+        shutil.copy(os.path.join("data", name), paths[name])
+    daemon = forecast_daemon.ForecastDaemon(
+                state_path=paths["2012_poll_data_states.csv"],
+                national_path=paths["2012_poll_data.csv"],
+                output=str(tmp_path / "predicted.csv"),
+                ev_output=str(tmp_path / "ev.csv"), debounce=0)
+    daemon.full_run()
+    return daemon
+
+
+def _new_poll(daemon):
+    poll = daemon.table[daemon.table["State"] == "Ohio"].head(1).copy()
+    poll["sample"] = poll["sample"] + 1
+    return poll
+
+
+def test_submitted_poll_survives_file_reload(daemon):
+    nrows = len(daemon.table)
+    daemon.submit(_new_poll(daemon))
+    stat = os.stat(daemon.state_path)
+    os.utime(daemon.state_path, ns=(stat.st_atime_ns,
+                                    stat.st_mtime_ns + 10**9))
+    daemon.step()
+    assert len(daemon.table) == nrows + 1
+    # and through a later reload too
+    os.utime(daemon.state_path, ns=(stat.st_atime_ns,
+                                    stat.st_mtime_ns + 2 * 10**9))
+    daemon.step()
+    assert len(daemon.table) == nrows + 1
+
+
+
+def test_file_change_during_debounce_reloads(daemon, monkeypatch):
+    daemon.submit(_new_poll(daemon))
+    loads = []
+    load = daemon._load
+    monkeypatch.setattr(daemon, "_load",
+                        lambda : loads.append(1) or load())
+    sleep = forecast_daemon.time.sleep
+
+    def touch_once(seconds):
+        if not loads and not touched:
+            stat = os.stat(daemon.state_path)
+            os.utime(daemon.state_path, ns=(stat.st_atime_ns,
+                                            stat.st_mtime_ns + 10**9))
+            touched.append(1)
+        sleep(seconds)
+    touched = []
+    monkeypatch.setattr(forecast_daemon.time, "sleep", touch_once)
+    daemon.step()
+    assert touched and loads
+    assert daemon._mtimes == daemon._stat()
+
+
+def test_changed_groups(daemon):
+    table = daemon.table
+    assert forecast_daemon.changed_groups(table, table) == set()
+    poll = _new_poll(daemon)
+    new = pandas.concat((poll, table), ignore_index=True)
+    assert forecast_daemon.changed_groups(table, new) == {
+                (poll["state"].iloc[0], poll["pollster"].iloc[0])}
+
+
+def test_update_matches_full_recompute(daemon):
+    daemon.submit(_new_poll(daemon))
+    daemon.step()
+    polls, averages = pipeline.state_averages(daemon.table, daemon.today)
+    trends = pipeline.cluster_trends(polls, daemon.national, daemon.labels)
+    adjusted = pipeline.adjust_trends(trends, daemon.m_correction)
+    results = pipeline.snapshot(averages, adjusted, daemon.weights)
+    np.testing.assert_allclose(daemon.results["poll"].values,
+                               results["poll"].values, atol=1e-10)
+    assert daemon.ev == pipeline.tally(results)
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas
+import pytest
+
+from forecast_history import FIELDS, ForecastHistory
+
+
+@pytest.fixture
+def recorded(tmp_path):
+    """
+    A history of 30 runs, each changing a few values of the last, and the
+    full table after every run.
+    """
+    rng = np.random.default_rng(0)
+    history = ForecastHistory(str(tmp_path / "history"), keyframe_every=7)
+    states = ["Ohio", "Florida", "Iowa", "Nevada"]
+    table = pandas.DataFrame(rng.normal(size=(4, 3)), index=states,
+                             columns=FIELDS)
+    tables, whens = [], []
+    start = pandas.Timestamp("2012-10-01")
+    for i in range(30):
+        table = table.copy()
+        if i == 12:
+            # a state shows up, with no trend
+            table.loc["Virginia"] = [rng.normal(), np.nan, 1.]
+        for _ in range(rng.integers(0, 3)):
+            table.iloc[rng.integers(len(table)), rng.integers(2)] = (
+                                                        rng.normal())
+        when = start + pandas.Timedelta(hours=6 * i)
+        history.append(when, table, dict(obama=300 + i, romney=238 - i))
+        tables.append(table)
+        whens.append(when)
+    return history, tables, whens
+
+
+def _full(table, states):
+    return table.reindex(states)[FIELDS]
+
+
+def test_as_of_every_run(recorded):
+    history, tables, whens = recorded
+    reopened = ForecastHistory(history.path)
+    for store in (history, reopened):
+        states = store.meta["states"]
+        for run, table in enumerate(tables):
+            got = store.as_of(run=run)
+            np.testing.assert_array_equal(got.values,
+                                          _full(table, states).values)
+    got = history.as_of(whens[9] + pandas.Timedelta(hours=1))
+    np.testing.assert_array_equal(got.values, _full(tables[9],
+                                                    got.index).values)
+    with pytest.raises(IndexError):
+        history.as_of("2012-09-01")
+
+
+def test_state_history_matches_the_tables(recorded):
+    history, tables, whens = recorded
+    for state in ["Ohio", "Virginia"]:
+        frame = history.state_history(state, last=20, until=25)
+        expected = [_full(table, [state]).values[0]
+                    for table in tables[6:26]]
+        np.testing.assert_array_equal(frame[FIELDS].values, expected)
+        assert list(frame.index) == whens[6:26]
+        np.testing.assert_array_equal(frame["obama"], 300 + np.arange(6, 26))
+
+
+def test_runs_table_and_order(recorded):
+    history, tables, whens = recorded
+    runs = history.runs()
+    assert len(runs) == len(history) == 30
+    assert list(runs["when"]) == whens
+    with pytest.raises(ValueError):
+        history.append(whens[0], tables[0], dict(obama=0, romney=0))
+    with pytest.raises(KeyError):
+        history.state_history("Atlantis")
+
+
+def test_record_a_pipeline_run(out, tmp_path):
+    history = ForecastHistory(str(tmp_path / "history"))
+    history.record(out, when="2012-10-02")
+    table = history.as_of()
+    np.testing.assert_array_equal(table["poll"].values,
+                                  out["results"]["poll"].values)
+    assert history.runs()["obama"].iloc[0] == out["ev"]["obama"]
@@ -0,0 +1,50 @@
+import json
+
+import numpy as np
+import pytest
+
+import forecast_service
+
+
+@pytest.fixture(scope="module")
+def service(out):
+    snapshot = forecast_service.Snapshot(out, version=3)
+    service = forecast_service.ForecastService(snapshot, snapshot_path=None)
+    yield service
+    service._executor.shutdown()
+
+
+def test_pages_match_the_pipeline(service, out):
+    status, headers, body = service.respond("GET", "/states/Ohio", {})
+    assert status == 200
+    ohio = json.loads(body.decode())
+    np.testing.assert_allclose(ohio["poll"], out["results"].loc["Ohio",
+                                                                "poll"])
+    status, _, body = service.respond("GET", "/national/", {})
+    assert json.loads(body.decode())["ev"] == out["ev"]
+
+
+@pytest.mark.parametrize("header, matches", [
+    (None, False),
+    ('"other"', False),
+    ("{etag}", True),
+    ("W/{etag}", True),
+    ('"other", {etag}', True),
+    ('"a", W/"b",W/{etag}', True),
+    ("*", True),
+])
+def test_if_none_match(service, header, matches):
+    _, headers, _ = service.respond("GET", "/states", {})
+    etag = headers["ETag"]
+    request = {} if header is None else {
+                    "if-none-match" : header.format(etag=etag)}
+    status, headers, body = service.respond("GET", "/states", request)
+    assert status == (304 if matches else 200)
+    assert headers["ETag"] == etag
+    assert (body == b"") == matches
+
+
+def test_errors(service):
+    assert service.respond("GET", "/states/Atlantis", {})[0] == 404
+    assert service.respond("DELETE", "/states", {})[0] == 405
+    assert service.respond("PUT", "/recompute", {})[0] == 405
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas
+import pytest
+
+import get_census_data
+
+
+@pytest.fixture
+def quickfacts(tmp_path):
+    rng = np.random.default_rng(0)
+    fips = []
+    for state in range(1, 52):
+        fips += [state * 1000, state * 1000 + 1, state * 1000 + 3]
+    fips = [0] + fips
+    data = pandas.DataFrame(dict(FIPS=fips))
+    for prefix in get_census_data.variables:
+        data[prefix + "211"] = rng.uniform(1, 50, len(fips)).round(1)
+    # an older vintage of one item, and a column that isn't used
+    data["PST045210"] = 1.
+    data["LND110210"] = 2.
+    data.to_csv(str(tmp_path / "DataSet.txt"), index=False)
+    names = ["UNITED STATES"] + ["State %d" % (f // 1000) if f % 1000 == 0
+                                 else "County %d" % f for f in fips[1:]]
+    with open(str(tmp_path / "FIPS_CountyName.txt"), "w") as fout:
+        for code, name in zip(fips, names):
+            fout.write("%05d %s\n" % (code, name))
+    return tmp_path, data
+
+
+def test_load_census_matches_a_direct_computation(quickfacts):
+    path, data = quickfacts
+    census = get_census_data.load_census(str(path), chunksize=7)
+    states = data[(data["FIPS"] % 1000 == 0) & (data["FIPS"] > 0)]
+    assert list(census.index) == ["STATE %d" % i for i in range(1, 52)]
+    tot_pop = states["PST045211"].values
+    older = states["AGE775211"].values / 100. * tot_pop
+    vote = tot_pop - states["AGE295211"].values / 100. * tot_pop - older
+    np.testing.assert_allclose(census["older_pop"], older)
+    np.testing.assert_allclose(census["per_vote"], vote / tot_pop)
+    np.testing.assert_allclose(census["per_black"], states["RHI225211"])
+    assert list(census.columns) == get_census_data.COLUMNS
+    assert (path / "census_states_211.csv").exists()
+
+
+def test_cached_table_is_reused(quickfacts):
+    path, _ = quickfacts
+    first = get_census_data.load_census(str(path))
+    again = get_census_data.load_census(str(path), chunksize=5)
+    pandas.testing.assert_frame_equal(first, again, check_dtype=False)
+
+
+def test_missing_variable(quickfacts):
+    path, data = quickfacts
+    data.drop(columns=["POP060211"]).to_csv(str(path / "DataSet.txt"),
+                                             index=False)
+    with pytest.raises(ValueError):
+        get_census_data.load_census(str(path))
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas
+import pytest
+from scipy import sparse
+
+import house_effects
+
+
+@pytest.fixture(scope="module")
+def exact(out):
+    return house_effects.house_effects(out["polls"])
+
+
+def _design(polls):
+    pollster = pandas.factorize(polls["pollster"].astype(str))[0]
+    state = pandas.factorize(polls["State"].astype(str), sort=True)[0]
+    date = pandas.factorize(polls["poll_date"], sort=True)[0]
+    ps = pandas.factorize(polls["pollster"].astype(str) + "-" +
+                          polls["State"].astype(str))[0]
+    X = np.column_stack((np.ones(len(polls)),
+                         np.eye(state.max() + 1)[state][:, 1:],
+                         np.eye(date.max() + 1)[date][:, 1:]))
+    return X, state, date, pollster, ps
+
+
+def test_fixed_rank_matches_dense_rank(out):
+    X, state, date, _, _ = _design(out["polls"])
+    rank = house_effects._fixed_rank(state, state.max() + 1, date,
+                                     date.max() + 1)
+    assert rank == np.linalg.matrix_rank(X) < X.shape[1]
+
+
+def test_fixed_variances_match_penalized_least_squares(out):
+    polls = out["polls"]
+    variances = dict(residual=9., pollster=4., pollster_state=2.)
+    fit = house_effects.house_effects(polls, variances=variances)
+    X, _, _, pollster, ps = _design(polls)
+    Z1 = np.eye(pollster.max() + 1)[pollster]
+    Z2 = np.eye(ps.max() + 1)[ps]
+    # the same penalties as rows of an augmented least squares
+    penalty = np.r_[np.zeros(X.shape[1]),
+                    np.repeat(np.sqrt(9. / 4.), Z1.shape[1]),
+                    np.repeat(np.sqrt(9. / 2.), Z2.shape[1])]
+    W = np.column_stack((X, Z1, Z2))
+    A = np.vstack((W, np.diag(penalty)[X.shape[1]:]))
+    b = np.r_[polls["spread"].values, np.zeros(len(penalty) - X.shape[1])]
+    theta = np.linalg.lstsq(A, b, rcond=None)[0]
+    u1 = theta[X.shape[1]:X.shape[1] + Z1.shape[1]]
+    names = pandas.factorize(polls["pollster"].astype(str))[1]
+    np.testing.assert_allclose(fit["pollsters"].loc[names].values, u1,
+                               atol=1e-4)
+
+
+def test_cg_matches_splu(out, exact):
+    fit = house_effects.house_effects(out["polls"], solver="cg")
+    for key, value in exact["variances"].items():
+        assert fit["variances"][key] == pytest.approx(value, rel=1e-4)
+    np.testing.assert_allclose(fit["effects"]["house"].values,
+                               exact["effects"]["house"].values, atol=1e-3)
+
+
+def test_hutchinson_close_to_exact(out, exact):
+    fit = house_effects.house_effects(out["polls"], exact_limit=0)
+    for key, value in exact["variances"].items():
+        assert fit["variances"][key] == pytest.approx(value, rel=.2)
+
+
+def test_effects_are_shrunk(exact):
+    effects = exact["effects"]
+    assert (effects["house"] == effects["pollster_effect"] +
+            effects["deviation"]).all()
+    # a singleton pollster-state is pulled toward its pollster's effect
+    single = effects[effects["npolls"] == 1]
+    assert (single["deviation"].abs() < 5).all()
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import influence
+import pipeline
+
+
+@pytest.fixture(scope="module")
+def loo(out):
+    return influence.leave_one_pollster_out(out["polls"], out["results"],
+                                            out["adjusted"])
+
+
+@pytest.mark.parametrize("pollster", ["Rasmussen", "SurveyUSA", "Public Policy Polling (PPP)"])
+def test_pollster_matches_rerun(out, loo, pollster):
+    polls = out["polls"]
+    polls = polls[polls["pollster"].astype(str) != pollster]
+    polls = polls.drop(columns=["ESS", "MESS", "time_weight"])
+    _, averages = pipeline.state_averages(polls)
+    results = pipeline.snapshot(averages, out["adjusted"], out["weights"])
+    poll = loo["poll"].loc[pollster]
+    # the rerun keeps the trend alone where the pollster was all there was
+    polled = poll.notnull()
+    np.testing.assert_allclose(poll[polled].values,
+                               results["poll"][polled].values, atol=1e-10)
+    obama, romney = pipeline.call_states(
+                        results["poll"].where(polled).values, results.index)
+    votes = results["Votes"].values
+    assert loo["ev"].loc[pollster, "obama"] == np.dot(votes, obama)
+    assert loo["ev"].loc[pollster, "romney"] == np.dot(votes, romney)
+
+
+def test_delta_is_zero_where_the_pollster_never_polled(out, loo):
+    polls = out["polls"]
+    states = polls.loc[polls["pollster"].astype(str) == "Quinnipiac",
+                       "State"].unique()
+    delta = loo["delta"].loc["Quinnipiac"]
+    others = delta.index.difference(states)
+    np.testing.assert_allclose(delta[others].dropna(), 0., atol=1e-12)
+    assert (delta[states].abs() > 0).any()
+
+
+def test_poll_matches_rerun(out):
+    polls = out["polls"]
+    table = influence.leave_one_poll_out(polls, out["results"],
+                                         out["adjusted"])
+    for at in [0, 100, len(polls) - 1]:
+        rest = polls.drop(polls.index[at])
+        averages = pipeline.pollster_averages(rest).sort_index()
+        results = pipeline.snapshot(averages, out["adjusted"], out["weights"])
+        state = table["State"].iloc[at]
+        np.testing.assert_allclose(table["loo"].iloc[at],
+                                   results.loc[state, "poll"], atol=1e-10)
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas
+import pytest
+from sklearn import cluster, neighbors
+from statsmodels.formula.api import wls
+
+import model_registry
+from model_registry import ModelRegistry, NeighborsFit
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    frame = pandas.DataFrame(dict(PVI=rng.normal(size=60),
+                                  median_income=rng.uniform(3e4, 7e4, 60),
+                                  group=rng.integers(0, 4, 60)))
+    frame["y"] = (1 + 2 * frame["PVI"] + np.log(frame["median_income"]) +
+                  frame["group"] + rng.normal(size=60))
+    return frame
+
+
+def test_linear_fit_predicts_like_statsmodels(data):
+    formula = "y ~ PVI * np.log(median_income) + C(group)"
+    results = wls(formula, data=data, weights=np.ones(len(data))).fit()
+    artifact = model_registry.to_artifact(results)
+    np.testing.assert_allclose(artifact.predict(data), results.predict(data))
+
+
+def test_cluster_fit_predicts_like_kmeans(data):
+    X = data[["PVI", "median_income"]].values
+    X = X / X.std(0)
+    kmeans = cluster.KMeans(n_clusters=3, n_init=5, random_state=0).fit(X)
+    artifact = model_registry.to_artifact(kmeans)
+    np.testing.assert_array_equal(artifact.predict(X), kmeans.predict(X))
+
+
+def test_neighbors_fit_matches_sklearn(data):
+    X = data[["PVI", "median_income"]].values
+    X = X / X.std(0)
+    knn = neighbors.NearestNeighbors(n_neighbors=5).fit(X)
+    artifact = model_registry.to_artifact(knn, X, data.index)
+    distances, idx = knn.kneighbors(X[:10])
+    np.testing.assert_allclose(artifact.kneighbors(X[:10])[0], distances)
+    names, dist = artifact.neighborhood(3)
+    assert names == list(idx[3])
+    np.testing.assert_allclose(dist, distances[3])
+
+
+def test_neighbors_fit_needs_its_data(data):
+    X = data[["PVI"]].values
+    knn = neighbors.NearestNeighbors(n_neighbors=5).fit(X)
+    with pytest.raises(ValueError):
+        model_registry.to_artifact(knn)
+    with pytest.raises(ValueError):
+        model_registry.to_artifact(knn, X[:10])
+    with pytest.raises(ValueError):
+        NeighborsFit(X, 5).neighborhood(0)
+
+
+def test_registry_refits_on_new_inputs(data, tmp_path):
+    registry = ModelRegistry(str(tmp_path))
+    calls = []
+
+    def fit():
+        calls.append(1)
+        return wls("y ~ PVI", data=data, weights=np.ones(len(data))).fit()
+    first = registry.fit("m_model", fit, data)
+    again = registry.fit("m_model", fit, data)
+    assert len(calls) == 1
+    pandas.testing.assert_series_equal(first.params, again.params)
+    assert registry.load("m_model", model_registry.fingerprint(data))
+    changed = data.assign(y=data["y"] + 1)
+    registry.fit("m_model", fit, changed)
+    assert len(calls) == 2
+    with pytest.raises(KeyError):
+        registry.load("m_model", model_registry.fingerprint(data))
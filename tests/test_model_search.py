@@ -0,0 +1,65 @@
+import numpy as np
+import pandas
+import pytest
+from statsmodels.formula.api import ols
+
+import model_search
+
+FORMULA = "y ~ C(group) + x1 * x2 + np.log(x3)"
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(0)
+    frame = pandas.DataFrame(dict(group=rng.integers(0, 4, 120),
+                                  x1=rng.normal(size=120),
+                                  x2=rng.normal(size=120),
+                                  x3=rng.uniform(1, 10, 120)))
+    frame["y"] = (frame["group"] + frame["x1"] * (1 + frame["x2"]) +
+                  rng.normal(size=120))
+    return frame
+
+
+@pytest.fixture(scope="module")
+def table(data):
+    return model_search.search(FORMULA, data, folds=5, seed=1)
+
+
+def test_scores_match_statsmodels(data, table):
+    # 16 subsets without x1:x2, 4 with it and both of x1 and x2
+    assert len(table) == 20
+    for _, row in table.iterrows():
+        results = ols(row["formula"], data=data).fit()
+        np.testing.assert_allclose(row["rss"], results.ssr, rtol=1e-8)
+        np.testing.assert_allclose(row["aic"], results.aic, rtol=1e-8)
+        np.testing.assert_allclose(row["bic"], results.bic, rtol=1e-8)
+        if row["formula"] != "y ~ 1":
+            np.testing.assert_allclose(row["r2"], results.rsquared,
+                                       rtol=1e-8)
+        assert row["k"] == results.df_model + 1
+
+
+def test_cross_validation_matches_refits(data, table):
+    fold = np.random.default_rng(1).permutation(len(data)) % 5
+    for _, row in table.head(3).iterrows():
+        sse = 0.
+        for f in range(5):
+            train = data[fold != f]
+            results = ols(row["formula"], data=train).fit()
+            test = data[fold == f]
+            sse += ((test["y"] - results.predict(test))**2).sum()
+        np.testing.assert_allclose(row["cv_mse"], sse / len(data),
+                                   rtol=1e-8)
+
+
+def test_hierarchical_candidates(table):
+    for formula in table["formula"]:
+        terms = [t.strip() for t in formula.split("~")[1].split("+")]
+        if "x1:x2" in terms:
+            assert "x1" in terms and "x2" in terms
+
+
+def test_processes_match(data, table):
+    parallel = model_search.search(FORMULA, data, folds=5, seed=1, jobs=2,
+                                   chunk=3)
+    pandas.testing.assert_frame_equal(parallel, table)
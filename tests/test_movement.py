@@ -0,0 +1,58 @@
+import datetime
+
+import numpy as np
+import pytest
+
+import movement
+
+
+@pytest.fixture(scope="module")
+def polls():
+    return movement.load_state_polls()
+
+
+def _direct(polls, state, cycle, horizon):
+    """
+    The state average as of a day, from the polls up to it.
+    """
+    today = movement.elections[cycle] - datetime.timedelta(days=horizon)
+    known = polls[(polls["State"] == state) & (polls["cycle"] == cycle) &
+                  (polls["poll_date"] <= today)]
+    if not len(known):
+        return np.nan
+    days = (today - known["poll_date"]).dt.days.values
+    known = known.assign(w=.5**(days / 30.))
+    num = den = 0.
+    for _, group in known.groupby("pollster"):
+        average = (group["w"] * group["spread"]).sum() / group["w"].sum()
+        num += group["Weight"].iloc[0] * average
+        den += group["Weight"].iloc[0]
+    return num / den
+
+
+def test_every_horizon_matches_a_direct_average(polls):
+    horizons = [0, 7, 35, 90]
+    averages = movement.horizon_averages(polls, horizons)
+    for state in ["Ohio", "Florida", "Iowa", "Vermont"]:
+        for cycle in [2004, 2008]:
+            for horizon in horizons:
+                expected = _direct(polls, state, cycle, horizon)
+                got = averages.loc[(state, cycle, horizon), "poll"]
+                np.testing.assert_allclose(got, expected, rtol=1e-10)
+
+
+def test_panel_change_is_final_minus_horizon(polls):
+    panel = movement.movement_panel(polls, horizons=[35], features=False)
+    averages = movement.horizon_averages(polls, [0, 35])
+    final = averages.xs(0, level="horizon")["poll"]
+    row = panel.loc[("Ohio", 2008, 35)]
+    np.testing.assert_allclose(row["poll_change"],
+                               final.loc[("Ohio", 2008)] - row["poll_horizon"])
+    assert panel["updated"].all()
+    assert panel["poll_horizon"].notnull().all()
+
+
+def test_features_join(polls):
+    panel = movement.movement_panel(polls, horizons=[35])
+    assert panel["PVI"].notnull().all()
+    assert {"per_black", "poll_change"} <= set(panel.columns)
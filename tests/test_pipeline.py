@@ -0,0 +1,49 @@
+import numpy as np
+import pandas
+import pytest
+
+import pipeline
+
+
+def test_snapshot_ev(out):
+    assert out["ev"] == dict(obama=328, romney=210)
+    assert out["results"]["Votes"].sum() == 538
+
+
+@pytest.mark.parametrize("backend", ["thread", "process"])
+def test_parallel_run_is_identical(out, backend):
+    parallel = pipeline.run(jobs=2, backend=backend, labels=out["labels"],
+                            m_correction=out["m_correction"])
+    pandas.testing.assert_frame_equal(parallel["polls"], out["polls"])
+    pandas.testing.assert_series_equal(parallel["state_polls"],
+                                       out["state_polls"])
+    pandas.testing.assert_series_equal(parallel["trends"], out["trends"])
+    pandas.testing.assert_frame_equal(parallel["results"], out["results"])
+
+
+def test_pollster_averages_match_weighted_mean(out):
+    polls = out["polls"]
+    expected = polls.groupby(["state", "pollster"], observed=True)[
+                    ["time_weight", "MESS", "spread"]].apply(
+                        pipeline.weighted_mean)
+    expected.index = expected.index.set_levels(
+                        expected.index.levels[0].astype(str), level=0)
+    got = out["state_polls"].reindex(expected.index)
+    np.testing.assert_allclose(got.values, expected.values)
+
+
+def test_mess_matches_a_loop(out):
+    polls = pipeline.load_state_polls()
+    mess = pipeline.calculate_mess(polls)
+    expected = pandas.Series(np.nan, index=polls.index)
+    for _, group in polls.groupby(["state", "pollster"], sort=False,
+                                  observed=True):
+        total, previous = 0., None
+        for idx, row in group.iterrows():
+            total += row["sample"]
+            ess = pipeline.effective_sample(
+                        pipeline.average_error(total) + row["PIE"])
+            expected[idx] = ess if previous is None else ess - previous
+            previous = ess
+    ok = expected.notnull()
+    np.testing.assert_allclose(mess["MESS"][ok], expected[ok])
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas
+import pytest
+
+import poll_archive
+import poll_schema
+from poll_archive import PollArchive
+
+
+@pytest.fixture(scope="module")
+def polls():
+    return poll_schema.load_all_polls()
+
+
+@pytest.fixture
+def archive(tmp_path, polls):
+    archive = PollArchive(str(tmp_path / "archive"))
+    half = len(polls) // 2
+    archive.append(polls.iloc[:half])
+    archive.append(polls.iloc[half:])
+    return archive
+
+
+def _sorted(polls):
+    polls = polls.assign(state=polls["state"].astype(str),
+                         pollster=polls["pollster"].astype(str))
+    return polls.sort_values(["state", "pollster", "end_date", "spread",
+                              "sample"])
+
+
+def _known(polls, date, states):
+    known = polls[(polls["end_date"] <= pandas.Timestamp(date)) &
+                  polls["state"].astype(str).isin(states)]
+    return _sorted(known)
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_as_of_matches_filtering_the_table(archive, polls, compact):
+    if compact:
+        archive.compact()
+    states = ["OH", "FL", "PA"]
+    frame = archive.as_of_frame("2008-10-02", states=states)
+    expected = _known(polls, "2008-10-02", states)
+    frame = _sorted(frame)
+    assert len(frame) == len(expected)
+    np.testing.assert_array_equal(frame["spread"].values,
+                                  expected["spread"].values)
+    np.testing.assert_array_equal(frame["pollster"].values,
+                                  expected["pollster"].values)
+    np.testing.assert_array_equal(frame["end_date"].values,
+                                  expected["end_date"].values)
+
+
+def test_encoded_codes_round_trip(archive, polls):
+    data = archive.as_of(pandas.Timestamp.max)
+    assert len(data["state"]) == len(polls)
+    states = np.asarray(archive.meta["states"])[data["state"]]
+    assert sorted(states) == sorted(polls["state"].astype(str))
+    # a new pollster gets the next code and the old codes stay
+    before = list(archive.meta["pollsters"])
+    extra = polls.head(2).copy()
+    extra["pollster"] = ["Newcomer", extra["pollster"].iloc[1]]
+    codes = archive._encode(extra["pollster"].astype(str).values,
+                            "pollster")
+    assert archive.meta["pollsters"][:len(before)] == before
+    assert list(codes) == [len(before), before.index(extra["pollster"]
+                                                     .iloc[1])]
+
+
+def test_crash_while_writing_a_segment(archive, polls, monkeypatch):
+    nrows = len(archive)
+    save = np.save
+
+    def crash(path, values):
+        if path.endswith("spread.npy"):
+            raise OSError("disk full")
+        save(path, values)
+    monkeypatch.setattr(poll_archive.np, "save", crash)
+    with pytest.raises(OSError):
+        archive.append(polls.head(10))
+    monkeypatch.setattr(poll_archive.np, "save", save)
+
+    reopened = PollArchive(archive.path)
+    assert len(reopened) == nrows
+    reopened.append(polls.head(10))
+    assert len(PollArchive(archive.path)) == nrows + 10
+    reopened.compact()
+    assert len(PollArchive(archive.path)) == nrows + 10
@@ -0,0 +1,108 @@
+import datetime
+
+import numpy as np
+import pandas
+import pytest
+
+import poll_schema
+
+
+def _loop_dates(raw, groups, today=None, year0=2012):
+    """
+    silver_model.py's year inference, one poll at a time.
+    """
+    start = pandas.Series(pandas.NaT, index=raw.index)
+    end = pandas.Series(pandas.NaT, index=raw.index)
+    for _, date in raw.groupby(groups, sort=False)["Date"]:
+        year = year0
+        months = [int(d.split("/")[0]) for d in date]
+        changes = np.r_[False, np.diff(months) > 0]
+        for j, (idx, dt) in enumerate(date.items()):
+            dt1, dt2 = [d.strip() for d in dt.split(" - ")]
+            year -= changes[j]
+            if today is not None and year == year0 and (
+                    int(dt1.split("/")[0]) > today.month and
+                    int(dt1.split("/")[1]) > today.day):
+                year -= 1
+            start[idx] = datetime.datetime.strptime(
+                                "%s/%d" % (dt1, year), "%m/%d/%Y")
+            end[idx] = datetime.datetime.strptime(
+                                "%s/%d" % (dt2, year), "%m/%d/%Y")
+    return start, end
+
+
+def _raw(path):
+    raw = pandas.read_csv(path, sep="\t", dtype=str, keep_default_na=False)
+    raw = raw[~raw["Poll"].str.strip().isin(poll_schema.NOT_POLLS)]
+    return raw.reset_index(drop=True)
+
+
+def test_state_years_match_the_loop():
+    raw = _raw("data/2012_poll_data_states.csv")
+    polls = poll_schema.load_polls("data/2012_poll_data_states.csv",
+                                   "2012_state")
+    start, end = _loop_dates(raw, ["State", "Poll"],
+                             today=poll_schema.AS_OF[2012])
+    np.testing.assert_array_equal(polls["start_date"].values,
+                                  start.values.astype("datetime64[ns]"))
+    np.testing.assert_array_equal(polls["end_date"].values,
+                                  end.values.astype("datetime64[ns]"))
+
+
+def test_national_years_match_the_loop():
+    raw = _raw("data/2012_poll_data.csv")
+    polls = poll_schema.load_polls("data/2012_poll_data.csv",
+                                   "2012_national")
+    start, _ = _loop_dates(raw, ["Poll"])
+    np.testing.assert_array_equal(polls["start_date"].values,
+                                  start.values.astype("datetime64[ns]"))
+    assert (polls["state"] == "USA").all()
+
+
+def test_poll_date_is_the_median_day():
+    polls = poll_schema.load_polls("data/2012_poll_data_states.csv",
+                                   "2012_state")
+    expected = []
+    for start, end in zip(polls["start_date"], polls["end_date"]):
+        dates = pandas.date_range(start, end)
+        expected.append(dates[int(np.median(range(len(dates))) + .5)])
+    np.testing.assert_array_equal(polls["poll_date"].values,
+                                  pandas.DatetimeIndex(expected).values)
+
+
+def test_normalize_fields():
+    raw = pandas.DataFrame({"Date" : ["10/1 - 10/3", "9/28 - 9/30",
+                                      "10/2 - 10/2"],
+                            "MoE" : ["4.0", "--", "3.5"],
+                            "Obama (D)" : ["50", "48", "47.5"],
+                            "Romney (R)" : ["45", "47", "46"],
+                            "Poll" : ["A Poll", "A Poll", "RCP Average"],
+                            "Sample" : ["600 LV", "--", "1000 RV"],
+                            "State" : ["OH", "OH", "OH"]})
+    polls = poll_schema.normalize_polls(raw, "2012_state",
+                                        pollster_map={"A Poll" : "APoll"})
+    assert list(polls.columns) == poll_schema.COLUMNS
+    assert len(polls) == 2
+    assert list(polls["pollster"]) == ["APoll", "APoll"]
+    np.testing.assert_array_equal(polls["spread"], [5., 1.])
+    np.testing.assert_array_equal(polls["sample"], [600., np.nan])
+    assert polls["population"].iloc[0] == "LV"
+    assert pandas.isnull(polls["population"].iloc[1])
+    np.testing.assert_array_equal(polls["moe"], [4., np.nan])
+
+
+def test_2004_undated_day():
+    raw = pandas.DataFrame(dict(State=["AL"], Kerry=["39"], Bush=["57"],
+                                Date=["Nov 00"], Pollster=["SurveyUSA"]))
+    polls = poll_schema.normalize_polls(raw, "2004_state")
+    assert polls["poll_date"].iloc[0] == pandas.Timestamp("2004-11-01")
+
+
+def test_load_all_polls():
+    polls = poll_schema.load_all_polls()
+    assert sorted(polls["cycle"].unique()) == [2004, 2008, 2012]
+    sizes = [len(poll_schema.load_polls(path, schema))
+             for path, schema in poll_schema.SOURCES]
+    assert len(polls) == sum(sizes)
+    assert polls["state"].dtype == "category"
+    assert "USA" in polls["state"].cat.categories
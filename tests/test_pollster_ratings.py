@@ -0,0 +1,88 @@
+import numpy as np
+import pandas
+import pytest
+
+import pipeline
+import pollster_ratings
+
+
+@pytest.fixture
+def errors():
+    rng = np.random.default_rng(0)
+    n = 300
+    frame = pandas.DataFrame(dict(
+                cycle=rng.choice([2004, 2008], n),
+                state=rng.choice(["OH", "FL", "PA", "IA"], n),
+                pollster=rng.choice(["A", "B", "C", "D", "E"], n),
+                sample=np.where(rng.random(n) < .2, np.nan,
+                                rng.integers(400, 1500, n))))
+    scale = frame["pollster"].map(dict(A=1., B=2., C=3., D=1.5, E=4.))
+    frame["error"] = rng.normal(0, 1, n) * scale.values
+    return frame
+
+
+def _rate_loop(errors, prior_polls=10., sample=600.):
+    """
+    The ratings one race and one pollster at a time.
+    """
+    errors = errors.copy()
+    errors["sq"] = errors["error"]**2
+    overall = errors["sq"].mean()
+    for _, race in errors.groupby(["cycle", "state"]):
+        errors.loc[race.index, "sq"] -= race["sq"].mean() - overall
+    n = errors["sample"].fillna(sample)
+    errors["excess"] = errors["sq"] - pipeline.average_error(n)**2
+    raw = {}
+    npolls = {}
+    for name, group in errors.groupby("pollster"):
+        raw[name] = max(group["excess"].mean(), 0.)
+        npolls[name] = len(group)
+    prior = sum(npolls[p] * raw[p] for p in raw) / sum(npolls.values())
+    base = pipeline.average_error(sample)
+    mean_ess = pipeline.effective_sample(base + np.sqrt(prior))
+    rows = {}
+    for name in sorted(raw):
+        pie = np.sqrt((npolls[name] * raw[name] + prior_polls * prior) /
+                      (npolls[name] + prior_polls))
+        rows[name] = dict(PIE=pie, Weight=pipeline.effective_sample(
+                                                    base + pie) / mean_ess)
+    return pandas.DataFrame(rows).T
+
+
+def test_rate_matches_a_loop(errors):
+    ratings = pollster_ratings.rate(errors)
+    expected = _rate_loop(errors)
+    np.testing.assert_allclose(ratings["PIE"], expected["PIE"])
+    np.testing.assert_allclose(ratings["Weight"], expected["Weight"])
+    # the noisier the pollster, the less weight
+    assert ratings["Weight"].idxmin() == "E"
+    assert ratings.loc["A", "Weight"] > ratings.loc["C", "Weight"]
+
+
+def test_poll_errors_window():
+    polls = pandas.DataFrame(dict(
+                cycle=[2008, 2008, 2008], state=["OH", "OH", "FL"],
+                pollster=["A", "B", "A"], spread=[4., 1., -2.],
+                poll_date=pandas.to_datetime(["2008-11-01", "2008-09-01",
+                                              "2008-10-30"])))
+    results = pandas.DataFrame(dict(cycle=[2008], state=["OH"], dem=[51.5],
+                                    rep=[46.9]))
+    errors = pollster_ratings.poll_errors(polls, results)
+    assert list(errors["pollster"]) == ["A"]
+    np.testing.assert_allclose(errors["error"], (4. - 4.6) / 2)
+
+
+def test_national_results():
+    national = pollster_ratings.national_results()
+    assert list(national["state"]) == ["USA"]
+    assert national["cycle"].iloc[0] == 2004
+    assert national["rep"].iloc[0] > national["dem"].iloc[0]
+
+
+def test_weights_file_round_trip(errors, tmp_path):
+    ratings = pollster_ratings.rate(errors)
+    path = str(tmp_path / "weights.csv")
+    pollster_ratings.write_weights(ratings, path)
+    weights = pipeline.load_weights(path)
+    assert list(weights.columns) == ["Pollster", "Weight", "PIE"]
+    np.testing.assert_allclose(weights["PIE"], ratings["PIE"].round(2))
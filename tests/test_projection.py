@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from scipy import stats
+
+import projection
+
+
+@pytest.fixture(scope="module")
+def proj(out):
+    return projection.project(out["results"], out["m_correction"],
+                              out["labels"], nsims=20000, chunk=3000,
+                              seed=0)
+
+
+def test_win_prob_matches_the_random_walk(out, proj):
+    results = out["results"]
+    margins = projection.starting_margins(results).values
+    vol = projection.state_volatility(results.index, out["m_correction"])
+    step_sd = np.sqrt(.35**2 + .25**2 + .4**2)
+    days = np.arange(1, len(proj["dates"]) + 1)[:, None]
+    # a state with no time sensitivity never moves
+    with np.errstate(divide="ignore"):
+        expected = stats.norm.cdf(margins / (vol * step_sd *
+                                             np.sqrt(days)))
+    np.testing.assert_allclose(proj["win_prob"].values, expected, atol=.015)
+
+
+def test_ev_summaries_are_consistent(out, proj):
+    votes = out["results"]["Votes"].values
+    np.testing.assert_allclose(proj["ev_mean"].values,
+                               np.dot(proj["win_prob"].values, votes))
+    np.testing.assert_allclose(proj["ev_distribution"].sum(axis=1), 1.)
+    quantiles = proj["ev_quantiles"].values
+    assert (np.diff(quantiles, axis=1) >= 0).all()
+    # on the first day the snapshot barely moves
+    assert abs(proj["ev_mean"].iloc[0] - out["ev"]["obama"]) < 10
+
+
+def test_margin_fan_median_is_today(out, proj):
+    np.testing.assert_allclose(
+        proj["margin_fan"][.5].values[-1],
+        projection.starting_margins(out["results"]).values)
+    assert (proj["margin_fan"][.95] >= proj["margin_fan"][.05]).all().all()
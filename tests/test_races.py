@@ -0,0 +1,51 @@
+import numpy as np
+import pandas
+import pytest
+from scipy import stats
+
+import pipeline
+import races
+
+
+def test_race_averages_match_the_pipeline(out):
+    polls = races.from_state_polls(pipeline.load_state_polls())
+    averages = races.race_averages(polls)
+    # the pipeline's snapshot without a national trend
+    no_trend = pandas.Series([], dtype=float,
+                             index=pandas.Index([], name="State"))
+    results = pipeline.snapshot(out["state_polls"], no_trend, out["weights"])
+    state = averages.index.str.replace("2012-PRES-", "")
+    expected = results["poll"].reindex(state.map(
+                    pipeline.states_abbrev_dict))
+    np.testing.assert_allclose(averages["margin"].values, expected.values,
+                               rtol=1e-10)
+    assert averages["npolls"].sum() == len(polls)
+
+
+def test_seat_distribution():
+    table = pandas.DataFrame(dict(office=["SEN"] * 3 + ["GOV"] * 2,
+                                  margin=[3., -1., 0., 10., -4.],
+                                  sd=[3., 3., 3., 5., 2.]),
+                             index=pandas.Index(list("abcde"), name="race"))
+    sims = races.seat_distribution(table, national_sd=0., nsims=40000,
+                                   held={"SEN" : 30}, seed=0)
+    np.testing.assert_allclose(sims["win_prob"],
+                               stats.norm.cdf(table["margin"] / table["sd"]),
+                               atol=.01)
+    np.testing.assert_allclose(sims["seats"].sum(axis=1), 1.)
+    sen = sims["win_prob"][table["office"] == "SEN"].sum()
+    np.testing.assert_allclose(sims["expected_seats"]["SEN"], 30 + sen)
+    assert sims["seats"].loc["SEN", :29].sum() == 0
+
+
+def test_run_with_unpolled_races(out):
+    polls = races.from_state_polls(pipeline.load_state_polls())
+    table = pandas.DataFrame(dict(race=["2012-PRES-OH", "2012-SEN-XX"],
+                                  office=["PRES", "SEN"],
+                                  prior=[0., -5.]))
+    result = races.run(polls, table, nsims=2000, seed=0)
+    margins = result["margins"]
+    assert margins.loc["2012-PRES-OH", "polled"]
+    assert not margins.loc["2012-SEN-XX", "polled"]
+    assert margins.loc["2012-SEN-XX", "margin"] == -5.
+    assert margins.loc["2012-SEN-XX", "sd"] == 10.
@@ -0,0 +1,67 @@
+import itertools
+
+import numpy as np
+import pandas
+import pytest
+from scipy import integrate, stats
+
+import rare_events
+
+
+@pytest.fixture
+def small():
+    return pandas.DataFrame(dict(poll=[1., -2., 4., .5],
+                                 Votes=[10, 20, 15, 5],
+                                 obama=[1, 0, 1, 1], romney=[0, 1, 0, 0]),
+                            index=pandas.Index(list("ABCD"), name="State"))
+
+
+def _exact(results, event, national_sd, state_sd):
+    """
+    P(event) by quadrature over the national swing, every state's win or
+    loss enumerated.
+    """
+    mu = results["poll"].values
+    votes = results["Votes"].values
+
+    def integrand(z):
+        p = stats.norm.cdf((mu + national_sd * z) / state_sd)
+        total = 0.
+        for combo in itertools.product([0, 1], repeat=len(mu)):
+            combo = np.array(combo)
+            if event(np.dot(combo, votes)):
+                total += np.prod(np.where(combo, p, 1 - p))
+        return total * stats.norm.pdf(z)
+    return integrate.quad(integrand, -10, 10, limit=200)[0]
+
+
+@pytest.mark.parametrize("event", [rare_events.at_least(45),
+                                   rare_events.at_most(10)])
+def test_estimate_matches_quadrature(small, event):
+    exact = _exact(small, event, 3., 3.)
+    # stratifying on every state leaves only the swing to sample
+    est = rare_events.estimate(small, event, tossups=list("ABCD"),
+                               nsims=4000, seed=0)
+    assert abs(est["estimate"] - exact) < 4 * est["se"] + 1e-12
+    # and on some, with the rest sampled
+    est = rare_events.estimate(small, event, tossups=["A", "B"],
+                               nsims=20000, seed=1)
+    assert abs(est["estimate"] - exact) < 4 * est["se"]
+
+
+def test_estimate_matches_brute_force(out):
+    event = rare_events.at_least(350)
+    est = rare_events.estimate(out["results"], event, seed=0)
+    brute = rare_events.brute_force(out["results"], event, nsims=200000,
+                                    seed=0)
+    se = np.sqrt(est["se"]**2 + brute["se"]**2)
+    assert abs(est["estimate"] - brute["estimate"]) < 4 * se
+    # worth more than as many plain draws
+    assert est["brute_force_equivalent"] > est["nsims"]
+    assert est["ci"][0] <= est["estimate"] <= est["ci"][1]
+
+
+def test_tie_is_rare_but_estimated(out):
+    est = rare_events.estimate(out["results"], rare_events.tie, seed=0)
+    assert 0 < est["estimate"] < .05
+    assert est["brute_force_equivalent"] > est["nsims"]
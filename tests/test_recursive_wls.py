@@ -0,0 +1,62 @@
+import datetime
+
+import numpy as np
+import pandas
+import pytest
+from statsmodels.formula.api import wls
+
+import pipeline
+from recursive_wls import RecursiveWLS
+
+
+@pytest.fixture(scope="module")
+def data(out):
+    return pipeline.m_regression_data(out["polls"], out["demo_data"])
+
+
+def _refit(data, today):
+    weights = pipeline.exp_decay((today - data["poll_date"]).dt.days.values)
+    return wls(pipeline.M_FORMULA, data=data, weights=weights).fit()
+
+
+def test_batch_fit_matches_statsmodels(out, data):
+    model = RecursiveWLS.from_frame(pipeline.M_FORMULA, data)
+    results = _refit(data, pipeline.today)
+    np.testing.assert_allclose(model.params, results.params, rtol=1e-8)
+    np.testing.assert_allclose(model.bse, results.bse, rtol=1e-6)
+    np.testing.assert_allclose(model.ssr, results.ssr, rtol=1e-8)
+    pandas.testing.assert_series_equal(model.m_correction(out["demo_data"]),
+                                       out["m_correction"], rtol=1e-8)
+
+
+def test_daily_updates_match_a_refit(data):
+    data = data[data["poll_date"] <= pipeline.today]
+    start = pipeline.today - datetime.timedelta(days=14)
+    early = data[data["poll_date"] <= start]
+    model = RecursiveWLS.from_frame(pipeline.M_FORMULA, early, today=start)
+    day = start
+    for _ in range(14):
+        day += datetime.timedelta(days=1)
+        model.advance(1)
+        new = data[data["poll_date"] == day]
+        if len(new):
+            model.add_frame(new)
+    assert model.today == pandas.Timestamp(pipeline.today)
+    assert model.nobs == len(data)
+    results = _refit(data, pipeline.today)
+    np.testing.assert_allclose(model.params, results.params, rtol=1e-6)
+    np.testing.assert_allclose(model.refresh().params, results.params,
+                               rtol=1e-8)
+
+
+def test_advance_to_a_date(data):
+    model = RecursiveWLS.from_frame(pipeline.M_FORMULA, data)
+    model.advance(to=pipeline.election)
+    results = _refit(data, pipeline.election)
+    np.testing.assert_allclose(model.params, results.params, rtol=1e-6)
+
+
+def test_too_few_rows(data):
+    model = RecursiveWLS.from_frame(pipeline.M_FORMULA, data.head(3))
+    with pytest.raises(ValueError):
+        model.params
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+import influence
+import pipeline
+import scenarios
+
+
+def test_baseline_is_the_snapshot(out):
+    table = scenarios.evaluate(out["polls"], out["results"], out["adjusted"])
+    np.testing.assert_allclose(table["margins"].loc["baseline"].values,
+                               out["results"]["poll"].values, atol=1e-10)
+    assert table["ev"].loc["baseline"].to_dict() == out["ev"]
+
+
+def test_exclude_pollster_matches_leave_one_out(out):
+    loo = influence.leave_one_pollster_out(out["polls"], out["results"],
+                                           out["adjusted"])
+    names = ["Rasmussen", "SurveyUSA"]
+    table = scenarios.evaluate(out["polls"], out["results"], out["adjusted"],
+                               [dict(name=name, exclude_pollsters=[name])
+                                for name in names])
+    for name in names:
+        np.testing.assert_allclose(table["margins"].loc[name].values,
+                                   loo["poll"].loc[name].values, atol=1e-10)
+        assert (table["ev"].loc[name].values ==
+                loo["ev"].loc[name, ["obama", "romney"]].values).all()
+
+
+def test_state_left_without_polls_is_nan(out):
+    table = scenarios.evaluate(out["polls"], out["results"], out["adjusted"],
+                               [dict(name="no_ohio", exclude_states=["OH"])])
+    assert np.isnan(table["margins"].loc["no_ohio", "Ohio"])
+
+
+def test_half_life_matches_rerun(out):
+    polls = out["polls"].drop(columns=["ESS", "MESS", "time_weight"])
+    _, averages = pipeline.state_averages(polls, half_life=21)
+    results = pipeline.snapshot(averages, out["adjusted"], out["weights"])
+    table = scenarios.evaluate(out["polls"], out["results"], out["adjusted"],
+                               [dict(name="hl", half_life=21)])
+    np.testing.assert_allclose(table["margins"].loc["hl"].values,
+                               results["poll"].values, atol=1e-10)
+
+
+@pytest.mark.parametrize("scenario", [
+    dict(shift=[dict(state="XX", points=1)]),
+    dict(exclude_states=["Atlantis"]),
+    dict(shift=[dict(pollster="Rasmusen", points=1)]),
+    dict(weights={"Rasmusen" : 1.}),
+    dict(exclude_pollsters=["Rasmusen"])])
+def test_unknown_names_raise(out, scenario):
+    with pytest.raises(KeyError):
+        scenarios.evaluate(out["polls"], out["results"], out["adjusted"],
+                           [scenario])
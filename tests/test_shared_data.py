@@ -0,0 +1,63 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas
+import pytest
+
+import pipeline
+import shared_data
+
+
+@pytest.fixture(scope="module")
+def polls():
+    return pipeline.load_state_polls()
+
+
+def _state_mean(args):
+    handle, state = args
+    data = shared_data.attach(handle, ["State", "spread"])
+    code = handle.categories["State"].index(state)
+    return float(data["spread"][data["State"] == code].mean())
+
+
+@pytest.mark.parametrize("backend", ["shm", "file"])
+def test_round_trip(polls, backend, tmp_path):
+    path = str(tmp_path / "polls.bin") if backend == "file" else None
+    with shared_data.publish(polls, backend=backend, path=path) as shared:
+        frame = shared_data.attach_frame(shared.handle)
+        for col in ["spread", "sample", "Weight"]:
+            np.testing.assert_array_equal(frame[col].values,
+                                          polls[col].values)
+        np.testing.assert_array_equal(frame["poll_date"].values,
+                                      polls["poll_date"].values)
+        for col in ["state", "pollster", "State", "population"]:
+            np.testing.assert_array_equal(
+                frame[col].astype(object).values,
+                polls[col].astype(object).values)
+        data = shared_data.attach(shared.handle)
+        assert not data["spread"].flags.writeable
+        shared_data.detach(shared.handle)
+
+
+def test_workers_see_the_published_data(polls):
+    states = ["Ohio", "Florida", "Virginia"]
+    expected = [polls.loc[polls["State"] == state, "spread"].mean()
+                for state in states]
+    with shared_data.publish(polls) as shared:
+        with ProcessPoolExecutor(2) as pool:
+            means = list(pool.map(_state_mean, [(shared.handle, state)
+                                                for state in states]))
+    np.testing.assert_allclose(means, expected)
+
+
+def test_index_and_arrays():
+    frame = pandas.DataFrame(dict(x=np.arange(5.)),
+                             index=pandas.Index(list("abcde"), name="k"))
+    with shared_data.publish(frame) as shared:
+        back = shared_data.attach_frame(shared.handle)
+        pandas.testing.assert_frame_equal(back, frame)
+        shared_data.detach(shared.handle)
+    with shared_data.publish(dict(m=np.eye(3))) as shared:
+        np.testing.assert_array_equal(shared_data.attach(shared.handle)["m"],
+                                      np.eye(3))
+        shared_data.detach(shared.handle)
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas
+import pytest
+
+import state_errors
+
+
+@pytest.fixture(scope="module")
+def errors(out):
+    return state_errors.state_errors(out["demo_data"], out["labels"])
+
+
+def test_sd_is_the_diagonal_of_the_covariance(errors):
+    cov = errors.covariance()
+    np.testing.assert_allclose(errors.sd().values, np.sqrt(np.diag(cov)))
+    draws = errors.sample(100000, seed=0)
+    np.testing.assert_allclose(draws.std(0), errors.sd().values, rtol=.02)
+
+
+@pytest.mark.parametrize("noise", [0., .5])
+def test_condition_matches_dense_gaussian_conditioning(errors, noise):
+    observed = pandas.Series({"Ohio" : -2.5, "Florida" : -1.,
+                              "Iowa" : .5})
+    rest = errors.condition(observed, noise=noise)
+    cov = errors.covariance().values
+    at = errors.states.get_indexer(observed.index)
+    other = errors.states.get_indexer(rest.states)
+    gain = np.linalg.solve(cov[np.ix_(at, at)] + noise * np.eye(len(at)),
+                           cov[np.ix_(at, other)]).T
+    np.testing.assert_allclose(rest.mean.values, np.dot(gain,
+                                                        observed.values))
+    expected = cov[np.ix_(other, other)] - np.dot(gain, cov[np.ix_(at,
+                                                                   other)])
+    np.testing.assert_allclose(rest.covariance().values, expected,
+                               atol=1e-10)
+
+
+def test_unknown_state(errors):
+    with pytest.raises(KeyError):
+        errors.condition({"Atlantis" : 1.})
+
+
+def test_cache_is_bounded(out, monkeypatch):
+    monkeypatch.setattr(state_errors, "CACHE_SIZE", 2)
+    first = state_errors.state_errors(out["demo_data"], out["labels"],
+                                      national_sd=3.)
+    assert state_errors.state_errors(out["demo_data"], out["labels"],
+                                     national_sd=3.) is first
+    for sd in (4., 5.):
+        state_errors.state_errors(out["demo_data"], out["labels"],
+                                  national_sd=sd)
+    assert len(state_errors._cache) == 2
+    again = state_errors.state_errors(out["demo_data"], out["labels"],
+                                      national_sd=3.)
+    assert again is not first
+    pandas.testing.assert_frame_equal(again.loadings, first.loadings)
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+import pipeline
+import undecided
+
+
+@pytest.fixture(scope="module")
+def polls():
+    return pipeline.load_state_polls()
+
+
+@pytest.mark.parametrize("kappa", [10., 50.])
+def test_draws_match_reported_mean_and_sd(polls, kappa):
+    alloc = undecided.allocate(polls, rule="incumbent", kappa=kappa)
+    draws = undecided.draw_spreads(alloc, ndraws=20000, seed=0)
+    assert draws.shape == (20000, len(polls))
+    np.testing.assert_allclose(draws.mean(0), alloc["adj_spread"].values,
+                               atol=.1)
+    np.testing.assert_allclose(draws.std(0), alloc["adj_spread_sd"].values,
+                               rtol=.05, atol=1e-8)
+
+
+def test_polls_in_a_state_move_together(polls):
+    alloc = undecided.allocate(polls, rule="even")
+    draws = undecided.draw_spreads(alloc, ndraws=500, seed=0)
+    ohio = np.flatnonzero(((alloc["State"] == "Ohio") &
+                           (alloc["undecided"] > 0)).values)[:2]
+    assert np.corrcoef(draws[:, ohio].T)[0, 1] > .99
+
+
+def test_allocation_adds_up(polls):
+    alloc = undecided.allocate(polls)
+    np.testing.assert_allclose(alloc["adj_dem"] + alloc["adj_rep"],
+                               np.maximum(alloc["dem"] + alloc["rep"], 100))
+
+
+def test_missing_state_raises(polls):
+    alloc = undecided.allocate(polls)
+    alloc.loc[alloc.index[0], "State"] = np.nan
+    with pytest.raises(ValueError):
+        undecided.draw_spreads(alloc)
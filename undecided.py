@@ -0,0 +1,140 @@
+"""
+Divide undecided voters probabilistically.
+
+The undecided share of every poll is 100 - dem - rep. A rule gives, for
+every state, the share of its undecideds expected to break to the
+Democrat, and that share is uncertain: it's treated as a Beta with the
+rule's mean and a concentration `kappa`. The allocation therefore comes
+out as a mean and a standard deviation of the adjusted spread for every
+poll, and `draw_spreads` samples from it with one draw per state so the
+uncertainty can be carried into the snapshot or a projection.
+
+Rules:
+
+    "proportional" : undecideds split like the decided voters in the poll
+    "even"         : half and half
+    "incumbent"    : undecideds break against the incumbent, who gets
+                     `incumbent_share` of them
+    "regression"   : undecideds split like demographically similar voters,
+                     from a regression of the two-party share on demo_data
+
+Usage:
+
+    polls = pipeline.load_state_polls()
+    alloc = allocate(polls, rule="incumbent")
+    alloc[["undecided", "dem_split", "adj_spread", "adj_spread_sd"]]
+"""
+import numpy as np
+import pandas
+
+RULES = ["proportional", "even", "incumbent", "regression"]
+REGRESSORS = ["PVI", "no_party", "per_black", "per_hisp", "educ_coll"]
+
+
+def undecided_share(polls):
+    """
+    100 - dem - rep, floored at zero, for every poll.
+    """
+    return np.maximum(100. - polls["dem"].values - polls["rep"].values, 0.)
+
+
+def regression_split(polls, demo_data, regressors=REGRESSORS):
+    """
+    The two-party Democratic share of each state predicted from
+    demographics, fit by least squares on every poll.
+    """
+    state = polls["State"].values
+    share = (polls["dem"] / (polls["dem"] + polls["rep"])).values
+    exog = demo_data[regressors].reindex(state).values
+    ok = np.isfinite(share) & np.isfinite(exog).all(1)
+    X = np.column_stack((np.ones(ok.sum()), exog[ok]))
+    beta = np.linalg.lstsq(X, share[ok], rcond=None)[0]
+    predict = demo_data[regressors].values
+    fitted = beta[0] + np.dot(predict, beta[1:])
+    return pandas.Series(np.clip(fitted, .01, .99), index=demo_data.index)
+
+
+def state_split(polls, rule="proportional", incumbent="dem",
+                incumbent_share=.4, demo_data=None):
+    """
+    The mean Democratic share of the undecideds for each poll's state.
+    """
+    if rule == "proportional":
+        decided = (polls["dem"] + polls["rep"]).values
+        with np.errstate(invalid="ignore", divide="ignore"):
+            split = np.where(decided > 0, polls["dem"].values / decided, .5)
+        return split
+    if rule == "even":
+        return np.repeat(.5, len(polls))
+    if rule == "incumbent":
+        share = incumbent_share if incumbent == "dem" else 1 - incumbent_share
+        return np.repeat(share, len(polls))
+    if rule == "regression":
+        if demo_data is None:
+            raise ValueError("The regression rule needs demo_data")
+        by_state = regression_split(polls, demo_data)
+        return by_state.reindex(polls["State"].values).fillna(.5).values
+    raise ValueError("rule must be one of %s" % ", ".join(RULES))
+
+
+def allocate(polls, rule="proportional", kappa=10., incumbent="dem",
+             incumbent_share=.4, demo_data=None):
+    """
+    Allocate the undecideds of every poll.
+
+    Parameters
+    ----------
+    polls : DataFrame
+        Poll table with dem, rep and State (full state name).
+    rule : str
+        One of RULES.
+    kappa : float
+        Concentration of the Beta on the split. Larger is more certain.
+    incumbent : str
+        "dem" or "rep", for the incumbent rule.
+    incumbent_share : float
+        Share of the undecideds going to the incumbent.
+
+    Returns
+    -------
+    The polls with undecided, dem_split (mean Democratic share of the
+    undecideds), adj_dem, adj_rep, adj_spread, adj_spread_sd and kappa
+    (for draw_spreads) added.
+    """
+    undecided = undecided_share(polls)
+    split = state_split(polls, rule, incumbent, incumbent_share, demo_data)
+    split_var = split * (1 - split) / (kappa + 1.)
+    polls = polls.copy()
+    polls["undecided"] = undecided
+    polls["dem_split"] = split
+    polls["adj_dem"] = polls["dem"].values + undecided * split
+    polls["adj_rep"] = polls["rep"].values + undecided * (1 - split)
+    polls["adj_spread"] = polls["adj_dem"] - polls["adj_rep"]
+    # spread moves 2 points for every point of split * undecided
+    polls["adj_spread_sd"] = 2 * undecided * np.sqrt(split_var)
+    polls["kappa"] = float(kappa)
+    return polls
+
+
+def draw_spreads(alloc, ndraws=1000, seed=None):
+    """
+    Sample adjusted spreads, ndraws x polls, from an `allocate` result
+    and with its kappa. The split is drawn once per state and draw, so
+    polls in the same state move together.
+    """
+    rng = np.random.default_rng(seed)
+    if alloc["State"].isnull().any():
+        raise ValueError("Polls without a State can't be drawn by state")
+    codes, states = pandas.factorize(alloc["State"])
+    npolls = np.bincount(codes)
+    # the mean split of a state's polls, as the Beta mean for that state
+    mean = np.bincount(codes, alloc["dem_split"].values) / npolls
+    mean = np.clip(mean, 1e-6, 1 - 1e-6)
+    kappa = np.bincount(codes, alloc["kappa"].values) / npolls
+    draws = rng.beta(mean * kappa, (1 - mean) * kappa,
+                     size=(ndraws, len(states)))
+    # keep each poll's own mean split, shift it by its state's draw
+    split = alloc["dem_split"].values + (draws - mean)[:, codes]
+    split = np.clip(split, 0, 1)
+    undecided = alloc["undecided"].values
+    return (alloc["spread"].values + undecided * (2 * split - 1))